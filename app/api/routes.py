@@ -1,22 +1,47 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Form, Body
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Form, Body, Request, Response
+from fastapi.responses import StreamingResponse
+from email.utils import format_datetime, parsedate_to_datetime
 from typing import Optional, List, Any, Literal
 import os
 import datetime
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 import json
-from app.functions.common.save_file import save_file
-from app.functions.alm.call_llm import calendar_llm, bill_llm, vcode_llm, vcode_llm_text
-from app.db.agenda import insert_event, delete_event, update_event, list_events
+from app.functions.common.save_file import save_file, FileTooLarge
+from app.functions.common import cas_store
+from app.functions.common.agenda import export_ics, cached_export_ics, iter_ics, merged_export_ics
+from app.functions.common import ics_cache
+from app.functions.common.agenda_import import import_events, iter_ics_events, check_tzid
+from app.db.agenda import _safe_table_name
+from app.functions.alm.call_llm import calendar_llm, vcode_llm, vcode_llm_text
+from app.functions.alm.call_llm import calendar_llm_sse, vcode_llm_sse, vcode_llm_text_sse
+from app.functions.alm import result_cache
+from app.functions.common import bill_jobs
+from app.db import aio_jobs
+from app.db.aio_agenda import insert_event, delete_event, update_event, list_events, list_events_in_window, list_events_page, EVENT_FIELDS
+from app.db.aio_agenda import sync_changes, SyncTokenExpired
+from app.db.paging import parse_fields, MAX_PAGE_SIZE
+from app.functions.common.recurrence import expand_rows, parse_time, AGENDA_MAX_EVENT_DAYS
+from app.functions.common.freebusy import busy_spans, merge_intervals, free_intervals, conflicts
 from app.core.config import UPLOAD_DIR
-from app.db.tools import query_bills, update_bill, insert_position
-from app.db import kv_tools
+from app.db.aio_tools import query_bills, query_bills_page, update_bill, insert_positions, BILL_FIELDS
+from app.functions.common import position_buffer
+from app.db.aio_bill_stats import bill_stats
+from app.db.aio_positions import records_within_radius, records_in_box, trajectory_points
+from app.functions.common.trajectory import simplify
+from app.db import aio_kv_tools as kv_tools
+from app.db.pool import pool_stats
+from app.db.aio_pool import aio_pool_stats
 import asyncio
 router = APIRouter()
 
+POSITION_BATCH_MAX = 5000
+TRAJECTORY_MAX_POINTS = 100000   # 单次轨迹查询最多读取的点数，超出要求缩小时间范围
 
-# 初始化上传目录
+
+# 初始化上传目录与（不公开的）对象库
 if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
+cas_store.ensure_store()
 
 
 
@@ -29,8 +54,8 @@ def save_upload_replace(body: update_icsBody):
             raise ValueError("名称为空")
         
         ics_text = export_ics(table_name=body.name, cal_name=body.name, tzid="Asia/Shanghai")
-        with open("cal.ics", "wb", encoding="utf-8", newline="") as f:
-            f.write(ics_text)
+        with open("cal.ics", "wb") as f:
+            f.write(ics_text.encode("utf-8"))
 
         return {"status":'ok'}
     except Exception as e:
@@ -40,6 +65,112 @@ def save_upload_replace(body: update_icsBody):
 
 
 
+def _not_modified(request: Request, etag: str, last_modified: datetime.datetime) -> bool:
+    """条件请求判断：优先 If-None-Match，其次 If-Modified-Since"""
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        tags = [t.strip().removeprefix("W/") for t in inm.split(",")]
+        return "*" in tags or etag in tags
+    ims = request.headers.get("if-modified-since")
+    if ims:
+        try:
+            return last_modified <= parsedate_to_datetime(ims)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+@router.get("/agenda/{table_name}/ics", description="订阅用 .ics（按表缓存，支持 ETag/Last-Modified 条件请求）")
+async def get_agenda_ics(
+    table_name: str,
+    request: Request,
+    cal_name: Optional[str] = None,
+    tzid: str = "Asia/Shanghai",
+    db_name: str = "agenda",
+    include_todos: bool = True,
+):
+    try:
+        art = await asyncio.to_thread(
+            cached_export_ics, table_name, cal_name or table_name, tzid, db_name, include_todos
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    headers = {
+        "ETag": art.etag,
+        "Last-Modified": format_datetime(art.last_modified, usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+    if _not_modified(request, art.etag, art.last_modified):
+        return Response(status_code=304, headers=headers)
+    return Response(content=art.body, media_type="text/calendar; charset=utf-8", headers=headers)
+
+
+# 合并订阅最多包含的表数
+AGENDA_MERGE_MAX_TABLES = 20
+
+
+@router.get(
+    "/agenda/merged.ics",
+    description="多表合并订阅：各表组件块分别缓存后拼接，可按 kinds/categories 过滤（支持 ETag/Last-Modified 条件请求）",
+)
+async def get_merged_agenda_ics(
+    request: Request,
+    tables: str = Query(..., description="日程表名，逗号分隔，如 dad,mom,kid"),
+    cal_name: str = "family",
+    tzid: str = "Asia/Shanghai",
+    db_name: str = "agenda",
+    kinds: Optional[str] = Query(None, description="只包含这些类型，逗号分隔：VEVENT,VTODO"),
+    categories: Optional[str] = Query(None, description="只包含带任一分类的条目，逗号分隔"),
+):
+    try:
+        names = list(dict.fromkeys(_safe_table_name(t.strip()) for t in tables.split(",") if t.strip()))
+        if not names or len(names) > AGENDA_MERGE_MAX_TABLES:
+            raise ValueError(f"tables 需要 1~{AGENDA_MERGE_MAX_TABLES} 张表")
+        kind_set = {k.strip().upper() for k in kinds.split(",") if k.strip()} if kinds else None
+        if kind_set and not kind_set <= {"VEVENT", "VTODO"}:
+            raise ValueError("kinds 只能是 VEVENT/VTODO")
+        category_set = {c.strip() for c in categories.split(",") if c.strip()} if categories else None
+        art = await asyncio.to_thread(
+            merged_export_ics, names, cal_name, tzid, db_name, kind_set, category_set
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    headers = {
+        "ETag": art.etag,
+        "Last-Modified": format_datetime(art.last_modified, usegmt=True),
+        "Cache-Control": "no-cache",
+    }
+    if _not_modified(request, art.etag, art.last_modified):
+        return Response(status_code=304, headers=headers)
+    return Response(content=art.body, media_type="text/calendar; charset=utf-8", headers=headers)
+
+
+@router.get("/agenda/{table_name}/ics/stream", description="流式导出 .ics（服务端游标逐行生成，适合超大日历）")
+def stream_agenda_ics(
+    table_name: str,
+    cal_name: Optional[str] = None,
+    tzid: str = "Asia/Shanghai",
+    db_name: str = "agenda",
+    include_todos: bool = True,
+):
+    try:
+        table_name = _safe_table_name(table_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return StreamingResponse(
+        iter_ics(table_name, cal_name or table_name, tzid, db_name, include_todos),
+        media_type="text/calendar; charset=utf-8",
+        headers={"Content-Disposition": f'inline; filename="{table_name}.ics"'},
+    )
+
+
 # 2) Pydantic body
 class AgendaEventCreateBody(BaseModel):
     uid: str
@@ -95,7 +226,8 @@ class AgendaEventUpdateBody(BaseModel):
 @router.post("/agenda/{table_name}/events", description="新增日程/待办（VEVENT/VTODO）")
 async def create_agenda_event(table_name: str, body: AgendaEventCreateBody, db_name: str = "agenda"):
     try:
-        new_id = await asyncio.to_thread(insert_event, table_name, body.model_dump(exclude_unset=True), db_name)
+        new_id = await insert_event(table_name, body.model_dump(exclude_unset=True), db_name)
+        ics_cache.invalidate(db_name, table_name)
         return {"id": new_id}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -103,11 +235,169 @@ async def create_agenda_event(table_name: str, body: AgendaEventCreateBody, db_n
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@router.get("/agenda/{table_name}/events", description="获取全部日程/待办（按 dtstart/due/created_at 排序）")
-async def get_agenda_events(table_name: str, db_name: str = "agenda"):
+@router.post(
+    "/agenda/{table_name}/events/batch",
+    description="批量新增/更新日程（JSON 数组），按 uid/kind/recurrence_id 匹配已有记录，返回逐条结果",
+)
+async def batch_agenda_events(
+    table_name: str,
+    body: List[Any] = Body(..., description="日程数组，每项字段同 POST /agenda/{table_name}/events"),
+    db_name: str = "agenda",
+):
     try:
-        rows = await asyncio.to_thread(list_events, table_name, db_name)
-        return rows
+        _safe_table_name(table_name)
+        return await import_events(table_name, body, db_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.post(
+    "/agenda/{table_name}/import",
+    description="批量导入：上传 .ics（流式解析）或 JSON 数组文件，按 uid/kind/recurrence_id upsert，返回逐条结果",
+)
+async def import_agenda(
+    table_name: str,
+    file: UploadFile = File(...),
+    tzid: str = Form("Asia/Shanghai", description="导入后统一换算到的本地时区"),
+    db_name: str = "agenda",
+):
+    try:
+        _safe_table_name(table_name)
+        check_tzid(tzid)
+        is_json = (file.filename or "").lower().endswith(".json") or file.content_type == "application/json"
+        if is_json:
+            items = json.loads(await file.read())
+            if not isinstance(items, list):
+                raise ValueError("JSON 文件必须是数组")
+            return await import_events(table_name, items, db_name)
+        # UploadFile 已落到临时文件，逐行读取，每批在线程里解析
+        return await import_events(table_name, iter_ics_events(file.file, tzid), db_name, blocking=True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        await file.close()
+
+
+def _parse_window(start: str | None, end: str | None) -> tuple[datetime.datetime, datetime.datetime]:
+    win_start, win_end = parse_time(start), parse_time(end)
+    if win_start is None or win_end is None or win_end <= win_start:
+        raise ValueError("start/end 必须同时提供且 end 晚于 start")
+    return win_start, win_end
+
+
+async def _window_instances(table_name: str, win_start, win_end, tzid: str, db_name: str) -> list[dict]:
+    """窗口内的实例（重复事件已展开）；tzid 未知时抛 ValueError"""
+    check_tzid(tzid)
+    rows = await list_events_in_window(
+        table_name, win_start, win_end, datetime.timedelta(days=AGENDA_MAX_EVENT_DAYS), db_name
+    )
+    return expand_rows(rows, win_start, win_end, tzid)
+
+
+@router.get(
+    "/agenda/{table_name}/events",
+    description="获取日程/待办（按 dtstart/due/created_at 排序）；传 start/end 时只返回窗口内的实例，重复事件在服务端展开（此时不支持 limit/cursor）",
+)
+async def get_agenda_events(
+    table_name: str,
+    db_name: str = "agenda",
+    start: Optional[str] = Query(None, description="窗口开始，如 2025-01-01 或 2025-01-01 00:00:00"),
+    end: Optional[str] = Query(None, description="窗口结束（不含）"),
+    tzid: str = "Asia/Shanghai",
+    limit: Optional[int] = Query(None, description="分页大小；传入后返回 {items, next_cursor}"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    fields: Optional[str] = Query(None, description="只返回这些字段，逗号分隔，如 id,summary,dtstart"),
+):
+    try:
+        if start is None and end is None:
+            if limit is None and cursor is None and fields is None:
+                rows = await list_events(table_name, db_name)
+                return rows
+
+            cols = parse_fields(fields, EVENT_FIELDS, required=("id",))
+            if limit is None and cursor is None:
+                page = await list_events_page(table_name, cols, None, None, db_name)
+                return page["items"]
+            return await list_events_page(table_name, cols, limit or MAX_PAGE_SIZE, cursor, db_name)
+
+        if limit is not None or cursor is not None:
+            raise ValueError("按时间窗口查询时不支持 limit/cursor 分页，请缩小窗口")
+        win_start, win_end = _parse_window(start, end)
+        instances = await _window_instances(table_name, win_start, win_end, tzid, db_name)
+        if fields:
+            cols = parse_fields(fields, EVENT_FIELDS, required=("id",))
+            instances = [{k: item.get(k) for k in cols} for item in instances]
+        return instances
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get(
+    "/agenda/{table_name}/freebusy",
+    description="忙闲查询：返回窗口内合并后的忙碌区间和空闲区间（重复事件已展开，已取消的日程和待办不占用时间）",
+)
+async def get_agenda_freebusy(
+    table_name: str,
+    start: str = Query(..., description="窗口开始，如 2025-01-01 或 2025-01-01 08:00:00"),
+    end: str = Query(..., description="窗口结束（不含）"),
+    tzid: str = "Asia/Shanghai",
+    min_free_minutes: int = Query(0, ge=0, description="只返回不短于该分钟数的空闲区间"),
+    db_name: str = "agenda",
+):
+    try:
+        win_start, win_end = _parse_window(start, end)
+        instances = await _window_instances(table_name, win_start, win_end, tzid, db_name)
+        busy = merge_intervals(busy_spans(instances), win_start, win_end)
+        free = free_intervals(busy, win_start, win_end, datetime.timedelta(minutes=min_free_minutes))
+        return {
+            "busy": [{"start": s, "end": e} for s, e in busy],
+            "free": [{"start": s, "end": e} for s, e in free],
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get(
+    "/agenda/{table_name}/conflicts",
+    description="冲突检测：返回与 [start, end) 重叠的日程实例；修改已有日程时用 exclude_uid 排除它自己",
+)
+async def check_agenda_conflicts(
+    table_name: str,
+    start: str = Query(..., description="待检查时段的开始"),
+    end: str = Query(..., description="待检查时段的结束（不含）"),
+    exclude_uid: Optional[str] = Query(None, description="不参与比较的 uid"),
+    tzid: str = "Asia/Shanghai",
+    db_name: str = "agenda",
+):
+    try:
+        win_start, win_end = _parse_window(start, end)
+        instances = await _window_instances(table_name, win_start, win_end, tzid, db_name)
+        items = conflicts(instances, win_start, win_end, exclude_uid)
+        return {"conflict": bool(items), "items": items}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get(
+    "/agenda/{table_name}/sync",
+    description="增量同步：返回 sync_token 之后新增/修改/删除的记录；令牌过期返回 410，需全量重新同步",
+)
+async def sync_agenda_events(
+    table_name: str,
+    token: Optional[str] = Query(None, description="上次返回的 sync_token；不传表示首次同步"),
+    limit: int = Query(MAX_PAGE_SIZE, description=f"每页最多返回的修改行数，最大 {MAX_PAGE_SIZE}"),
+    db_name: str = "agenda",
+):
+    try:
+        return await sync_changes(table_name, token, limit, db_name)
+    except SyncTokenExpired as e:
+        raise HTTPException(status_code=410, detail=str(e))
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
@@ -118,7 +408,9 @@ async def get_agenda_events(table_name: str, db_name: str = "agenda"):
 async def patch_agenda_event(table_name: str, event_id: int, body: AgendaEventUpdateBody, db_name: str = "agenda"):
     try:
         payload = body.model_dump(exclude_unset=True)
-        affected = await asyncio.to_thread(update_event, table_name, event_id, payload, db_name)
+        affected = await update_event(table_name, event_id, payload, db_name)
+        if affected:
+            ics_cache.invalidate(db_name, table_name)
         return {"affected": affected}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -129,7 +421,9 @@ async def patch_agenda_event(table_name: str, event_id: int, body: AgendaEventUp
 @router.delete("/agenda/{table_name}/events/{event_id}", description="删除日程/待办（按 id）")
 async def remove_agenda_event(table_name: str, event_id: int, db_name: str = "agenda"):
     try:
-        affected = await asyncio.to_thread(delete_event, table_name, event_id, db_name)
+        affected = await delete_event(table_name, event_id, db_name)
+        if affected:
+            ics_cache.invalidate(db_name, table_name)
         return {"affected": affected}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -145,6 +439,8 @@ async def upload_image(
 ):
     try:
         result = await save_file(f, key)
+    except FileTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
         raise HTTPException(
             status_code=500,
@@ -154,9 +450,20 @@ async def upload_image(
     return result
 
 
+@router.delete("/save_file/{filename}", description="删除上传文件（别名），最后一个别名删除时回收实际内容")
+async def delete_uploaded_file(filename: str):
+    if not filename or filename != os.path.basename(filename) or filename.startswith("."):
+        raise HTTPException(status_code=400, detail="非法文件名")
+    removed = await asyncio.to_thread(cas_store.remove_alias, filename)
+    if not removed:
+        raise HTTPException(status_code=404, detail="file not found")
+    return {"deleted": filename}
+
+
 class KVSetBody(BaseModel):
     k: str
     v: str
+    ttl: Optional[int] = Field(None, ge=1, description="有效秒数，不传表示永不过期")
 
 
 class KVGetBody(BaseModel):
@@ -165,20 +472,99 @@ class KVGetBody(BaseModel):
 
 @router.post("/kv/set")
 async def kv_set(body: KVSetBody):
-    kv_tools.set(body.k, body.v)
-    return {"k": body.k, "v": body.v}
+    await kv_tools.set(body.k, body.v, body.ttl)
+    return {"k": body.k, "v": body.v, "ttl": body.ttl}
 
 
 @router.post("/kv/get")
 async def kv_get(body: KVGetBody):
-    value = kv_tools.get(body.k)
+    value = await kv_tools.get(body.k)
     if value is None:
         raise HTTPException(status_code=404, detail="key not found")
     return {"k": body.k, "v": value}
 
 
+@router.get("/db/pool_stats", description="数据库连接池指标（连接数、等待时间等）")
+async def get_pool_stats():
+    return {"sync": pool_stats(), "async": aio_pool_stats()}
+
+
+# 单次批量操作最多的 key 数
+KV_BATCH_MAX = 1000
+
+
+class KVMGetBody(BaseModel):
+    keys: list[str]
+
+
+class KVMSetBody(BaseModel):
+    items: list[KVSetBody]
+    ttl: Optional[int] = Field(None, ge=1, description="本批 key 的有效秒数，不传表示永不过期；单条带 ttl 时以单条为准")
+
+
+@router.post("/kv/mget", description="批量读取；不存在的 key 出现在 missing 里")
+async def kv_mget(body: KVMGetBody):
+    if len(body.keys) > KV_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"一次最多 {KV_BATCH_MAX} 个 key")
+    values = await kv_tools.mget(body.keys)
+    if values is None:
+        raise HTTPException(status_code=500, detail="kv 读取失败")
+    return {
+        "items": {k: v for k, v in values.items() if v is not None},
+        "missing": [k for k, v in values.items() if v is None],
+    }
+
+
+@router.post("/kv/mset", description="批量写入，一条 SQL 完成")
+async def kv_mset(body: KVMSetBody):
+    if len(body.items) > KV_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"一次最多 {KV_BATCH_MAX} 个 key")
+    # 同一个 key 出现多次时以最后一次为准
+    items = {item.k: item.v for item in body.items}
+    ttls = {item.k: item.ttl for item in body.items}
+    ttls = {k: t for k, t in ttls.items() if t is not None}
+    written = await kv_tools.mset(items, body.ttl, ttls)
+    if written is None:
+        raise HTTPException(status_code=500, detail="kv 写入失败")
+    return {"written": written}
+
+
+@router.get("/kv/scan", description="按前缀分页列出 key（按 key 升序）")
+async def kv_scan(
+    prefix: str = Query("", description="key 前缀，为空时列出全部"),
+    limit: int = Query(100, description=f"分页大小，最大 {MAX_PAGE_SIZE}"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    keys_only: bool = Query(False, description="只返回 key 不返回值"),
+):
+    try:
+        return await kv_tools.scan(prefix, limit, cursor, keys_only)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/kv/cache_stats", description="KV 读缓存的命中/未命中统计")
+async def get_kv_cache_stats():
+    return kv_tools.cache_stats()
+
+
+@router.get("/llm/cache_stats", description="图片识别结果缓存的命中/未命中统计")
+async def get_llm_cache_stats():
+    return result_cache.stats()
+
+
+# SSE 响应头：禁止缓存和反向代理缓冲，增量文本即时到达客户端
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def _sse_response(events) -> StreamingResponse:
+    return StreamingResponse(events, media_type="text/event-stream", headers=_SSE_HEADERS)
+
+
 @router.post("/cal")
-async def calendar(img: UploadFile = File(...)):
+async def calendar(
+    img: UploadFile = File(...),
+    stream: bool = Query(False, description="以 SSE 流式返回：delta 事件为增量文本，result 事件为最终 JSON"),
+):
     """
     自动识别用户图片中的事件类型
     将事件划分为日历事件calendar和提醒事件reminder
@@ -187,6 +573,10 @@ async def calendar(img: UploadFile = File(...)):
     if not img.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="请上传图片文件")
 
+    if stream:
+        # 响应开始后上传文件可能已关闭，先把内容读出来
+        return _sse_response(calendar_llm_sse(await img.read()))
+
     try:
         result = await calendar_llm(img)
     except Exception as e:
@@ -208,31 +598,76 @@ async def book_bill(img: UploadFile = File(...), pos: str = Form(...)):
         raise HTTPException(status_code=400, detail="请上传图片文件")
 
     img_bytes = await img.read()
-    asyncio.create_task(bill_llm(img_bytes, pos))
+    try:
+        job_id = await bill_jobs.submit(img_bytes, pos)
+    except bill_jobs.QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return {"message": "账单识别任务已启动，稍后请查看结果", "job_id": job_id}
 
-    return {"message": "账单识别任务已启动，稍后请查看结果"}
+
+@router.get("/jobs/{job_id}", description="查询账单识别任务状态（queued/running/done/failed）")
+async def get_job(job_id: int):
+    job = await aio_jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="job not found")
+    return job
 
 
 @router.get("/bills")
 async def get_bills(
     start_time: Optional[str] = Query(None),
-    end_time: Optional[str] = Query(None)
+    end_time: Optional[str] = Query(None),
+    limit: Optional[int] = Query(None, description="分页大小；传入后返回 {fields, items, next_cursor}"),
+    cursor: Optional[str] = Query(None, description="上一页返回的 next_cursor"),
+    fields: Optional[str] = Query(None, description="只返回这些列，逗号分隔，如 title,amount,created_at"),
 ):
     """
     GET /bills?start_time=xxxx&end_time=xxxx
     返回指定时间范围内的账单列表
+
+    可选 limit/cursor 游标分页、fields 列投影：
+    GET /bills?start_time=..&end_time=..&limit=50&fields=title,amount
     """
 
     # 参数校验
     if not start_time or not end_time:
         return {"error": "start_time and end_time are required"}
 
-    rows = query_bills(start_time, end_time)
+    if limit is not None or cursor is not None or fields is not None:
+        try:
+            cols = parse_fields(fields, BILL_FIELDS)
+            if limit is None and cursor is not None:
+                limit = MAX_PAGE_SIZE
+            return await query_bills_page(start_time, end_time, cols, limit, cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    try:
+        rows = await query_bills(start_time, end_time)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
     data = [list(row) for row in rows]
     return data
 
 
 
+@router.get("/bills/stats/{dimension}", description="账单统计：按 type/day/week/month/position/title 汇总金额与笔数")
+async def get_bill_stats(
+    dimension: str,
+    start_time: str,
+    end_time: str,
+    top: Optional[int] = Query(None, ge=1, le=1000, description="只返回前 N 组（如 title 维度的 Top-N）"),
+):
+    try:
+        return await bill_stats(dimension, start_time, end_time, top)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+
 @router.put("/bill", response_model=bool)
 async def put_bill(
     bill: List[Any] = Body(..., description="要更新的一条账单：[position, type, detail, title, amount, created_at, id]")
@@ -255,8 +690,11 @@ async def put_bill(
         "time": created_at,   # 映射 SQL 的 created_at
     }
 
-    # 调用 SQL 更新函数
-    affected = update_bill(bill_id, data)
+    # 调用 SQL 更新函数；数据库出错返回 500，不能当成 id 不存在
+    try:
+        affected = await update_bill(bill_id, data)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
     # affected = 1 → 更新成功  
     # affected = 0 → id 不存在
@@ -265,14 +703,15 @@ async def put_bill(
 
 
 class PositionBody(BaseModel):
-    name: str
-    lat: float
-    lon: float
-    detail: str | None = None   # 新增字段，可选
+    name: str = Field(..., max_length=255)
+    lat: float = Field(..., ge=-90, le=90)
+    lon: float = Field(..., ge=-180, le=180)
+    detail: str | None = Field(None, max_length=500)   # 新增字段，可选
+    time: datetime.datetime | None = None              # 采集时间（设备离线补传时使用），不传则为入库时间
 @router.post("/location")
 async def add_position(body: PositionBody):
     """
-    插入一条位置记录
+    插入一条位置记录（先进写缓冲，按批合并写库）
     JSON 请求体格式:
     {
         "name": "...",
@@ -281,13 +720,94 @@ async def add_position(body: PositionBody):
         "lon": 116.321
     }
     """
-    asyncio.create_task(asyncio.to_thread(insert_position, body.name, body.lat, body.lon, body.detail))
+    position_buffer.add(body.model_dump())
     return {"message": "位置记录插入成功"}
 
 
+class PositionBatchBody(BaseModel):
+    points: List[PositionBody]
+@router.post("/location/batch")
+async def add_positions(body: PositionBatchBody):
+    """
+    批量插入位置记录，一条多行 INSERT 写入
+    JSON 请求体格式:
+    {
+        "points": [
+            {"name": "...", "lat": 39.123, "lon": 116.321, "detail": null, "time": "2025-01-01 12:00:00"},
+            ...
+        ]
+    }
+    """
+    if not body.points:
+        return {"inserted": 0}
+    if len(body.points) > POSITION_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"单次最多 {POSITION_BATCH_MAX} 个点")
+    try:
+        inserted = await insert_positions([p.model_dump() for p in body.points])
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"inserted": inserted}
+
+
+@router.get("/positions/nearby", description="查询距 (lat, lon) 半径 radius 米内的位置记录，按距离排序")
+async def get_positions_nearby(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius: float = Query(..., gt=0, le=100000, description="半径（米）"),
+    name: Optional[str] = None,
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=5000),
+):
+    try:
+        return await records_within_radius(lat, lon, radius, name, start_time, end_time, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.get("/positions/trajectory", description="某个名称在时间范围内的轨迹，按容差（米）做 Douglas-Peucker 简化")
+async def get_trajectory(
+    name: str,
+    start_time: str,
+    end_time: str,
+    tolerance: float = Query(10, ge=0, le=10000, description="简化容差（米），0 表示不简化"),
+):
+    try:
+        points = await trajectory_points(name, start_time, end_time, TRAJECTORY_MAX_POINTS + 1)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if len(points) > TRAJECTORY_MAX_POINTS:
+        raise HTTPException(status_code=400, detail=f"时间范围内超过 {TRAJECTORY_MAX_POINTS} 个点，请缩小时间范围")
+    # Douglas-Peucker 是纯 CPU 计算，放到线程里，不阻塞事件循环
+    simplified = await asyncio.to_thread(simplify, points, tolerance)
+    return {"name": name, "count_raw": len(points), "count": len(simplified), "points": simplified}
+
+
+@router.get("/positions/bbox", description="查询经纬度矩形范围内（可选时间范围）的位置记录，按时间排序")
+async def get_positions_in_box(
+    min_lat: float = Query(..., ge=-90, le=90),
+    min_lon: float = Query(..., ge=-180, le=180),
+    max_lat: float = Query(..., ge=-90, le=90),
+    max_lon: float = Query(..., ge=-180, le=180),
+    name: Optional[str] = None,
+    start_time: Optional[str] = None,
+    end_time: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=5000),
+):
+    if min_lat > max_lat or min_lon > max_lon:
+        raise HTTPException(status_code=400, detail="min_lat/min_lon 必须不大于 max_lat/max_lon")
+    try:
+        return await records_in_box(min_lat, min_lon, max_lat, max_lon, name, start_time, end_time, limit)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 
 @router.post("/code")
-async def vcode(img: UploadFile = File(...)):
+async def vcode(
+    img: UploadFile = File(...),
+    stream: bool = Query(False, description="以 SSE 流式返回，识别出第一行提取码即结束"),
+):
     """
     自动识别用户图片中的取餐吗
     并按指定格式输出
@@ -295,6 +815,9 @@ async def vcode(img: UploadFile = File(...)):
     if not img.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="请上传图片文件")
 
+    if stream:
+        return _sse_response(vcode_llm_sse(await img.read()))
+
     try:
         result = await vcode_llm(img)
     except Exception as e:
@@ -309,7 +832,10 @@ async def vcode(img: UploadFile = File(...)):
 class PositionBody(BaseModel):
     detail: str | None = None   # 新增字段，可选
 @router.post("/codetext")
-async def vcodetext(body: PositionBody):
+async def vcodetext(
+    body: PositionBody,
+    stream: bool = Query(False, description="以 SSE 流式返回，识别出第一行提取码即结束"),
+):
     """
     插入一条位置记录
     JSON 请求体格式:
@@ -317,6 +843,8 @@ async def vcodetext(body: PositionBody):
         "detail": "...",
     }
     """
+    if stream:
+        return _sse_response(vcode_llm_text_sse(body.detail))
 
     try:
         result = await vcode_llm_text(body.detail)
@@ -1 +1,12 @@
+import os
+from dotenv import load_dotenv
+
+load_dotenv()
+
 UPLOAD_DIR = "uploads"
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))   # 单个上传文件大小上限
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))       # 流式写盘的块大小
+UPLOAD_FORM_OVERHEAD = 64 * 1024                                                  # multipart 边界、表单字段等额外开销
+# 不对外公开的上传存储目录（临时文件等），需与 UPLOAD_DIR 在同一文件系统，才能原子改名/硬链接
+UPLOAD_STORE_DIR = os.getenv("UPLOAD_STORE_DIR", "upload_store")
+UPLOAD_TMP_DIR = os.path.join(UPLOAD_STORE_DIR, "tmp")
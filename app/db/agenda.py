@@ -1,31 +1,8 @@
 import re
 from app.core.logger import log
-from dotenv import load_dotenv
-import os
 import pymysql
 from typing import Optional
-
-
-load_dotenv()
-
-HOST = os.getenv("HOST")
-PORT = int(os.getenv("PORT"))
-USER = os.getenv("USER")
-PASSWORD = os.getenv("PASSWORD")
-
-
-def get_conn(DB_NAME):
-    """获取一个连接到 bills 数据库的连接"""
-    conn = pymysql.connect(
-        host=HOST,
-        port=PORT,
-        user=USER,
-        password=PASSWORD,
-        database=DB_NAME,
-        charset="utf8mb4",
-        autocommit=True,  # 简化操作，不用手动 commit
-    )
-    return conn
+from app.db.pool import get_conn
 
 
 _IDENTIFIER_RE = re.compile(r"^[A-Za-z0-9_]{1,64}$")
@@ -48,6 +25,27 @@ _ALLOWED_FIELDS = {
     # created_at/updated_at 通常不让外部写；如果你要允许也可加进去
 }
 
+# 分页排序键：与 list_events 的顺序一致（先按 dtstart/due），再用 id 保证唯一
+# 迁移 0009 按同一表达式建了函数索引，修改时两处要一起改
+_SORT_EXPR = "COALESCE(`dtstart`, `due`, '1000-01-01 00:00:00')"
+
+# 重复记录的起点（非重复记录为 NULL）：窗口查询的重复分支按它范围扫描
+# 迁移 0014 按同一表达式建了函数索引 idx_rrule_start，修改时两处要一起改
+_RRULE_START_EXPR = "IF(`rrule` IS NULL, NULL, COALESCE(`dtstart`, `due`))"
+
+# 删除记录表（与日程表在同一个库），见 init.init_agenda_tombstone_db
+TOMBSTONE_TABLE = "agenda_tombstone"
+# MySQL 错误码：表不存在
+ER_NO_SUCH_TABLE = 1146
+
+
+def no_such_table(e: BaseException) -> bool:
+    """
+    库里没有删除记录表（日程表不是 init_agenda_db 建的）时为 True
+    删除照常进行，只是不写墓碑，这个库的增量同步看不到删除
+    """
+    return isinstance(e, pymysql.err.ProgrammingError) and e.args[:1] == (ER_NO_SUCH_TABLE,)
+
 def insert_event(table_name: str, data: dict, db_name: str = "agenda"):
     """
     插入一条日程/待办
@@ -95,7 +93,8 @@ def insert_event(table_name: str, data: dict, db_name: str = "agenda"):
     try:
         with conn.cursor() as cursor:
             cursor.execute(sql, tuple(clean.values()))
-            return cursor.lastrowid
+            new_id = cursor.lastrowid
+            return new_id
     except Exception as e:
         log(e)
         raise
@@ -111,10 +110,34 @@ def delete_event(table_name: str, event_id: int, db_name: str = "agenda") -> int
 
     conn = get_conn(db_name)
     try:
-        with conn.cursor() as cursor:
-            sql = f"DELETE FROM `{table_name}` WHERE `id`=%s"
-            cursor.execute(sql, (event_id,))
-            return cursor.rowcount
+        # 删除和写墓碑放在同一事务里，增量同步不会漏掉删除
+        conn.begin()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    f"SELECT `uid`, `kind`, `recurrence_id` FROM `{table_name}` WHERE `id`=%s FOR UPDATE",
+                    (event_id,),
+                )
+                row = cursor.fetchone()
+                affected = 0
+                if row:
+                    cursor.execute(f"DELETE FROM `{table_name}` WHERE `id`=%s", (event_id,))
+                    affected = cursor.rowcount
+                    try:
+                        cursor.execute(
+                            f"INSERT INTO `{TOMBSTONE_TABLE}` (`table_name`, `event_id`, `uid`, `kind`, `recurrence_id`) "
+                            "VALUES (%s, %s, %s, %s, %s)",
+                            (table_name, event_id, *row),
+                        )
+                    except Exception as e:
+                        if not no_such_table(e):
+                            raise
+                        log(f"库 {db_name} 没有 {TOMBSTONE_TABLE}，删除不写墓碑", "WARNING")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return affected
     except Exception as e:
         log(e)
         raise
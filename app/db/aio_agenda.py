@@ -0,0 +1,387 @@
+"""
+app/db/agenda.py 的异步版本，表名校验与字段白名单复用同步版
+"""
+import datetime as _dt
+import os
+import aiomysql
+from dotenv import load_dotenv
+
+from app.core.logger import log
+from app.db.aio_pool import get_conn
+from app.db.agenda import (
+    _safe_table_name, _ALLOWED_FIELDS, _SORT_EXPR, _RRULE_START_EXPR, TOMBSTONE_TABLE, no_such_table,
+)
+from app.db.paging import encode_cursor, decode_cursor, clamp_limit
+
+load_dotenv()
+
+# 可查询/投影的全部列
+EVENT_FIELDS = ["id", *sorted(_ALLOWED_FIELDS), "created_at", "updated_at"]
+
+# 删除记录保留天数；早于这个时间的同步令牌不再有效
+AGENDA_TOMBSTONE_DAYS = int(os.getenv("AGENDA_TOMBSTONE_DAYS", "30"))
+
+
+class SyncTokenExpired(Exception):
+    """同步令牌早于删除记录保留期，客户端需要全量重新同步"""
+
+
+async def insert_event(table_name: str, data: dict, db_name: str = "agenda"):
+    """
+    插入一条日程/待办（data 格式同 agenda.insert_event）
+    返回：新插入记录 id
+    """
+    table_name = _safe_table_name(table_name)
+
+    clean = {k: v for k, v in (data or {}).items() if k in _ALLOWED_FIELDS}
+
+    if not clean.get("uid"):
+        raise ValueError("uid 不能为空")
+    if clean.get("kind") not in ("VEVENT", "VTODO"):
+        raise ValueError("kind 必须是 'VEVENT' 或 'VTODO'")
+
+    cols = ", ".join(f"`{k}`" for k in clean.keys())
+    placeholders = ", ".join(["%s"] * len(clean))
+    sql = f"INSERT INTO `{table_name}` ({cols}) VALUES ({placeholders})"
+
+    try:
+        async with get_conn(db_name) as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(sql, tuple(clean.values()))
+                new_id = cursor.lastrowid
+                return new_id
+    except Exception as e:
+        log(e)
+        raise
+
+
+def upsert_key(uid: str, kind: str, recurrence_id) -> tuple:
+    """与 uniq_uid_kind_recur 对应的匹配键（uid 列是大小写不敏感的排序规则）"""
+    return (uid.casefold(), kind, recurrence_id)
+
+
+async def upsert_events(table_name: str, rows: list[dict], db_name: str = "agenda") -> list[tuple[int, bool]]:
+    """
+    批量 upsert：一条多行 INSERT ... ON DUPLICATE KEY UPDATE
+    rows 必须字段齐全（见 agenda_import.normalize_event），且同一批内 (uid, kind, recurrence_id) 不重复
+    recurrence_id 为 NULL 时唯一键不会冲突，所以先按 uid 查出已有行，
+    把它们的 id 一起写入，让主键冲突走 UPDATE
+    返回与 rows 一一对应的 [(id, 是否新建)]
+    """
+    table_name = _safe_table_name(table_name)
+    if not rows:
+        return []
+
+    cols = sorted(_ALLOWED_FIELDS)
+    keys = [upsert_key(r["uid"], r["kind"], r["recurrence_id"]) for r in rows]
+    uids = list({r["uid"] for r in rows})
+    select_sql = (
+        f"SELECT `id`, `uid`, `kind`, `recurrence_id` FROM `{table_name}` "
+        f"WHERE `uid` IN ({', '.join(['%s'] * len(uids))})"
+    )
+
+    col_list = ", ".join(f"`{c}`" for c in ["id", *cols])
+    row_ph = "(" + ", ".join(["%s"] * (len(cols) + 1)) + ")"
+    updates = ", ".join(f"`{c}`=VALUES(`{c}`)" for c in cols)
+    insert_sql = (
+        f"INSERT INTO `{table_name}` ({col_list}) VALUES {', '.join([row_ph] * len(rows))} "
+        f"ON DUPLICATE KEY UPDATE {updates}"
+    )
+
+    try:
+        async with get_conn(db_name) as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(select_sql, uids)
+                existing = {upsert_key(u, k, r): i for i, u, k, r in await cursor.fetchall()}
+
+                params = []
+                for key, r in zip(keys, rows):
+                    params.append(existing.get(key))
+                    params.extend(r[c] for c in cols)
+                await cursor.execute(insert_sql, params)
+
+                ids = existing
+                if any(key not in existing for key in keys):
+                    # 取回新插入行的 id
+                    await cursor.execute(select_sql, uids)
+                    ids = {upsert_key(u, k, r): i for i, u, k, r in await cursor.fetchall()}
+    except Exception as e:
+        log(e)
+        raise
+
+    return [(ids.get(key), key not in existing) for key in keys]
+
+
+async def delete_event(table_name: str, event_id: int, db_name: str = "agenda") -> int:
+    """
+    删除一条记录（按 id）
+    返回：受影响行数
+    """
+    table_name = _safe_table_name(table_name)
+
+    try:
+        async with get_conn(db_name) as conn:
+            # 删除和写墓碑放在同一事务里，增量同步不会漏掉删除
+            await conn.begin()
+            try:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(
+                        f"SELECT `uid`, `kind`, `recurrence_id` FROM `{table_name}` WHERE `id`=%s FOR UPDATE",
+                        (event_id,),
+                    )
+                    row = await cursor.fetchone()
+                    affected = 0
+                    if row:
+                        await cursor.execute(f"DELETE FROM `{table_name}` WHERE `id`=%s", (event_id,))
+                        affected = cursor.rowcount
+                        try:
+                            await cursor.execute(
+                                f"INSERT INTO `{TOMBSTONE_TABLE}` (`table_name`, `event_id`, `uid`, `kind`, `recurrence_id`) "
+                                "VALUES (%s, %s, %s, %s, %s)",
+                                (table_name, event_id, *row),
+                            )
+                        except Exception as e:
+                            if not no_such_table(e):
+                                raise
+                            log(f"库 {db_name} 没有 {TOMBSTONE_TABLE}，删除不写墓碑", "WARNING")
+                await conn.commit()
+            except Exception:
+                await conn.rollback()
+                raise
+        return affected
+    except Exception as e:
+        log(e)
+        raise
+
+
+async def update_event(table_name: str, event_id: int, data: dict, db_name: str = "agenda") -> int:
+    """
+    更新一条记录（按 id）
+    返回：受影响行数
+    """
+    table_name = _safe_table_name(table_name)
+
+    clean = {k: v for k, v in (data or {}).items() if k in _ALLOWED_FIELDS}
+    if not clean:
+        return 0
+
+    set_clause = ", ".join([f"`{k}`=%s" for k in clean.keys()])
+    sql = f"UPDATE `{table_name}` SET {set_clause} WHERE `id`=%s"
+
+    try:
+        async with get_conn(db_name) as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(sql, tuple(clean.values()) + (event_id,))
+                return cursor.rowcount
+    except Exception as e:
+        log(e)
+        raise
+
+
+async def list_events(table_name: str, db_name: str = "agenda"):
+    """
+    获取所有记录（按时间排序：事件按 dtstart，待办按 due，再按 created_at）
+    返回：list[dict]
+    """
+    table_name = _safe_table_name(table_name)
+
+    try:
+        async with get_conn(db_name) as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                sql = f"""
+                    SELECT *
+                    FROM `{table_name}`
+                    ORDER BY
+                        COALESCE(`dtstart`, `due`) ASC,
+                        `created_at` ASC
+                """
+                await cursor.execute(sql)
+                return await cursor.fetchall()
+    except Exception as e:
+        log(e)
+        raise
+
+
+async def list_events_page(
+    table_name: str,
+    fields: list[str],
+    limit: int | None,
+    cursor: str | None = None,
+    db_name: str = "agenda",
+) -> dict:
+    """
+    按 (COALESCE(dtstart, due), id) 做游标分页；limit 为 None 时不分页
+    fields 必须是 EVENT_FIELDS 的子集；返回：
+    {"items": [dict, ...], "next_cursor": str | None}
+    """
+    table_name = _safe_table_name(table_name)
+    limit = clamp_limit(limit) if limit is not None else None
+    cols = ", ".join(f"`{f}`" for f in fields)
+
+    where = ""
+    params = []
+    if cursor:
+        last_key, last_id = decode_cursor(cursor, (_dt.datetime, int))
+        where = f"WHERE ({_SORT_EXPR}, `id`) > (%s, %s)"
+        params += [last_key, last_id]
+
+    sql = f"""
+        SELECT {cols}, {_SORT_EXPR} AS `_k1`, `id` AS `_k2`
+        FROM `{table_name}`
+        {where}
+        ORDER BY `_k1` ASC, `_k2` ASC
+        {"LIMIT %s" if limit is not None else ""}
+    """
+    if limit is not None:
+        params.append(limit + 1)
+
+    try:
+        async with get_conn(db_name) as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                await cur.execute(sql, params or None)
+                rows = await cur.fetchall()
+    except Exception as e:
+        log(e)
+        raise
+
+    has_more = limit is not None and len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor([rows[-1]["_k1"], rows[-1]["_k2"]]) if has_more else None
+    for row in rows:
+        del row["_k1"], row["_k2"]
+    return {"items": rows, "next_cursor": next_cursor}
+
+
+async def list_events_in_window(
+    table_name: str,
+    start: _dt.datetime,
+    end: _dt.datetime,
+    max_span: _dt.timedelta,
+    db_name: str = "agenda",
+):
+    """
+    取可能落在 [start, end) 内的记录（重复规则由调用方展开）：
+    - 非重复事件：dtstart 在 [start - max_span, end) 内，走 idx_time(dtstart, due) 范围扫描
+    - 非重复待办：dtstart IS NULL 且 due 在 [start, end) 内，同样走 idx_time
+    - 重复记录：起点早于 end 的全部取出，走函数索引 idx_rrule_start
+    - 单次修改：recurrence_id 在 [start - max_span, end) 内的，走 idx_recurrence_id；
+      即使这次被改到了窗口外，也要取回来，调用方才能把主事件里原来那次去掉
+    同一行可能命中多个分支，按 id 去重
+    返回：list[dict]
+    """
+    table_name = _safe_table_name(table_name)
+
+    sql = f"""
+        SELECT * FROM `{table_name}`
+        WHERE `dtstart` >= %s AND `dtstart` < %s AND `rrule` IS NULL
+        UNION ALL
+        SELECT * FROM `{table_name}`
+        WHERE `dtstart` IS NULL AND `due` >= %s AND `due` < %s AND `rrule` IS NULL
+        UNION ALL
+        SELECT * FROM `{table_name}`
+        WHERE {_RRULE_START_EXPR} < %s
+        UNION ALL
+        SELECT * FROM `{table_name}`
+        WHERE `recurrence_id` >= %s AND `recurrence_id` < %s
+    """
+    try:
+        async with get_conn(db_name) as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(sql, (start - max_span, end, start, end, end, start - max_span, end))
+                rows = await cursor.fetchall()
+        return list({r["id"]: r for r in rows}.values())
+    except Exception as e:
+        log(e)
+        raise
+
+
+async def sync_changes(table_name: str, token: str | None, limit: int, db_name: str = "agenda") -> dict:
+    """
+    增量同步：返回令牌之后新增/修改的行，以及被删除的记录
+    {"changed": [dict, ...], "deleted": [dict, ...], "sync_token": str, "has_more": bool}
+
+    - token 为空表示首次同步，返回全部行
+    - 行按 (updated_at, id) 翻页；has_more 为 True 时用返回的 sync_token 继续取
+    - deleted 只在最后一页返回，覆盖从本轮同步开始到现在的全部删除
+    - updated_at 只精确到秒，边界那一秒的行可能重复返回，客户端按 id 覆盖即可
+    - updated_at 取的是语句执行时间而不是提交时间：长事务里改的行提交前被别的同步越过，
+      之后就不会再返回。写日程表的事务要短（本模块的写操作都是单语句或短事务）
+    - 库里没有删除记录表时 deleted 恒为空（见 agenda.no_such_table）
+    - 令牌早于 AGENDA_TOMBSTONE_DAYS 时抛 SyncTokenExpired
+    """
+    table_name = _safe_table_name(table_name)
+    limit = clamp_limit(limit)
+
+    # 令牌内容：[上次同步到的 updated_at, 同一秒内已取到的 id, 本轮同步的起点]
+    since, after_id, base = decode_cursor(token, (_dt.datetime, int, _dt.datetime)) if token else (None, 0, None)
+
+    try:
+        async with get_conn(db_name) as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cur:
+                await cur.execute(
+                    "SELECT NOW() AS `now`, NOW() - INTERVAL %s DAY AS `horizon`",
+                    (AGENDA_TOMBSTONE_DAYS,),
+                )
+                clock = await cur.fetchone()
+                if base is None:
+                    base = clock["now"]
+                elif base < clock["horizon"]:
+                    raise SyncTokenExpired(f"同步令牌已超过 {AGENDA_TOMBSTONE_DAYS} 天，请全量重新同步")
+
+                where, params = "", []
+                if since is not None:
+                    where = "WHERE (`updated_at`, `id`) > (%s, %s)"
+                    params = [since, after_id]
+                await cur.execute(
+                    f"""
+                    SELECT * FROM `{table_name}`
+                    {where}
+                    ORDER BY `updated_at` ASC, `id` ASC
+                    LIMIT %s
+                    """,
+                    params + [limit + 1],
+                )
+                rows = await cur.fetchall()
+
+                has_more = len(rows) > limit
+                rows = rows[:limit]
+                deleted = []
+                if not has_more and token:
+                    try:
+                        await cur.execute(
+                            f"""
+                            SELECT `event_id` AS `id`, `uid`, `kind`, `recurrence_id`, `deleted_at`
+                            FROM `{TOMBSTONE_TABLE}`
+                            WHERE `table_name` = %s AND `deleted_at` >= %s
+                            ORDER BY `deleted_at` ASC, `id` ASC
+                            """,
+                            (table_name, base),
+                        )
+                        deleted = await cur.fetchall()
+                    except Exception as e:
+                        if not no_such_table(e):
+                            raise
+                        log(f"库 {db_name} 没有 {TOMBSTONE_TABLE}，增量同步不返回删除", "WARNING")
+    except (SyncTokenExpired, ValueError):
+        raise
+    except Exception as e:
+        log(e)
+        raise
+
+    if has_more:
+        next_token = encode_cursor([rows[-1]["updated_at"], rows[-1]["id"], base])
+    else:
+        next_token = encode_cursor([clock["now"], 0, clock["now"]])
+    return {"changed": rows, "deleted": deleted, "sync_token": next_token, "has_more": has_more}
+
+
+async def prune_tombstones(limit: int, db_name: str = "agenda") -> int:
+    """删除最多 limit 条超过保留期的删除记录，返回删除条数"""
+    async with get_conn(db_name) as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                f"DELETE FROM `{TOMBSTONE_TABLE}` WHERE `deleted_at` < NOW() - INTERVAL %s DAY "
+                "ORDER BY `deleted_at` LIMIT %s",
+                (AGENDA_TOMBSTONE_DAYS, limit),
+            )
+            return cur.rowcount
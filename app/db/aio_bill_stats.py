@@ -0,0 +1,82 @@
+"""
+账单统计（在 SQL 里聚合，不再把整段时间的账单拉到客户端求和）
+
+按时间范围的结果缓存在进程内；insert_bill / update_bill 后整体失效。
+created_at 上的覆盖索引 idx_created_type_amount(created_at, type, amount)
+让按类型/按日期统计只扫索引。
+"""
+import os
+from dotenv import load_dotenv
+
+from app.core.cache import TTLCache, MISSING
+from app.core.logger import log
+from app.db.aio_pool import get_conn
+
+load_dotenv()
+
+BILL_STATS_CACHE_TTL = float(os.getenv("BILL_STATS_CACHE_TTL", "300"))
+
+stats_cache = TTLCache(maxsize=512, ttl=BILL_STATS_CACHE_TTL)
+
+# 维度 -> 分组表达式
+_GROUP_EXPR = {
+    "type": "`type`",
+    "day": "DATE(`created_at`)",
+    "week": "DATE_SUB(DATE(`created_at`), INTERVAL WEEKDAY(`created_at`) DAY)",   # 周一
+    "month": "DATE_FORMAT(`created_at`, '%%Y-%%m')",
+    "position": "`position`",
+    "title": "`title`",
+}
+DIMENSIONS = list(_GROUP_EXPR)
+
+
+async def bill_stats(dimension: str, start_time: str, end_time: str, top: int | None = None) -> dict:
+    """
+    按维度汇总金额：返回
+    {"dimension": ..., "total": 总金额, "count": 笔数, "groups": [{"key", "total", "count"}, ...]}
+    时间类维度按 key 升序；其余按金额降序，top 限制返回的组数
+    """
+    if dimension not in _GROUP_EXPR:
+        raise ValueError(f"不支持的统计维度: {dimension!r}，可选 {DIMENSIONS}")
+
+    cache_key = (dimension, start_time, end_time, top)
+    cached = stats_cache.get(cache_key)
+    if cached is not MISSING:
+        return cached
+
+    expr = _GROUP_EXPR[dimension]
+    order = "`key` ASC" if dimension in ("day", "week", "month") else "`total` DESC"
+    sql = f"""
+        SELECT {expr} AS `key`, SUM(`amount`) AS `total`, COUNT(*) AS `count`
+        FROM bill
+        WHERE created_at BETWEEN %s AND %s
+        GROUP BY `key`
+        ORDER BY {order}
+    """
+    params = [start_time, end_time]
+    if top is not None:
+        sql += " LIMIT %s"
+        params.append(top)
+
+    try:
+        async with get_conn("bills") as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(sql, params)
+                rows = await cursor.fetchall()
+                await cursor.execute(
+                    "SELECT COALESCE(SUM(`amount`), 0), COUNT(*) FROM bill WHERE created_at BETWEEN %s AND %s",
+                    (start_time, end_time),
+                )
+                total, count = await cursor.fetchone()
+    except Exception as e:
+        log(e)
+        raise
+
+    result = {
+        "dimension": dimension,
+        "total": total,
+        "count": count,
+        "groups": [{"key": k, "total": t, "count": c} for k, t, c in rows],
+    }
+    stats_cache.set(cache_key, result)
+    return result
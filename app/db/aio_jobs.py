@@ -0,0 +1,117 @@
+"""
+账单识别任务表 bills.bill_job 的读写
+"""
+import json
+import aiomysql
+
+from app.db.aio_pool import get_conn
+from app.db.aio_tools import INSERT_BILL_SQL, bill_params
+from app.db.aio_bill_stats import stats_cache
+
+
+async def create_job(image: bytes, position: str) -> int:
+    """新建一个 queued 任务，返回任务 id"""
+    async with get_conn("bills") as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                "INSERT INTO `bill_job` (`status`, `position`, `image`) VALUES ('queued', %s, %s)",
+                (position, image),
+            )
+            return cursor.lastrowid
+
+
+async def claim_job(job_id: int, lease: float):
+    """
+    把任务标记为 running 并返回 (image, position, attempts)；
+    只能领取 queued 的任务，或 running 但超过 lease 秒没有更新的任务（上一个 worker 已经不在了），
+    所以同一个任务不会被两个 worker 同时执行。不可领取时返回 None
+    """
+    async with get_conn("bills") as conn:
+        async with conn.cursor() as cursor:
+            rows = await cursor.execute(
+                "UPDATE `bill_job` SET `status`='running', `attempts`=`attempts`+1 "
+                "WHERE `id`=%s AND (`status`='queued' "
+                "OR (`status`='running' AND `updated_at` < NOW() - INTERVAL %s SECOND))",
+                (job_id, int(lease)),
+            )
+            if not rows:
+                return None
+            await cursor.execute(
+                "SELECT `image`, `position`, `attempts` FROM `bill_job` WHERE `id`=%s",
+                (job_id,),
+            )
+            return await cursor.fetchone()
+
+
+async def finish_job(job_id: int, result: dict) -> int | None:
+    """
+    任务成功：在同一个事务里插入账单、保存结果、记下 bill_id 并清掉图片，返回账单 id
+    任务已经记过账（bill_id 不为空）时什么也不做，返回 None，保证一个任务只记一次账
+    """
+    async with get_conn("bills") as conn:
+        await conn.begin()
+        try:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "SELECT `bill_id` FROM `bill_job` WHERE `id`=%s FOR UPDATE",
+                    (job_id,),
+                )
+                row = await cursor.fetchone()
+                if row is None or row[0] is not None:
+                    await conn.rollback()
+                    return None
+                await cursor.execute(INSERT_BILL_SQL, bill_params(result))
+                bill_id = cursor.lastrowid
+                await cursor.execute(
+                    "UPDATE `bill_job` SET `status`='done', `bill_id`=%s, `result`=%s, `image`=NULL, `last_error`=NULL "
+                    "WHERE `id`=%s",
+                    (bill_id, json.dumps(result, ensure_ascii=False, default=str), job_id),
+                )
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+    stats_cache.clear()
+    return bill_id
+
+
+async def fail_job(job_id: int, error: str, retry: bool) -> None:
+    """任务失败：retry=True 时放回 queued 等待重试，否则标记 failed 并清掉图片"""
+    if retry:
+        sql = "UPDATE `bill_job` SET `status`='queued', `last_error`=%s WHERE `id`=%s"
+    else:
+        sql = "UPDATE `bill_job` SET `status`='failed', `last_error`=%s, `image`=NULL WHERE `id`=%s"
+    async with get_conn("bills") as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(sql, (error[:2000], job_id))
+
+
+async def get_job(job_id: int):
+    """查询任务状态（不返回图片），不存在返回 None"""
+    async with get_conn("bills") as conn:
+        async with conn.cursor(aiomysql.DictCursor) as cursor:
+            await cursor.execute(
+                "SELECT `id`, `status`, `position`, `attempts`, `last_error`, `result`, `created_at`, `updated_at` "
+                "FROM `bill_job` WHERE `id`=%s",
+                (job_id,),
+            )
+            row = await cursor.fetchone()
+    if row and isinstance(row.get("result"), str):
+        row["result"] = json.loads(row["result"])
+    return row
+
+
+async def list_unfinished_jobs(lease: float) -> list[tuple[int, int]]:
+    """
+    进程重启后需要恢复的任务（queued/running），返回 [(id, 还需等待的秒数)]
+    running 的任务要等 lease 过期后才能被重新领取
+    """
+    async with get_conn("bills") as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                "SELECT `id`, IF(`status`='queued', 0, "
+                "GREATEST(0, %s - TIMESTAMPDIFF(SECOND, `updated_at`, NOW()))) "
+                "FROM `bill_job` WHERE `status` IN ('queued','running') ORDER BY `id`",
+                (int(lease),),
+            )
+            return [(row[0], int(row[1])) for row in await cursor.fetchall()]
@@ -0,0 +1,294 @@
+"""
+app/db/kv_tools.py 的异步版本
+
+读路径前面有一层进程内缓存 kv_cache（LRU + TTL）：
+- get/has 先查缓存，未命中再查库并回填
+- 不存在的 key 也会缓存（较短的 KV_CACHE_NEG_TTL），避免反复查不存在的 key
+- set/delete 成功后同步更新缓存（写穿），本进程内读到的总是最新值
+- 读未命中查库期间如果同一 key 被写过，查到的可能是旧值，这次就不回填（见 write_gen）
+多进程部署时，其它进程最多在 KV_CACHE_TTL 秒内读到旧值
+
+key 可以带过期时间（expires_at），读的时候过滤掉已过期的行，
+物理删除交给定时任务 app/functions/scheduler/kv_sweep.py
+"""
+import os
+import threading
+from typing import Optional
+from dotenv import load_dotenv
+
+from app.core.cache import TTLCache, MISSING
+from app.core.logger import log
+from app.db.aio_pool import get_conn
+from app.db.paging import encode_cursor, decode_cursor, clamp_limit
+
+load_dotenv()
+
+KV_CACHE_SIZE = int(os.getenv("KV_CACHE_SIZE", "4096"))
+KV_CACHE_TTL = float(os.getenv("KV_CACHE_TTL", "60"))
+KV_CACHE_NEG_TTL = float(os.getenv("KV_CACHE_NEG_TTL", "10"))
+# 写代数的分桶数，按 key 哈希分桶，内存固定
+KV_GEN_BUCKETS = 4096
+
+# 同步版 kv_tools 也用这一份，两边的写操作互相可见
+kv_cache = TTLCache(maxsize=KV_CACHE_SIZE, ttl=KV_CACHE_TTL)
+
+# 缓存里表示“库里没有这个 key”
+ABSENT = object()
+
+# 写代数：写操作开始前、写完回填前各加一次。
+# 读未命中时先记下代数，查完库代数没变才回填；变了说明期间有写，
+# 查到的可能是旧值，回填会盖掉写穿的新值。同桶的 key 互相影响只会多跳过几次回填
+_gens = [0] * KV_GEN_BUCKETS
+# 同步版在线程里跑，和异步版共用，加锁
+_gen_lock = threading.Lock()
+
+
+# 未过期的行（expires_at 为 NULL 表示永不过期）
+LIVE = "(`expires_at` IS NULL OR `expires_at` > NOW())"
+# 剩余秒数，永不过期时为 NULL
+TTL_LEFT = "TIMESTAMPDIFF(SECOND, NOW(), `expires_at`)"
+
+
+def cache_put(key: str, value: Optional[str], ttl: Optional[float] = None) -> None:
+    """
+    查库/写库成功后回填缓存；value 为 None 表示不存在
+    ttl 是 key 在库里剩余的有效秒数，缓存不会比 key 本身活得更久
+    """
+    if value is None:
+        kv_cache.set(key, ABSENT, ttl=KV_CACHE_NEG_TTL)
+    elif ttl is None:
+        kv_cache.set(key, value)
+    else:
+        kv_cache.set(key, value, ttl=min(KV_CACHE_TTL, ttl))
+
+
+def write_gen(key: str) -> int:
+    """查库前调用，记下 key 当前的写代数"""
+    return _gens[hash(key) % KV_GEN_BUCKETS]
+
+
+def bump_gen(keys) -> None:
+    """写操作开始前、写完回填缓存前各调用一次"""
+    with _gen_lock:
+        for key in keys:
+            _gens[hash(key) % KV_GEN_BUCKETS] += 1
+
+
+def cache_fill(key: str, value: Optional[str], ttl: Optional[float], gen: int) -> None:
+    """读路径回填：gen 是查库前的写代数，期间 key 被写过就不回填"""
+    with _gen_lock:
+        if _gens[hash(key) % KV_GEN_BUCKETS] == gen:
+            cache_put(key, value, ttl)
+
+
+def cache_stats() -> dict:
+    return kv_cache.stats()
+
+
+def like_prefix(prefix: str) -> str:
+    """前缀扫描用的 LIKE 模式（转义 \\ % _），k 上的主键索引可以走范围扫描"""
+    escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return escaped + "%"
+
+
+def split_cached(keys: list[str]) -> tuple[dict, list[str]]:
+    """mget 用：先从缓存取，返回 ({key: value|None}, 需要查库的 key)"""
+    found, todo = {}, []
+    for key in dict.fromkeys(keys):
+        cached = kv_cache.get(key)
+        if cached is MISSING:
+            todo.append(key)
+        else:
+            found[key] = None if cached is ABSENT else cached
+    return found, todo
+
+
+def scan_sql(prefix: str, limit: int, cursor: str | None, keys_only: bool) -> tuple[str, list]:
+    cols = "`k`" if keys_only else "`k`, `v`"
+    where = f"`k` LIKE %s AND {LIVE}"
+    params = [like_prefix(prefix)]
+    if cursor:
+        (last_k,) = decode_cursor(cursor, (str,))
+        where += " AND `k` > %s"
+        params.append(last_k)
+    params.append(limit + 1)
+    return f"SELECT {cols} FROM `kv` WHERE {where} ORDER BY `k` LIMIT %s", params
+
+
+def scan_page(rows, limit: int, keys_only: bool) -> dict:
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if keys_only:
+        items = [{"k": row[0]} for row in rows]
+    else:
+        items = [{"k": row[0], "v": row[1]} for row in rows]
+    return {
+        "items": items,
+        "next_cursor": encode_cursor([rows[-1][0]]) if has_more else None,
+    }
+
+
+async def _load(key: str):
+    """先查缓存，未命中再查库并回填；查库失败返回 MISSING（不缓存）"""
+    cached = kv_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    gen = write_gen(key)
+    try:
+        async with get_conn("kv") as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    f"SELECT `v`, {TTL_LEFT} FROM `kv` WHERE `k`=%s AND {LIVE} LIMIT 1;",
+                    (key,),
+                )
+                row = await cur.fetchone()
+    except Exception as e:
+        log(e)
+        return MISSING
+    value, left = (None, None) if row is None else row
+    cache_fill(key, value, left, gen)
+    return ABSENT if value is None else value
+
+
+async def has(key: str) -> bool:
+    value = await _load(key)
+    if value is MISSING:
+        return None
+    return value is not ABSENT
+
+
+async def get(key: str) -> Optional[str]:
+    value = await _load(key)
+    if value is MISSING or value is ABSENT:
+        return None
+    return value
+
+
+async def set(key: str, value: str, ttl: int | None = None) -> None:
+    """ttl 为有效秒数，None 表示永不过期（覆盖写入时也会清掉原来的过期时间）"""
+    bump_gen((key,))
+    try:
+        async with get_conn("kv") as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    INSERT INTO `kv` (`k`, `v`, `expires_at`)
+                    VALUES (%s, %s, DATE_ADD(NOW(), INTERVAL %s SECOND))
+                    ON DUPLICATE KEY UPDATE `v`=VALUES(`v`), `expires_at`=VALUES(`expires_at`);
+                    """,
+                    (key, value, ttl),
+                )
+        bump_gen((key,))
+        cache_put(key, value, ttl)
+    except Exception as e:
+        # 写库结果未知，丢掉缓存，下次从库里读
+        bump_gen((key,))
+        kv_cache.delete(key)
+        log(e)
+
+
+async def delete(key: str) -> bool:
+    """删除成功返回 True；不存在返回 False"""
+    bump_gen((key,))
+    try:
+        async with get_conn("kv") as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    "DELETE FROM `kv` WHERE `k`=%s;",
+                    (key,),
+                )
+                deleted = cur.rowcount > 0
+        bump_gen((key,))
+        cache_put(key, None)
+        return deleted
+    except Exception as e:
+        bump_gen((key,))
+        kv_cache.delete(key)
+        log(e)
+
+
+async def mget(keys: list[str]) -> Optional[dict[str, Optional[str]]]:
+    """
+    批量读取，返回 {key: value}，不存在的 key 值为 None
+    缓存未命中的 key 用一条 IN 查询取回
+    """
+    result, todo = split_cached(keys)
+    if not todo:
+        return result
+    gens = {key: write_gen(key) for key in todo}
+    try:
+        async with get_conn("kv") as conn:
+            async with conn.cursor() as cur:
+                placeholders = ", ".join(["%s"] * len(todo))
+                await cur.execute(
+                    f"SELECT `k`, `v`, {TTL_LEFT} FROM `kv` WHERE `k` IN ({placeholders}) AND {LIVE};",
+                    todo,
+                )
+                rows = {row[0]: row[1:] for row in await cur.fetchall()}
+    except Exception as e:
+        log(e)
+        return None
+    for key in todo:
+        value, left = rows.get(key, (None, None))
+        cache_fill(key, value, left, gens[key])
+        result[key] = value
+    return result
+
+
+async def mset(items: dict[str, str], ttl: int | None = None, ttls: dict[str, int] | None = None) -> Optional[int]:
+    """
+    批量写入（一条多行 INSERT ... ON DUPLICATE KEY UPDATE），返回写入的 key 数
+    ttl 对本批所有 key 生效，ttls 里单独给了有效秒数的 key 以 ttls 为准
+    """
+    if not items:
+        return 0
+    ttls = {k: (ttls or {}).get(k, ttl) for k in items}
+    bump_gen(items)
+    try:
+        async with get_conn("kv") as conn:
+            async with conn.cursor() as cur:
+                values = ", ".join(["(%s, %s, DATE_ADD(NOW(), INTERVAL %s SECOND))"] * len(items))
+                params = [x for k, v in items.items() for x in (k, v, ttls[k])]
+                await cur.execute(
+                    f"""
+                    INSERT INTO `kv` (`k`, `v`, `expires_at`)
+                    VALUES {values}
+                    ON DUPLICATE KEY UPDATE `v`=VALUES(`v`), `expires_at`=VALUES(`expires_at`);
+                    """,
+                    params,
+                )
+        bump_gen(items)
+        for key, value in items.items():
+            cache_put(key, value, ttls[key])
+        return len(items)
+    except Exception as e:
+        bump_gen(items)
+        for key in items:
+            kv_cache.delete(key)
+        log(e)
+
+
+async def scan(prefix: str, limit: int = 100, cursor: str | None = None, keys_only: bool = False) -> dict:
+    """
+    按前缀分页扫描，按 key 升序：
+    {"items": [{"k": ..., "v": ...}, ...], "next_cursor": str | None}
+    游标非法时抛 ValueError
+    """
+    limit = clamp_limit(limit)
+    sql, params = scan_sql(prefix, limit, cursor, keys_only)
+    async with get_conn("kv") as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(sql, params)
+            rows = await cur.fetchall()
+    return scan_page(rows, limit, keys_only)
+
+
+async def delete_expired(limit: int) -> int:
+    """删除最多 limit 条已过期的行（走 idx_expires_at），返回删除条数"""
+    async with get_conn("kv") as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(
+                "DELETE FROM `kv` WHERE `expires_at` <= NOW() ORDER BY `expires_at` LIMIT %s;",
+                (limit,),
+            )
+            return cur.rowcount
@@ -0,0 +1,91 @@
+"""
+异步数据库连接池（aiomysql），供 FastAPI 路由直接 await 使用，
+不阻塞事件循环，也不占用默认线程池。
+配置与同步连接池（app/db/pool.py）共用同一组 .env 变量。
+"""
+import asyncio
+from contextlib import asynccontextmanager
+import aiomysql
+import pymysql
+
+from app.db.pool import HOST, PORT, USER, PASSWORD, POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_RECYCLE
+
+_pools: dict[str, aiomysql.Pool] = {}
+_pools_lock = asyncio.Lock()
+
+
+async def get_pool(DB_NAME: str) -> aiomysql.Pool:
+    """按库名取异步连接池，不存在则创建"""
+    pool = _pools.get(DB_NAME)
+    if pool is None:
+        async with _pools_lock:
+            pool = _pools.get(DB_NAME)
+            if pool is None:
+                pool = await aiomysql.create_pool(
+                    host=HOST,
+                    port=PORT,
+                    user=USER,
+                    password=PASSWORD,
+                    db=DB_NAME,
+                    charset="utf8mb4",
+                    autocommit=True,  # 与同步版保持一致
+                    minsize=POOL_MIN_SIZE,
+                    maxsize=POOL_MAX_SIZE,
+                    pool_recycle=int(POOL_RECYCLE),
+                )
+                _pools[DB_NAME] = pool
+    return pool
+
+
+# 服务端的临时性错误：锁等待超时、死锁、连接数已满、正在关闭
+_TRANSIENT_SERVER_ERRORS = {1040, 1053, 1205, 1213}
+
+
+def is_transient_error(e: BaseException) -> bool:
+    """
+    连接/网络层面的错误（换一批数据重试也没用，应整体稍后重试），
+    与数据本身有问题（某一行非法，重试永远失败）区分开
+    """
+    if isinstance(e, (OSError, asyncio.TimeoutError, pymysql.err.InterfaceError)):
+        return True
+    if isinstance(e, pymysql.err.OperationalError) and e.args:
+        code = e.args[0]
+        # 2000 以上是客户端错误码（连不上、连接断开等）
+        return isinstance(code, int) and (code >= 2000 or code in _TRANSIENT_SERVER_ERRORS)
+    return False
+
+
+@asynccontextmanager
+async def get_conn(DB_NAME):
+    """
+    借一个异步连接，退出 async with 时自动归还：
+
+        async with get_conn("bills") as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(...)
+    """
+    pool = await get_pool(DB_NAME)
+    async with pool.acquire() as conn:
+        yield conn
+
+
+def aio_pool_stats() -> list[dict]:
+    return [
+        {
+            "db_name": name,
+            "size": p.size,
+            "idle": p.freesize,
+            "in_use": p.size - p.freesize,
+            "max_size": p.maxsize,
+        }
+        for name, p in list(_pools.items())
+    ]
+
+
+async def close_all_aio_pools():
+    pools = list(_pools.values())
+    _pools.clear()
+    for p in pools:
+        p.close()
+    for p in pools:
+        await p.wait_closed()
@@ -0,0 +1,214 @@
+"""
+position_record 的空间查询（依赖 pt 列上的 SPATIAL 索引，见 init.migrate_position_spatial）
+"""
+import math
+import aiomysql
+
+from app.core.logger import log
+from app.db.aio_pool import get_conn
+from app.functions.common.trajectory import simplify
+
+# 与 ST_Distance_Sphere 默认使用的球半径一致，粗筛范围才不会比精确过滤小
+_EARTH_RADIUS_M = 6370986.0
+# 粗筛矩形的额外余量，吸收浮点误差
+_BOX_PAD = 1.01
+
+
+def _box_wkt(min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> str:
+    """
+    经纬度矩形的 WKT（经度在前，配合 axis-order=long-lat 使用）
+    只用作 MBRContains 的包络：SRID 4326 下多边形的边是测地线，向极地方向会鼓出去，
+    ST_Within 会漏掉靠近极地一侧边缘的点；MBR 的边沿经线、纬线，才是真正的经纬度矩形
+    """
+    return (
+        f"POLYGON(({min_lon} {min_lat}, {max_lon} {min_lat}, {max_lon} {max_lat}, "
+        f"{min_lon} {max_lat}, {min_lon} {min_lat}))"
+    )
+
+
+def _radius_boxes(lat: float, lon: float, radius_m: float) -> list[tuple[float, float, float, float]]:
+    """
+    半径 radius_m 米的球冠的外接经纬度矩形（留少量余量），用于先走空间索引粗筛
+    经度半宽按球冠的最大经度跨度 asin(sin(r) / cos(lat)) 计算；圆覆盖极点时取整个经度范围
+    跨过 ±180° 经线时拆成两个矩形
+    """
+    r = radius_m * _BOX_PAD / _EARTH_RADIUS_M   # 角距离（弧度）
+    dlat = math.degrees(r)
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return [(max(min_lat, -90.0), -180.0, min(max_lat, 90.0), 180.0)]
+    ratio = math.sin(r) / math.cos(math.radians(lat))
+    if ratio >= 1.0:
+        return [(min_lat, -180.0, max_lat, 180.0)]
+    dlon = math.degrees(math.asin(ratio))
+    west, east = lon - dlon, lon + dlon
+    if west < -180.0:
+        return [(min_lat, -180.0, max_lat, east), (min_lat, west + 360.0, max_lat, 180.0)]
+    if east > 180.0:
+        return [(min_lat, west, max_lat, 180.0), (min_lat, -180.0, max_lat, east - 360.0)]
+    return [(min_lat, west, max_lat, east)]
+
+
+def _filters(name: str | None, start_time: str | None, end_time: str | None) -> tuple[str, list]:
+    where, params = "", []
+    if name:
+        where += " AND `name` = %s"
+        params.append(name)
+    if start_time:
+        where += " AND `time` >= %s"
+        params.append(start_time)
+    if end_time:
+        where += " AND `time` <= %s"
+        params.append(end_time)
+    return where, params
+
+
+async def records_within_radius(
+    lat: float,
+    lon: float,
+    radius_m: float,
+    name: str | None = None,
+    start_time: str | None = None,
+    end_time: str | None = None,
+    limit: int = 500,
+) -> list[dict]:
+    """
+    距 (lat, lon) 不超过 radius_m 米的记录，按距离由近到远
+    先用外接矩形（MBRContains）走空间索引，再用球面距离精确过滤
+    """
+    boxes = [_box_wkt(*b) for b in _radius_boxes(lat, lon, radius_m)]
+    center = f"POINT({lon} {lat})"
+    where, params = _filters(name, start_time, end_time)
+    in_box = " OR ".join(["MBRContains(ST_GeomFromText(%s, 4326, 'axis-order=long-lat'), `pt`)"] * len(boxes))
+
+    sql = f"""
+        SELECT `id`, `name`, `lat`, `lon`, `detail`, `time`,
+               ST_Distance_Sphere(`pt`, ST_GeomFromText(%s, 4326, 'axis-order=long-lat')) AS `distance`
+        FROM `position_record`
+        WHERE ({in_box}){where}
+        HAVING `distance` <= %s
+        ORDER BY `distance` ASC
+        LIMIT %s
+    """
+    try:
+        async with get_conn("record_position") as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(sql, [center, *boxes, *params, radius_m, limit])
+                return await cursor.fetchall()
+    except Exception as e:
+        log(e)
+        raise
+
+
+async def records_in_box(
+    min_lat: float,
+    min_lon: float,
+    max_lat: float,
+    max_lon: float,
+    name: str | None = None,
+    start_time: str | None = None,
+    end_time: str | None = None,
+    limit: int = 500,
+) -> list[dict]:
+    """矩形范围内（可再按时间/名称过滤）的记录，按时间排序"""
+    box = _box_wkt(min_lat, min_lon, max_lat, max_lon)
+    where, params = _filters(name, start_time, end_time)
+
+    sql = f"""
+        SELECT `id`, `name`, `lat`, `lon`, `detail`, `time`
+        FROM `position_record`
+        WHERE MBRContains(ST_GeomFromText(%s, 4326, 'axis-order=long-lat'), `pt`){where}
+        ORDER BY `time` ASC
+        LIMIT %s
+    """
+    try:
+        async with get_conn("record_position") as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(sql, [box, *params, limit])
+                return await cursor.fetchall()
+    except Exception as e:
+        log(e)
+        raise
+
+
+async def trajectory_points(name: str, start_time: str, end_time: str, limit: int) -> list[dict]:
+    """
+    某个名称在时间范围内的轨迹点（原始表 + 已压缩的汇总表），按时间排序，最多 limit 个
+    """
+    sql = """
+        SELECT `lat`, `lon`, `time` FROM `position_record`
+        WHERE `name` = %s AND `time` BETWEEN %s AND %s
+        UNION ALL
+        SELECT `lat`, `lon`, `time` FROM `position_summary`
+        WHERE `name` = %s AND `time` BETWEEN %s AND %s
+        ORDER BY `time` ASC
+        LIMIT %s
+    """
+    try:
+        async with get_conn("record_position") as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(sql, (name, start_time, end_time, name, start_time, end_time, limit))
+                return await cursor.fetchall()
+    except Exception as e:
+        log(e)
+        raise
+
+
+async def compaction_groups(cutoff, limit: int) -> list[tuple[str, object]]:
+    """
+    cutoff 当天之前、尚未压缩的 (name, 日期) 分组
+    compact_group 按整天压缩，所以只比较日期：cutoff 当天的点一个都不动
+    """
+    async with get_conn("record_position") as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                """
+                SELECT DISTINCT `name`, DATE(`time`) AS `day`
+                FROM `position_record`
+                WHERE `time` < DATE(%s)
+                LIMIT %s
+                """,
+                (cutoff, limit),
+            )
+            return list(await cursor.fetchall())
+
+
+async def compact_group(name: str, day, tolerance_m: float) -> tuple[int, int]:
+    """
+    把某人某天的原始点简化后写入 position_summary，并删除原始点（同一事务）
+    返回 (原始点数, 保留点数)
+    """
+    async with get_conn("record_position") as conn:
+        await conn.begin()
+        try:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(
+                    """
+                    SELECT `id`, `name`, `lat`, `lon`, `detail`, `time`
+                    FROM `position_record`
+                    WHERE `name` = %s AND `time` >= %s AND `time` < %s + INTERVAL 1 DAY
+                    ORDER BY `time` ASC, `id` ASC
+                    FOR UPDATE
+                    """,
+                    (name, day, day),
+                )
+                rows = await cursor.fetchall()
+                kept = simplify(rows, tolerance_m)
+
+                if kept:
+                    await cursor.executemany(
+                        "INSERT INTO `position_summary` (`name`, `lat`, `lon`, `detail`, `time`) VALUES (%s, %s, %s, %s, %s)",
+                        [(r["name"], r["lat"], r["lon"], r["detail"], r["time"]) for r in kept],
+                    )
+                ids = [r["id"] for r in rows]
+                for i in range(0, len(ids), 1000):
+                    chunk = ids[i:i + 1000]
+                    await cursor.execute(
+                        f"DELETE FROM `position_record` WHERE `id` IN ({', '.join(['%s'] * len(chunk))})",
+                        chunk,
+                    )
+            await conn.commit()
+        except Exception:
+            await conn.rollback()
+            raise
+    return len(rows), len(kept)
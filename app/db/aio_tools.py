@@ -0,0 +1,190 @@
+"""
+app/db/tools.py 的异步版本，SQL 与返回值保持一致
+"""
+import datetime as _dt
+from app.core.logger import log
+from app.db.aio_pool import get_conn
+from app.db.paging import encode_cursor, decode_cursor, clamp_limit
+from app.db.aio_bill_stats import stats_cache
+
+# GET /bills 默认返回的列（顺序即返回列表中的顺序）
+BILL_FIELDS = ["position", "type", "detail", "title", "amount", "created_at", "id"]
+
+
+INSERT_BILL_SQL = """
+    INSERT INTO bill (title, amount, type, detail, created_at, position)
+    VALUES (%s, %s, %s, %s, %s, %s)
+"""
+
+
+def bill_params(data: dict) -> tuple:
+    """INSERT_BILL_SQL 的参数（data 格式同 tools.insert_bill）"""
+    return (
+        data.get("title"),
+        data.get("amount"),
+        data.get("type"),
+        data.get("detail"),
+        data.get("time"),       # 映射到 created_at
+        data.get("position"),
+    )
+
+
+async def insert_bill(data: dict) -> int:
+    """
+    插入一条账单记录（data 格式同 tools.insert_bill），返回新账单 id
+    失败直接抛出，由调用方决定重试还是报错
+    """
+    async with get_conn("bills") as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(INSERT_BILL_SQL, bill_params(data))
+            bill_id = cursor.lastrowid
+    stats_cache.clear()
+    return bill_id
+
+
+async def update_bill(bill_id: int, data: dict) -> int:
+    """
+    按 id 修改一条账单记录（直接覆盖所有字段），返回受影响行数
+    """
+    try:
+        async with get_conn("bills") as conn:
+            async with conn.cursor() as cursor:
+                sql = """
+                    UPDATE bill
+                    SET title = %s,
+                        amount = %s,
+                        type = %s,
+                        detail = %s,
+                        created_at = %s,
+                        position = %s
+                    WHERE id = %s
+                """
+                rows = await cursor.execute(
+                    sql,
+                    (
+                        data.get("title"),
+                        data.get("amount"),
+                        data.get("type"),
+                        data.get("detail"),
+                        data.get("time"),   # 映射到 created_at
+                        data.get("position"),
+                        bill_id,
+                    ),
+                )
+        if rows:
+            stats_cache.clear()
+        return rows
+    except Exception as e:
+        # 不能返回 None：路由会把它当成“id 不存在”
+        log(e)
+        raise
+
+
+async def query_bills(start_time: str, end_time: str):
+    """
+    查询账单（按 created_at 时间范围），返回 tuple 列表：
+    (position, type, detail, title, amount, created_at, id)
+    """
+    try:
+        async with get_conn("bills") as conn:
+            async with conn.cursor() as cursor:
+                sql = """
+                    SELECT position, type, detail, title, amount, created_at, id
+
+                    FROM bill
+                    WHERE created_at BETWEEN %s AND %s
+                    ORDER BY created_at ASC;
+                """
+                await cursor.execute(sql, (start_time, end_time))
+                return await cursor.fetchall()
+    except Exception as e:
+        # 不能返回 None：路由会把它当成“没有账单”
+        log(e)
+        raise
+
+
+async def query_bills_page(
+    start_time: str,
+    end_time: str,
+    fields: list[str],
+    limit: int | None,
+    cursor: str | None = None,
+) -> dict:
+    """
+    按 (created_at, id) 做游标分页查询账单；limit 为 None 时不分页
+    fields 必须是 BILL_FIELDS 的子集；返回：
+    {"fields": [...], "items": [[...], ...], "next_cursor": str | None}
+    """
+    limit = clamp_limit(limit) if limit is not None else None
+    cols = ", ".join(f"`{f}`" for f in fields)
+
+    where = "created_at BETWEEN %s AND %s"
+    params = [start_time, end_time]
+    if cursor:
+        last_created_at, last_id = decode_cursor(cursor, (_dt.datetime, int))
+        where += " AND (created_at, id) > (%s, %s)"
+        params += [last_created_at, last_id]
+
+    sql = f"""
+        SELECT {cols}, created_at AS `_k1`, id AS `_k2`
+        FROM bill
+        WHERE {where}
+        ORDER BY created_at ASC, id ASC
+        {"LIMIT %s" if limit is not None else ""}
+    """
+    if limit is not None:
+        params.append(limit + 1)
+
+    async with get_conn("bills") as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(sql, params)
+            rows = await cur.fetchall()
+
+    has_more = limit is not None and len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = encode_cursor(list(rows[-1][-2:])) if has_more else None
+    return {
+        "fields": fields,
+        "items": [list(row[:-2]) for row in rows],
+        "next_cursor": next_cursor,
+    }
+
+
+async def insert_position(name: str, lat: float, lon: float, detail: str = None):
+    """插入一条位置记录"""
+    try:
+        async with get_conn("record_position") as conn:
+            async with conn.cursor() as cursor:
+                sql = """
+                    INSERT INTO position_record (name, lat, lon, detail)
+                    VALUES (%s, %s, %s, %s)
+                """
+                await cursor.execute(sql, (name, lat, lon, detail))
+    except Exception as e:
+        log(e)
+
+
+async def insert_positions(points: list[dict]) -> int:
+    """
+    批量插入位置记录（多行 INSERT），返回插入行数
+    points: [{"name": ..., "lat": ..., "lon": ..., "detail": ..., "time": ...}, ...]
+    没带 time 的点使用表默认值（当前时间）
+    """
+    with_time = [(p["name"], p["lat"], p["lon"], p.get("detail"), p["time"]) for p in points if p.get("time")]
+    without_time = [(p["name"], p["lat"], p["lon"], p.get("detail")) for p in points if not p.get("time")]
+
+    inserted = 0
+    async with get_conn("record_position") as conn:
+        async with conn.cursor() as cursor:
+            # executemany 会把 VALUES (%s, ...) 改写成一条多行 INSERT
+            if without_time:
+                inserted += await cursor.executemany(
+                    "INSERT INTO position_record (name, lat, lon, detail) VALUES (%s, %s, %s, %s)",
+                    without_time,
+                )
+            if with_time:
+                inserted += await cursor.executemany(
+                    "INSERT INTO position_record (name, lat, lon, detail, time) VALUES (%s, %s, %s, %s, %s)",
+                    with_time,
+                )
+    return inserted
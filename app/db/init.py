@@ -42,13 +42,118 @@ def init_position_db():
                     `lon` DOUBLE NOT NULL COMMENT '经度',
                     `detail` VARCHAR(500) DEFAULT NULL COMMENT '详情',
                     `time` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '记录时间',
-                    PRIMARY KEY (`id`)
+                    `pt` POINT AS (ST_SRID(POINT(`lat`, `lon`), 4326)) STORED NOT NULL SRID 4326 COMMENT '坐标（由 lat/lon 生成；SRID 4326 的轴顺序是纬度在前）',
+                    PRIMARY KEY (`id`),
+                    SPATIAL KEY `idx_pt` (`pt`)
                 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='位置记录表';
             """)
 
     finally:
         conn.close()
 
+def init_position_summary_db():
+    """初始化轨迹压缩后的汇总表 record_position.position_summary"""
+    conn = pymysql.connect(
+        host=HOST,
+        port=PORT,
+        user=USER,
+        password=PASSWORD,
+        database="record_position",
+        charset="utf8mb4",
+        autocommit=True
+    )
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS `position_summary` (
+                    `id` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT COMMENT '主键',
+                    `name` VARCHAR(255) NOT NULL COMMENT '名称',
+                    `lat` DOUBLE NOT NULL COMMENT '纬度',
+                    `lon` DOUBLE NOT NULL COMMENT '经度',
+                    `detail` VARCHAR(500) DEFAULT NULL COMMENT '详情',
+                    `time` TIMESTAMP NOT NULL COMMENT '记录时间',
+                    PRIMARY KEY (`id`),
+                    KEY `idx_name_time` (`name`, `time`)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='压缩后的历史轨迹点';
+            """)
+
+    finally:
+        conn.close()
+
+def migrate_position_spatial():
+    """
+    给已存在的 position_record 补上空间列和空间索引（可重复执行）
+    pt 是由 lat/lon 生成的存储列，写入方无需改动
+    """
+    conn = pymysql.connect(
+        host=HOST,
+        port=PORT,
+        user=USER,
+        password=PASSWORD,
+        database="record_position",
+        charset="utf8mb4",
+        autocommit=True
+    )
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA='record_position' AND TABLE_NAME='position_record' AND COLUMN_NAME='pt'"
+            )
+            if not cursor.fetchone()[0]:
+                cursor.execute("""
+                    ALTER TABLE `position_record`
+                    ADD COLUMN `pt` POINT AS (ST_SRID(POINT(`lat`, `lon`), 4326)) STORED NOT NULL SRID 4326 COMMENT '坐标（由 lat/lon 生成；SRID 4326 的轴顺序是纬度在前）'
+                """)
+
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.STATISTICS "
+                "WHERE TABLE_SCHEMA='record_position' AND TABLE_NAME='position_record' AND INDEX_NAME='idx_pt'"
+            )
+            if not cursor.fetchone()[0]:
+                cursor.execute("ALTER TABLE `position_record` ADD SPATIAL INDEX `idx_pt` (`pt`)")
+
+    finally:
+        conn.close()
+
+def migrate_kv_expiry():
+    """
+    给已存在的 kv 表补上过期时间列和索引（可重复执行）
+    """
+    conn = pymysql.connect(
+        host=HOST,
+        port=PORT,
+        user=USER,
+        password=PASSWORD,
+        database="kv",
+        charset="utf8mb4",
+        autocommit=True
+    )
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA='kv' AND TABLE_NAME='kv' AND COLUMN_NAME='expires_at'"
+            )
+            if not cursor.fetchone()[0]:
+                cursor.execute("""
+                    ALTER TABLE `kv`
+                    ADD COLUMN `expires_at` DATETIME NULL DEFAULT NULL COMMENT '过期时间，NULL 表示永不过期'
+                """)
+
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.STATISTICS "
+                "WHERE TABLE_SCHEMA='kv' AND TABLE_NAME='kv' AND INDEX_NAME='idx_expires_at'"
+            )
+            if not cursor.fetchone()[0]:
+                cursor.execute("ALTER TABLE `kv` ADD INDEX `idx_expires_at` (`expires_at`)")
+
+    finally:
+        conn.close()
+
 def init_bills_db():
     # 连接到 MySQL
     conn = pymysql.connect(
@@ -82,7 +187,8 @@ def init_bills_db():
                 `amount` DECIMAL(10,2) NOT NULL COMMENT '金额',
                 `title` VARCHAR(255) NOT NULL COMMENT '标题',
                 `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
-                PRIMARY KEY (`id`)
+                PRIMARY KEY (`id`),
+                KEY `idx_created_type_amount` (`created_at`, `type`, `amount`)
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='账单表';
             """
             cursor.execute(create_table_sql)
@@ -92,6 +198,80 @@ def init_bills_db():
 
 
 
+def init_jobs_db():
+    """初始化后台任务表 bills.bill_job（/book 账单识别任务）"""
+    conn = pymysql.connect(
+        host=HOST,
+        port=PORT,
+        user=USER,
+        password=PASSWORD,
+        charset="utf8mb4",
+        autocommit=True,
+    )
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "CREATE DATABASE IF NOT EXISTS `bills` "
+                "DEFAULT CHARACTER SET utf8mb4 "
+                "COLLATE utf8mb4_unicode_ci;"
+            )
+            cursor.execute("USE `bills`;")
+
+            create_table_sql = """
+            CREATE TABLE IF NOT EXISTS `bill_job` (
+                `id` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT COMMENT '任务ID',
+                `status` ENUM('queued','running','done','failed') NOT NULL DEFAULT 'queued' COMMENT '任务状态',
+                `position` TEXT COMMENT '位置',
+                `image` MEDIUMBLOB NULL COMMENT '待识别图片，完成后清空',
+                `attempts` INT NOT NULL DEFAULT 0 COMMENT '已执行次数',
+                `last_error` TEXT NULL COMMENT '最近一次错误',
+                `result` JSON NULL COMMENT '识别结果',
+                `created_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+                `updated_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+                    ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间',
+                PRIMARY KEY (`id`),
+                KEY `idx_status` (`status`)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='账单识别任务表';
+            """
+            cursor.execute(create_table_sql)
+
+    finally:
+        conn.close()
+
+
+def migrate_bill_job_bill_id():
+    """
+    给 bill_job 补上 bill_id 列（可重复执行）
+    完成任务时与账单插入在同一事务里写入，重复完成同一任务不会重复记账
+    """
+    conn = pymysql.connect(
+        host=HOST,
+        port=PORT,
+        user=USER,
+        password=PASSWORD,
+        database="bills",
+        charset="utf8mb4",
+        autocommit=True
+    )
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT COUNT(*) FROM information_schema.COLUMNS "
+                "WHERE TABLE_SCHEMA='bills' AND TABLE_NAME='bill_job' AND COLUMN_NAME='bill_id'"
+            )
+            if not cursor.fetchone()[0]:
+                cursor.execute("""
+                    ALTER TABLE `bill_job`
+                    ADD COLUMN `bill_id` BIGINT UNSIGNED NULL DEFAULT NULL COMMENT '识别成功后写入的账单ID'
+                """)
+
+    finally:
+        conn.close()
+
+
+
 def init_kv_db():
     # 连接到 MySQL
     conn = pymysql.connect(
@@ -123,7 +303,9 @@ def init_kv_db():
                 `v` LONGTEXT NULL,
                 `updated_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
                                 ON UPDATE CURRENT_TIMESTAMP,
-                PRIMARY KEY (`k`)
+                `expires_at` DATETIME NULL DEFAULT NULL COMMENT '过期时间，NULL 表示永不过期',
+                PRIMARY KEY (`k`),
+                KEY `idx_expires_at` (`expires_at`)
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
             """
             cursor.execute(create_table_sql)
@@ -145,10 +327,27 @@ def _safe_table_name(table_name: str) -> str:
         raise ValueError(f"非法表名: {table_name!r}（仅允许字母数字下划线，长度<=64）")
     return table_name
 
+# 日程删除记录表，所有日程表共用（与日程表在同一个库）
+_TOMBSTONE_DDL = """
+            CREATE TABLE IF NOT EXISTS `agenda_tombstone` (
+                `id` BIGINT UNSIGNED NOT NULL AUTO_INCREMENT COMMENT '主键ID',
+                `table_name` VARCHAR(64) NOT NULL COMMENT '日程表名',
+                `event_id` BIGINT UNSIGNED NOT NULL COMMENT '被删除记录的 id',
+                `uid` VARCHAR(255) NOT NULL COMMENT 'iCalendar UID',
+                `kind` ENUM('VEVENT','VTODO') NOT NULL COMMENT '类型',
+                `recurrence_id` DATETIME NULL COMMENT '重复事件单次实例标识',
+                `deleted_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '删除时间',
+                PRIMARY KEY (`id`),
+                KEY `idx_table_deleted` (`table_name`, `deleted_at`),
+                KEY `idx_deleted_at` (`deleted_at`)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='日程删除记录（增量同步用）';
+            """
+
 def init_agenda_db(table_name: str, db_name: str = "agenda"):
     """
     初始化数据库 + 用户表（表名由参数传入）
     表内同时存 VEVENT（日程）和 VTODO（待办）
+    同时建好该库的删除记录表（db_name 由调用方决定，不一定是 AGENDA_DB）
     """
     table_name = _safe_table_name(table_name)
 
@@ -204,10 +403,40 @@ def init_agenda_db(table_name: str, db_name: str = "agenda"):
                 PRIMARY KEY (`id`),
                 UNIQUE KEY `uniq_uid_kind_recur` (`uid`, `kind`, `recurrence_id`),
                 KEY `idx_time` (`dtstart`, `due`),
-                KEY `idx_status` (`status`)
+                KEY `idx_status` (`status`),
+                KEY `idx_updated_at` (`updated_at`)
             ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='用户日程/待办表';
             """
             cursor.execute(create_table_sql)
+            cursor.execute(_TOMBSTONE_DDL)
+
+    finally:
+        conn.close()
+
+def init_agenda_tombstone_db(db_name: str = "agenda"):
+    """
+    日程删除记录（墓碑），所有日程表共用；增量同步靠它告诉客户端哪些记录被删了
+    由 delete_event 在删除的同一事务里写入，超过保留期的由定时任务清理
+    """
+    conn = pymysql.connect(
+        host=HOST,
+        port=PORT,
+        user=USER,
+        password=PASSWORD,
+        charset="utf8mb4",
+        autocommit=True,
+    )
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                f"CREATE DATABASE IF NOT EXISTS `{db_name}` "
+                "DEFAULT CHARACTER SET utf8mb4 "
+                "COLLATE utf8mb4_unicode_ci;"
+            )
+            cursor.execute(f"USE `{db_name}`;")
+
+            cursor.execute(_TOMBSTONE_DDL)
 
     finally:
         conn.close()
@@ -1,93 +1,155 @@
-from dotenv import load_dotenv
-import os
-import pymysql
 from typing import Optional
+from app.core.cache import MISSING
 from app.core.logger import log
+from app.db.pool import get_conn
+# 与异步版共用同一份读缓存，见 app/db/aio_kv_tools.py
+from app.db.aio_kv_tools import kv_cache, cache_put, cache_fill, write_gen, bump_gen, ABSENT, LIVE, TTL_LEFT, split_cached, scan_sql, scan_page
+from app.db.paging import clamp_limit
 
 
-load_dotenv()
-
-HOST = os.getenv("HOST")
-PORT = int(os.getenv("PORT"))
-USER = os.getenv("USER")
-PASSWORD = os.getenv("PASSWORD")
-
-
-def get_conn(DB_NAME):
-    """获取一个连接到 bills 数据库的连接"""
-    conn = pymysql.connect(
-        host=HOST,
-        port=PORT,
-        user=USER,
-        password=PASSWORD,
-        database=DB_NAME,
-        charset="utf8mb4",
-        autocommit=True,  # 简化操作，不用手动 commit
-    )
-    return conn
-
-
-def has(key: str) -> bool:
-    conn = get_conn("bills")
+def _load(key: str):
+    """先查缓存，未命中再查库并回填；查库失败返回 MISSING（不缓存）"""
+    cached = kv_cache.get(key)
+    if cached is not MISSING:
+        return cached
+    gen = write_gen(key)
+    conn = get_conn("kv")
     try:
-
         with conn.cursor() as cur:
-            cur.execute(f"USE `kv`;")
             cur.execute(
-                f"SELECT 1 FROM `kv` WHERE `k`=%s LIMIT 1;",
+                f"SELECT `v`, {TTL_LEFT} FROM `kv` WHERE `k`=%s AND {LIVE} LIMIT 1;",
                 (key,),
             )
-            return cur.fetchone() is not None
+            row = cur.fetchone()
     except Exception as e:
         log(e)
+        return MISSING
     finally:
         conn.close()
+    value, left = (None, None) if row is None else row
+    cache_fill(key, value, left, gen)
+    return ABSENT if value is None else value
+def has(key: str) -> bool:
+    value = _load(key)
+    if value is MISSING:
+        return None
+    return value is not ABSENT
 def get(key: str) -> Optional[str]:
-    conn = get_conn("bills")
+    value = _load(key)
+    if value is MISSING or value is ABSENT:
+        return None
+    return value
+def set(key: str, value: str, ttl: int | None = None) -> None:
+    """ttl 为有效秒数，None 表示永不过期"""
+    bump_gen((key,))
+    conn = get_conn("kv")
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                INSERT INTO `kv` (`k`, `v`, `expires_at`)
+                VALUES (%s, %s, DATE_ADD(NOW(), INTERVAL %s SECOND))
+                ON DUPLICATE KEY UPDATE `v`=VALUES(`v`), `expires_at`=VALUES(`expires_at`);
+                """,
+                (key, value, ttl),
+            )
+        bump_gen((key,))
+        cache_put(key, value, ttl)
+    except Exception as e:
+        # 写库结果未知，丢掉缓存，下次从库里读
+        bump_gen((key,))
+        kv_cache.delete(key)
+        log(e)
+    finally:
+        conn.close()
+def delete(key: str) -> bool:
+    """删除成功返回 True；不存在返回 False"""
+    bump_gen((key,))
+    conn = get_conn("kv")
     try:
         with conn.cursor() as cur:
-            cur.execute(f"USE `kv`;")
             cur.execute(
-                f"SELECT `v` FROM `kv` WHERE `k`=%s LIMIT 1;",
+                f"DELETE FROM `kv` WHERE `k`=%s;",
                 (key,),
             )
-            row = cur.fetchone()
-            return None if row is None else row[0]
+            deleted = cur.rowcount > 0
+        bump_gen((key,))
+        cache_put(key, None)
+        return deleted
+
     except Exception as e:
+        bump_gen((key,))
+        kv_cache.delete(key)
         log(e)
     finally:
         conn.close()
-def set(key: str, value: str) -> None:
-    conn = get_conn("bills")
+def mget(keys: list[str]) -> Optional[dict[str, Optional[str]]]:
+    """批量读取，返回 {key: value}，不存在的 key 值为 None"""
+    result, todo = split_cached(keys)
+    if not todo:
+        return result
+    gens = {key: write_gen(key) for key in todo}
+    conn = get_conn("kv")
     try:
         with conn.cursor() as cur:
-            cur.execute(f"USE `kv`;")
+            placeholders = ", ".join(["%s"] * len(todo))
             cur.execute(
-                f"""
-                INSERT INTO `kv` (`k`, `v`)
-                VALUES (%s, %s)
-                ON DUPLICATE KEY UPDATE `v`=VALUES(`v`);
-                """,
-                (key, value),
+                f"SELECT `k`, `v`, {TTL_LEFT} FROM `kv` WHERE `k` IN ({placeholders}) AND {LIVE};",
+                todo,
             )
+            rows = {row[0]: row[1:] for row in cur.fetchall()}
     except Exception as e:
         log(e)
+        return None
     finally:
         conn.close()
-def delete(key: str) -> bool:
-    """删除成功返回 True；不存在返回 False"""
-    conn = get_conn("bills")
+    for key in todo:
+        value, left = rows.get(key, (None, None))
+        cache_fill(key, value, left, gens[key])
+        result[key] = value
+    return result
+def mset(items: dict[str, str], ttl: int | None = None, ttls: dict[str, int] | None = None) -> Optional[int]:
+    """
+    批量写入（一条多行 INSERT ... ON DUPLICATE KEY UPDATE），返回写入的 key 数
+    ttl 对本批所有 key 生效，ttls 里单独给了有效秒数的 key 以 ttls 为准
+    """
+    if not items:
+        return 0
+    ttls = {k: (ttls or {}).get(k, ttl) for k in items}
+    bump_gen(items)
+    conn = get_conn("kv")
     try:
         with conn.cursor() as cur:
-            cur.execute(f"USE `kv`;")
+            values = ", ".join(["(%s, %s, DATE_ADD(NOW(), INTERVAL %s SECOND))"] * len(items))
+            params = [x for k, v in items.items() for x in (k, v, ttls[k])]
             cur.execute(
-                f"DELETE FROM `kv` WHERE `k`=%s;",
-                (key,),
+                f"""
+                INSERT INTO `kv` (`k`, `v`, `expires_at`)
+                VALUES {values}
+                ON DUPLICATE KEY UPDATE `v`=VALUES(`v`), `expires_at`=VALUES(`expires_at`);
+                """,
+                params,
             )
-            return cur.rowcount > 0
-
+        bump_gen(items)
+        for key, value in items.items():
+            cache_put(key, value, ttls[key])
+        return len(items)
     except Exception as e:
+        bump_gen(items)
+        for key in items:
+            kv_cache.delete(key)
         log(e)
     finally:
         conn.close()
-
+def scan(prefix: str, limit: int = 100, cursor: str | None = None, keys_only: bool = False) -> dict:
+    """按前缀分页扫描，按 key 升序；游标非法时抛 ValueError"""
+    limit = clamp_limit(limit)
+    sql, params = scan_sql(prefix, limit, cursor, keys_only)
+    conn = get_conn("kv")
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            rows = cur.fetchall()
+    finally:
+        conn.close()
+    return scan_page(rows, limit, keys_only)
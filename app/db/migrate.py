@@ -0,0 +1,201 @@
+"""
+轻量级版本化迁移
+
+- 每个迁移有一个递增的版本号，已执行的版本记录在 app_meta.schema_migrations
+- 迁移本身写成可重复执行（建表用 IF NOT EXISTS，加列/加索引前先查 information_schema），
+  即使记录丢失重跑也不会出错
+- 日程表是按用户动态建的，这类迁移对 AGENDA_TABLES 里的每张表分别执行、分别记录
+
+启动时由 app.main 自动执行（RUN_MIGRATIONS=0 可关闭），也可手动：
+
+    uv run -m app.db.migrate
+"""
+import os
+import pymysql
+from dotenv import load_dotenv
+
+from app.core.logger import log
+from app.db.agenda import _SORT_EXPR, _RRULE_START_EXPR
+from app.db.init import (
+    HOST, PORT, USER, PASSWORD, _safe_table_name,
+    init_bills_db, init_position_db, init_kv_db, init_jobs_db, init_agenda_db,
+    init_position_summary_db, migrate_position_spatial, migrate_kv_expiry,
+    init_agenda_tombstone_db, migrate_bill_job_bill_id,
+)
+
+load_dotenv()
+
+# 需要迁移的日程表（逗号分隔）
+AGENDA_TABLES = [t.strip() for t in os.getenv("AGENDA_TABLES", "zdh").split(",") if t.strip()]
+AGENDA_DB = os.getenv("AGENDA_DB", "agenda")
+
+_META_DB = "app_meta"
+_LOCK_NAME = "app_schema_migrations"
+
+
+def _connect(database: str | None = None):
+    return pymysql.connect(
+        host=HOST,
+        port=PORT,
+        user=USER,
+        password=PASSWORD,
+        database=database,
+        charset="utf8mb4",
+        autocommit=True,
+    )
+
+
+def _has_index(cursor, db: str, table: str, index: str) -> bool:
+    cursor.execute(
+        "SELECT 1 FROM information_schema.STATISTICS "
+        "WHERE TABLE_SCHEMA=%s AND TABLE_NAME=%s AND INDEX_NAME=%s LIMIT 1",
+        (db, table, index),
+    )
+    return cursor.fetchone() is not None
+
+
+def _add_index(db: str, table: str, index: str, definition: str):
+    """索引不存在时才创建；definition 如 "(`created_at`)" """
+    conn = _connect(db)
+    try:
+        with conn.cursor() as cursor:
+            if not _has_index(cursor, db, table, index):
+                log(f"创建索引 {db}.{table}.{index}")
+                cursor.execute(f"ALTER TABLE `{table}` ADD INDEX `{index}` {definition}")
+    finally:
+        conn.close()
+
+
+# ---------- 迁移定义 ----------
+# 全局迁移：fn()
+# 日程表迁移：fn(table_name)，对 AGENDA_TABLES 中每张表各执行一次
+# 执行记录按 (版本号, 作用对象) 区分，所以两张列表各自的版本号不重复即可；
+# 执行时两张列表合并后按版本号排序（同号时全局迁移在前）。
+# 新迁移取两张列表里最大的版本号 + 1，这样不论加在哪张列表都排在已有迁移之后；已发布的版本号不能改
+
+def _bill_indexes():
+    # 以 created_at 开头的覆盖索引，按时间范围的查询和统计都走它
+    _add_index("bills", "bill", "idx_created_type_amount", "(`created_at`, `type`, `amount`)")
+
+
+def _position_indexes():
+    _add_index("record_position", "position_record", "idx_time", "(`time`)")
+    _add_index("record_position", "position_record", "idx_name_time", "(`name`, `time`)")
+
+
+def _agenda_tombstone():
+    init_agenda_tombstone_db(AGENDA_DB)
+
+
+def _agenda_table(table_name: str):
+    init_agenda_db(table_name, AGENDA_DB)
+
+
+def _agenda_sort_index(table_name: str):
+    # 与分页查询的排序表达式一致的函数索引（MySQL 8.0.13+）
+    _add_index(AGENDA_DB, table_name, "idx_sort", f"(({_SORT_EXPR}), `id`)")
+
+
+def _agenda_updated_index(table_name: str):
+    # 增量同步按 (updated_at, id) 翻页；二级索引自带主键，所以只建 updated_at
+    _add_index(AGENDA_DB, table_name, "idx_updated_at", "(`updated_at`)")
+
+
+def _agenda_recurrence_indexes(table_name: str):
+    # 窗口查询：重复记录按起点范围扫描；单次修改按 recurrence_id 取回（即使改到了窗口外）
+    _add_index(AGENDA_DB, table_name, "idx_rrule_start", f"(({_RRULE_START_EXPR}))")
+    _add_index(AGENDA_DB, table_name, "idx_recurrence_id", "(`recurrence_id`)")
+
+
+MIGRATIONS = [
+    (1, "bills 库与 bill 表", init_bills_db),
+    (2, "record_position 库与 position_record 表", init_position_db),
+    (3, "kv 库与 kv 表", init_kv_db),
+    (4, "账单识别任务表 bill_job", init_jobs_db),
+    (5, "bill 统计用覆盖索引", _bill_indexes),
+    (6, "position_record 空间列与 SPATIAL 索引", migrate_position_spatial),
+    (7, "position_record 时间索引", _position_indexes),
+    (8, "轨迹汇总表 position_summary", init_position_summary_db),
+    (10, "kv 过期时间列与索引", migrate_kv_expiry),
+    (11, "日程删除记录表 agenda_tombstone", _agenda_tombstone),
+    (13, "bill_job.bill_id 列", migrate_bill_job_bill_id),
+]
+
+AGENDA_MIGRATIONS = [
+    (1, "日程表", _agenda_table),
+    (9, "日程表分页排序索引", _agenda_sort_index),
+    (12, "日程表 updated_at 索引", _agenda_updated_index),
+    (14, "日程表重复规则起点与 recurrence_id 索引", _agenda_recurrence_indexes),
+]
+
+for _migrations in (MIGRATIONS, AGENDA_MIGRATIONS):
+    _versions = [v for v, _, _ in _migrations]
+    assert len(_versions) == len(set(_versions)), "同一张迁移列表内的版本号不能重复"
+
+
+# ---------- 执行 ----------
+
+def _ensure_meta(cursor):
+    cursor.execute(
+        f"CREATE DATABASE IF NOT EXISTS `{_META_DB}` "
+        "DEFAULT CHARACTER SET utf8mb4 "
+        "COLLATE utf8mb4_unicode_ci;"
+    )
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS `{_META_DB}`.`schema_migrations` (
+            `version` INT NOT NULL COMMENT '迁移版本号',
+            `target` VARCHAR(128) NOT NULL DEFAULT '' COMMENT '作用对象（日程表名，全局迁移为空）',
+            `name` VARCHAR(255) NOT NULL COMMENT '说明',
+            `applied_at` TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP COMMENT '执行时间',
+            PRIMARY KEY (`version`, `target`)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COMMENT='已执行的迁移';
+    """)
+
+
+def _planned() -> list[tuple[int, str, str, callable, tuple]]:
+    """(version, target, name, fn, args)，按版本号、对象排序"""
+    plan = [(v, "", name, fn, ()) for v, name, fn in MIGRATIONS]
+    for table in AGENDA_TABLES:
+        table = _safe_table_name(table)
+        plan += [(v, f"{AGENDA_DB}.{table}", name, fn, (table,)) for v, name, fn in AGENDA_MIGRATIONS]
+    return sorted(plan, key=lambda m: (m[0], m[1]))
+
+
+def run_migrations() -> list[str]:
+    """
+    执行所有未执行过的迁移，返回本次执行的迁移描述
+    用 MySQL 命名锁保证多个进程同时启动时只有一个在迁移
+    """
+    conn = _connect()
+    applied_now = []
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT GET_LOCK(%s, 60)", (_LOCK_NAME,))
+            if cursor.fetchone()[0] != 1:
+                raise RuntimeError("获取迁移锁超时")
+            try:
+                _ensure_meta(cursor)
+                cursor.execute(f"SELECT `version`, `target` FROM `{_META_DB}`.`schema_migrations`")
+                done = {(v, t) for v, t in cursor.fetchall()}
+
+                for version, target, name, fn, args in _planned():
+                    if (version, target) in done:
+                        continue
+                    desc = f"{version:04d} {name}" + (f" [{target}]" if target else "")
+                    log(f"执行迁移 {desc}")
+                    fn(*args)
+                    cursor.execute(
+                        f"INSERT INTO `{_META_DB}`.`schema_migrations` (`version`, `target`, `name`) VALUES (%s, %s, %s)",
+                        (version, target, name),
+                    )
+                    applied_now.append(desc)
+            finally:
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (_LOCK_NAME,))
+    finally:
+        conn.close()
+    return applied_now
+
+
+if __name__ == "__main__":
+    applied = run_migrations()
+    print("\n".join(applied) if applied else "没有需要执行的迁移")
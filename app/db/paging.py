@@ -0,0 +1,80 @@
+"""
+游标（keyset）分页与字段投影的公共小工具
+"""
+import base64
+import datetime as _dt
+import json
+
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(values: list) -> str:
+    """把最后一行的排序键编码成不透明游标（日期时间按 'YYYY-MM-DD HH:MM:SS' 存，MySQL 可直接比较）"""
+    def conv(v):
+        if isinstance(v, _dt.datetime):
+            return v.strftime("%Y-%m-%d %H:%M:%S")
+        if isinstance(v, _dt.date):
+            return v.strftime("%Y-%m-%d")
+        return v
+
+    raw = json.dumps([conv(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _cursor_value(v, kind: type):
+    if kind is _dt.datetime:
+        if isinstance(v, str):
+            try:
+                return _dt.datetime.strptime(v, "%Y-%m-%d %H:%M:%S")
+            except ValueError:
+                pass
+    elif kind is int:
+        if isinstance(v, int) and not isinstance(v, bool) and v >= 0:
+            return v
+    elif kind is str:
+        if isinstance(v, str):
+            return v
+    raise ValueError("非法游标")
+
+
+def decode_cursor(cursor: str, kinds: tuple[type, ...]) -> list:
+    """
+    解码 encode_cursor 产生的游标，并按 kinds（_dt.datetime / int / str）逐项校验类型，
+    被篡改的游标抛 ValueError（路由返回 400），而不是带着错误类型进 SQL
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except Exception:
+        raise ValueError("非法游标")
+    if not isinstance(values, list) or len(values) != len(kinds):
+        raise ValueError("非法游标")
+    return [_cursor_value(v, kind) for v, kind in zip(values, kinds)]
+
+
+def parse_fields(fields: str | None, allowed: list[str], required: tuple[str, ...] = ()) -> list[str]:
+    """
+    解析逗号分隔的字段列表并按白名单校验；为空时返回全部允许字段
+    required 中的字段总会带上（分页游标需要）
+    """
+    if not fields:
+        return list(allowed)
+    names = []
+    for name in fields.split(","):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in allowed:
+            raise ValueError(f"不支持的字段: {name!r}")
+        if name not in names:
+            names.append(name)
+    for name in required:
+        if name not in names:
+            names.append(name)
+    return names
+
+
+def clamp_limit(limit: int) -> int:
+    if limit < 1:
+        raise ValueError("limit 必须大于 0")
+    return min(limit, MAX_PAGE_SIZE)
@@ -0,0 +1,287 @@
+import threading
+import time
+from collections import deque
+from dotenv import load_dotenv
+import os
+import pymysql
+
+from app.core.logger import log
+
+load_dotenv()
+
+HOST = os.getenv("HOST")
+PORT = int(os.getenv("PORT"))
+USER = os.getenv("USER")
+PASSWORD = os.getenv("PASSWORD")
+
+# 连接池配置（均可通过 .env 覆盖）
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))          # 每个库常驻的最少连接数
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))         # 每个库允许的最大连接数
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))         # 借连接时最长等待秒数
+POOL_RECYCLE = float(os.getenv("DB_POOL_RECYCLE", "3600"))       # 空闲超过该秒数的连接直接回收重建
+POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", "30"))   # 空闲超过该秒数，借出前先 ping 一次
+POOL_IDLE_TIMEOUT = float(os.getenv("DB_POOL_IDLE_TIMEOUT", "300"))  # 超出 min_size 的连接空闲超过该秒数即关闭
+
+
+class PoolTimeout(Exception):
+    """在 POOL_TIMEOUT 内没有借到连接"""
+
+
+class _PooledConnection:
+    """
+    对 pymysql 连接的轻量包装：
+    close() 不会真正断开，而是把连接还回连接池，
+    其余属性/方法全部透传给底层连接，所以调用方的写法保持不变：
+
+        conn = get_conn("bills")
+        try:
+            with conn.cursor() as cursor:
+                ...
+        finally:
+            conn.close()
+    """
+
+    def __init__(self, pool: "ConnectionPool", raw: pymysql.connections.Connection):
+        self._pool = pool
+        self._raw = raw
+
+    def __getattr__(self, name):
+        raw = self.__dict__.get("_raw")
+        if raw is None:
+            raise pymysql.err.InterfaceError("连接已归还连接池")
+        return getattr(raw, name)
+
+    def close(self):
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool._release(raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    单个数据库的连接池（线程安全）
+    - 借出时做健康检查：空闲太久的先 ping，失效的丢弃重建
+    - 空闲超过 POOL_RECYCLE 的连接直接关闭，避免被 MySQL wait_timeout 断开
+    - 超出 min_size 的连接空闲超过 POOL_IDLE_TIMEOUT 后在借还时顺带关闭
+    - 记录等待时间等指标，见 stats()
+    """
+
+    def __init__(
+        self,
+        db_name: str,
+        min_size: int = POOL_MIN_SIZE,
+        max_size: int = POOL_MAX_SIZE,
+        timeout: float = POOL_TIMEOUT,
+        recycle: float = POOL_RECYCLE,
+        ping_after: float = POOL_PING_AFTER,
+        idle_timeout: float = POOL_IDLE_TIMEOUT,
+    ):
+        self.db_name = db_name
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self.idle_timeout = idle_timeout
+
+        self._cond = threading.Condition()
+        self._idle = deque()   # [(raw_conn, 归还时间)]
+        self._size = 0         # 已创建且未关闭的连接数（含借出中的）
+
+        # 指标
+        self._checkouts = 0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+        for _ in range(self.min_size):
+            try:
+                raw = self._connect()
+            except Exception as e:
+                log(f"连接池预热失败 db={db_name}: {e}", "WARNING")
+                break
+            with self._cond:
+                self._size += 1
+                self._created += 1
+                self._idle.append((raw, time.monotonic()))
+
+    def _connect(self) -> pymysql.connections.Connection:
+        conn = pymysql.connect(
+            host=HOST,
+            port=PORT,
+            user=USER,
+            password=PASSWORD,
+            database=self.db_name,
+            charset="utf8mb4",
+            autocommit=True,  # 简化操作，不用手动 commit
+        )
+        return conn
+
+    def _discard(self, raw):
+        self._close_raw(raw)
+        with self._cond:
+            self._size -= 1
+            self._discarded += 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_raw(raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _reap_locked(self) -> list:
+        """
+        持锁调用：从队首（最久未用）摘掉空闲超时的多余连接，返回待关闭的列表。
+        LIFO 复用下队首的连接一直轮不到借出，只能靠这里收缩。
+        """
+        now = time.monotonic()
+        reaped = []
+        while self._idle and self._size > self.min_size:
+            raw, idle_since = self._idle[0]
+            if now - idle_since < self.idle_timeout:
+                break
+            self._idle.popleft()
+            self._size -= 1
+            self._discarded += 1
+            reaped.append(raw)
+        return reaped
+
+    def _healthy(self, raw, idle_for: float) -> bool:
+        if not raw.open:
+            return False
+        if idle_for >= self.recycle:
+            return False
+        if idle_for >= self.ping_after:
+            try:
+                raw.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    def acquire(self) -> _PooledConnection:
+        start = time.monotonic()
+        deadline = start + self.timeout
+
+        while True:
+            raw = None
+            idle_since = None
+            need_new = False
+
+            with self._cond:
+                reaped = self._reap_locked()
+                while not self._idle and self._size >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(f"数据库 {self.db_name} 连接池已满（max={self.max_size}），等待超时")
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    raw, idle_since = self._idle.pop()
+                else:
+                    self._size += 1
+                    need_new = True
+
+            for r in reaped:
+                self._close_raw(r)
+
+            if need_new:
+                try:
+                    raw = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self._created += 1
+            elif not self._healthy(raw, time.monotonic() - idle_since):
+                self._discard(raw)
+                continue
+
+            waited = time.monotonic() - start
+            with self._cond:
+                self._checkouts += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+            return _PooledConnection(self, raw)
+
+    def _release(self, raw):
+        if not raw.open:
+            self._discard(raw)
+            return
+        with self._cond:
+            # LIFO：最近用过的连接最先被复用，队首的多余连接由 _reap_locked 收缩
+            self._idle.append((raw, time.monotonic()))
+            self._cond.notify()
+            reaped = self._reap_locked()
+        for r in reaped:
+            self._close_raw(r)
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+        for raw, _ in idle:
+            self._close_raw(raw)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "db_name": self.db_name,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "max_size": self.max_size,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "created": self._created,
+                "discarded": self._discarded,
+                "wait_avg_ms": round(self._wait_total / self._checkouts * 1000, 3) if self._checkouts else 0.0,
+                "wait_max_ms": round(self._wait_max * 1000, 3),
+            }
+
+
+_pools: dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(DB_NAME: str) -> ConnectionPool:
+    """按库名取连接池，不存在则创建"""
+    pool = _pools.get(DB_NAME)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(DB_NAME)
+            if pool is None:
+                pool = ConnectionPool(DB_NAME)
+                _pools[DB_NAME] = pool
+    return pool
+
+
+def get_conn(DB_NAME):
+    """从连接池借一个连接到 DB_NAME 的连接，用完调用 close() 归还"""
+    return get_pool(DB_NAME).acquire()
+
+
+def pool_stats() -> list[dict]:
+    """所有连接池的指标"""
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [p.stats() for p in pools]
+
+
+def close_all_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+    for p in pools:
+        p.close_all()
@@ -1,29 +1,7 @@
-from dotenv import load_dotenv
-import os
-import pymysql
-
 from app.core.logger import log
+from app.db.pool import get_conn
+from app.db.aio_bill_stats import stats_cache
 
-load_dotenv()
-
-HOST = os.getenv("HOST")
-PORT = int(os.getenv("PORT"))
-USER = os.getenv("USER")
-PASSWORD = os.getenv("PASSWORD")
-
-
-def get_conn(DB_NAME):
-    """获取一个连接到 bills 数据库的连接"""
-    conn = pymysql.connect(
-        host=HOST,
-        port=PORT,
-        user=USER,
-        password=PASSWORD,
-        database=DB_NAME,
-        charset="utf8mb4",
-        autocommit=True,  # 简化操作，不用手动 commit
-    )
-    return conn
 
 def insert_bill(data: dict):
     """
@@ -58,6 +36,7 @@ def insert_bill(data: dict):
                     data.get("position"),
                 ),
             )
+        stats_cache.clear()
     except Exception as e:
         log(e)
     finally:
@@ -107,6 +86,8 @@ def update_bill(bill_id: int, data: dict) -> int:
                     bill_id,
                 ),
             )
+        if rows:
+            stats_cache.clear()
         return rows 
     except Exception as e:
         log(e)
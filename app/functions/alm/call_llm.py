@@ -1,70 +1,113 @@
+import copy
 import os
 import datetime
+from contextlib import aclosing
 from fastapi import  UploadFile, HTTPException
-from app.functions.alm.prompts.prompts import CALENDAR_IMG_PROMPT, BILL_IMG_PROMPT, VCODE_IMG_PROMPT, VCODE_TEXT_PROMPT
+from app.functions.alm.prompts.prompts import (
+    CALENDAR_IMG_PROMPT, CALENDAR_IMG_TEMPLATE, BILL_IMG_PROMPT, BILL_IMG_TEMPLATE, VCODE_IMG_PROMPT, VCODE_TEXT_PROMPT,
+)
+from app.functions.alm.llm_client import chat_completion, message_content, stream_chat_completion
+from app.functions.alm import result_cache
+from app.functions.alm.image_prep import prepare_image
+from app.core.cache import MISSING
 import base64
 from dotenv import load_dotenv
-import requests
 import json
-import asyncio
-import httpx
-from app.db.tools import insert_bill
 from app.core.logger import log
 
 # 默认会加载当前工作目录下的 .env 文件
 load_dotenv()
 
+VL_MODEL = "Qwen/Qwen3-VL-235B-A22B-Instruct"
+TEXT_MODEL = "deepseek-ai/DeepSeek-V3.1-Terminus"
+
+
+def _image_payload(prompt: str, b64: str, mime: str = "image/png", json_mode: bool = True) -> dict:
+    """
+    图片识别请求体：系统提示词 + 一张 base64 图片
+    json_mode 为 True 时要求返回 JSON；提取码的提示词要的是一行纯文本，传 False
+    """
+    payload = {
+        "model": VL_MODEL,
+        "messages": [
+            {
+                "role": "system",
+                "content": [
+                    {
+                        "type": "text",
+                        "text":  prompt,
+                    }
+                ]
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": f"data:{mime};base64,{b64}"
+                        },
+                    },
+                ],
+            }
+        ],
+        "stream": False,
+        "temperature": 0,
+    }
+    if json_mode:
+        payload["response_format"] = {"type": "json_object"}
+    return payload
+
+
+def _text_payload(prompt: str, text: str) -> dict:
+    return {
+        "model": TEXT_MODEL,
+        "messages": [
+            {
+                "role": "system",
+                "content": [
+                    {
+                        "type": "text",
+                        "text":  prompt,
+                    }
+                ]
+            },
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text":  text,
+                    }
+                ],
+            }
+        ],
+        "stream": False,
+        "temperature": 0,
+    }
+
+
 async def calendar_llm(img: UploadFile) -> dict:
     try:
 
         content = await img.read()
-        b64 = base64.b64encode(content).decode("utf-8")
-
-        payload = {
-            "model": "Qwen/Qwen3-VL-235B-A22B-Instruct",
-            "response_format": {"type": "json_object"},
-            "messages": [
-                {
-                    "role": "system",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text":  CALENDAR_IMG_PROMPT,
-                        }
-                    ]
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{b64}"
-                            },
-                        },
-                    ],
-                }
-            ],
-            "stream": False,
-            "temperature": 0,
-        }
-
-        api_key = os.getenv("SILICONFLOW_API_KEY")
-        if not api_key:
-            raise HTTPException(status_code=500, detail="服务器未配置 API 密钥")
-
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        }
-
-        url = "https://api.siliconflow.cn/v1/chat/completions"
-
-        response = requests.post(url, json=payload, headers=headers, timeout=60)
-        resp_json = response.json()
-        content = resp_json["choices"][0]["message"]["content"]
+        # 提示词末尾带着启动时的时间，key 用不带时间的模板，重启后持久化缓存仍能命中
+        key = result_cache.cache_key(content, VL_MODEL, CALENDAR_IMG_TEMPLATE)
+        cached = await result_cache.get(key)
+        if cached is not MISSING:
+            # 返回副本，调用方改结果不会改到缓存
+            return copy.deepcopy(cached)
+
+        image, mime = await prepare_image(content)
+        b64 = base64.b64encode(image).decode("utf-8")
+
+        payload = _image_payload(CALENDAR_IMG_PROMPT, b64, mime)
+
+        resp_json = await chat_completion(payload)
+        content = message_content(resp_json)
         json_obj = json.loads(content)
-        return json_obj
+        await result_cache.set(key, json_obj)
+        return copy.deepcopy(json_obj)
 
 
     except Exception as e:
@@ -79,51 +122,19 @@ async def vcode_llm(img: UploadFile):
     try:
 
         content = await img.read()
-        b64 = base64.b64encode(content).decode("utf-8")
-
-        payload = {
-            "model": "Qwen/Qwen3-VL-235B-A22B-Instruct",
-            "response_format": {"type": "json_object"},
-            "messages": [
-                {
-                    "role": "system",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text":  VCODE_IMG_PROMPT,
-                        }
-                    ]
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{b64}"
-                            },
-                        },
-                    ],
-                }
-            ],
-            "stream": False,
-            "temperature": 0,
-        }
-
-        api_key = os.getenv("SILICONFLOW_API_KEY")
-        if not api_key:
-            raise HTTPException(status_code=500, detail="服务器未配置 API 密钥")
-
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        }
-
-        url = "https://api.siliconflow.cn/v1/chat/completions"
-
-        response = requests.post(url, json=payload, headers=headers, timeout=60)
-        resp_json = response.json()
-        content = resp_json["choices"][0]["message"]["content"]
+        key = result_cache.cache_key(content, VL_MODEL, VCODE_IMG_PROMPT)
+        cached = await result_cache.get(key)
+        if cached is not MISSING:
+            return cached
+
+        image, mime = await prepare_image(content)
+        b64 = base64.b64encode(image).decode("utf-8")
+
+        payload = _image_payload(VCODE_IMG_PROMPT, b64, mime)
+
+        resp_json = await chat_completion(payload)
+        content = message_content(resp_json)
+        await result_cache.set(key, content)
         return content
 
 
@@ -139,46 +150,10 @@ async def vcode_llm(img: UploadFile):
 async def vcode_llm_text(text):
     try:
 
-        payload = {
-            "model": "deepseek-ai/DeepSeek-V3.1-Terminus",
-            "messages": [
-                {
-                    "role": "system",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text":  VCODE_IMG_PROMPT,
-                        }
-                    ]
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text":  text,
-                        }
-                    ],
-                }
-            ],
-            "stream": False,
-            "temperature": 0,
-        }
-
-        api_key = os.getenv("SILICONFLOW_API_KEY")
-        if not api_key:
-            raise HTTPException(status_code=500, detail="服务器未配置 API 密钥")
-
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        }
-
-        url = "https://api.siliconflow.cn/v1/chat/completions"
-
-        response = requests.post(url, json=payload, headers=headers, timeout=60)
-        resp_json = response.json()
-        content = resp_json["choices"][0]["message"]["content"]
+        payload = _text_payload(VCODE_IMG_PROMPT, text)
+
+        resp_json = await chat_completion(payload)
+        content = message_content(resp_json)
         return content
 
 
@@ -195,67 +170,25 @@ async def bill_llm(content, position):
 
     try:
 
-        b64 = base64.b64encode(content).decode("utf-8")
-
-        payload = {
-            "model": "Qwen/Qwen3-VL-235B-A22B-Instruct",
-            "response_format": {"type": "json_object"},
-            "messages": [
-                {
-                    "role": "system",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text":  BILL_IMG_PROMPT,
-                        }
-                    ]
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{b64}"
-                            },
-                        },
-                    ],
-                }
-            ],
-            "stream": False,
-            "temperature": 0,
-        }
-
-        api_key = os.getenv("SILICONFLOW_API_KEY")
-        if not api_key:
-            raise HTTPException(status_code=500, detail="服务器未配置 API 密钥")
-
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json",
-        }
-
-        url = "https://api.siliconflow.cn/v1/chat/completions"
-
-        # 使用异步 HTTP 客户端避免在事件循环中阻塞
-        for _ in range(3):
-            try:
-                async with httpx.AsyncClient(timeout=60.0) as client:
-                    response = await client.post(url, json=payload, headers=headers)
-                break
-            except httpx.TimeoutException:
-                log("TimeoutException","ERROR")
-                continue
-        log("bill : " + str(response.json()) )
-
-
-        # async with httpx.AsyncClient(timeout=60.0) as client:
-        #     response = await client.post(url, json=payload, headers=headers)
-        resp_json = response.json()
-        json_obj = json.loads(content)
+        key = result_cache.cache_key(content, VL_MODEL, BILL_IMG_TEMPLATE)
+        recognized = await result_cache.get(key)
+        if recognized is MISSING:
+            image, mime = await prepare_image(content)
+            b64 = base64.b64encode(image).decode("utf-8")
+
+            payload = _image_payload(BILL_IMG_PROMPT, b64, mime)
+
+            # 共享的异步客户端负责连接复用、并发限制与超时重试
+            resp_json = await chat_completion(payload)
+            log("bill : " + str(resp_json) )
+
+            recognized = json.loads(message_content(resp_json))
+            await result_cache.set(key, recognized)
+
+        # 缓存里存的是识别结果本身，位置每次单独附加
+        # 入库由 bill_jobs 在完成任务时与任务状态放在同一事务里写
+        json_obj = dict(recognized)
         json_obj['position'] = position
-        # 将同步的数据库插入放到线程池中执行，防止阻塞事件循环
-        await asyncio.to_thread(insert_bill, json_obj)
         return json_obj
 
 
@@ -264,3 +197,100 @@ async def bill_llm(content, position):
             status_code=500,
             detail=str(e),
         )
+
+
+
+# ---------- 流式（SSE）版本 ----------
+# 事件：delta（{"text": 增量文本}）若干个，最后一个 result（最终结果）或 error（{"detail": ...}）
+
+def sse_event(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def _finish_json(text: str, delta: str, done: bool):
+    """已收到的内容构成完整 JSON 对象时返回该对象；只在收到 } 时尝试解析"""
+    if done:
+        return json.loads(text)
+    if "}" not in delta:
+        return None
+    try:
+        obj, _ = json.JSONDecoder().raw_decode(text.lstrip())
+    except ValueError:
+        return None
+    return obj
+
+
+def _finish_code(text: str, delta: str, done: bool):
+    """提取码只占一行：第一行写完（出现换行）就可以结束"""
+    stripped = text.strip()
+    if done:
+        return stripped
+    if "\n" in delta and stripped:
+        return stripped.splitlines()[0].strip()
+    return None
+
+
+async def _sse_completion(payload: dict, finish, cache_key: str | None = None, cache_early: bool = False):
+    """
+    转发模型的流式输出；finish(全文, 本次增量, 是否结束) 返回非 None 时
+    立刻关闭上游请求并把它作为 result 发出，不必等模型生成完
+    cache_key 与非流式版本共用，所以默认只缓存完整生成的结果；
+    提前结束的结果与完整结果一定相同时（完整的 JSON 对象）才传 cache_early=True
+    """
+    text = ""
+    result = None
+    early = False
+    try:
+        async with aclosing(stream_chat_completion(payload)) as stream:
+            async for delta in stream:
+                text += delta
+                yield sse_event("delta", {"text": delta})
+                result = finish(text, delta, False)
+                if result is not None:
+                    early = True
+                    break
+        if result is None:
+            result = finish(text, "", True)
+        if cache_key is not None and (cache_early or not early):
+            await result_cache.set(cache_key, result)
+        yield sse_event("result", result)
+    except Exception as e:
+        log(f"LLM 流式调用失败: {e}", "ERROR")
+        detail = e.detail if isinstance(e, HTTPException) else str(e)
+        yield sse_event("error", {"detail": detail})
+
+
+async def _image_sse(content: bytes, prompt: str, finish, json_mode: bool, key_prompt: str | None = None):
+    """
+    key_prompt：算缓存 key 用的提示词，与非流式版本一致（默认同 prompt）
+    返回格式也算进 key：纯文本模式的结果与非流式的 JSON 模式结果分开缓存
+    """
+    key = result_cache.cache_key(content, VL_MODEL, key_prompt or prompt, "json" if json_mode else "text")
+    cached = await result_cache.get(key)
+    if cached is not MISSING:
+        yield sse_event("result", cached)
+        return
+    try:
+        image, mime = await prepare_image(content)
+    except Exception as e:
+        yield sse_event("error", {"detail": str(e)})
+        return
+    b64 = base64.b64encode(image).decode("utf-8")
+    payload = _image_payload(prompt, b64, mime, json_mode)
+    async for chunk in _sse_completion(payload, finish, key, cache_early=json_mode):
+        yield chunk
+
+
+def calendar_llm_sse(content: bytes):
+    """calendar_llm 的流式版本，content 为图片字节"""
+    return _image_sse(content, CALENDAR_IMG_PROMPT, _finish_json, json_mode=True, key_prompt=CALENDAR_IMG_TEMPLATE)
+
+
+def vcode_llm_sse(content: bytes):
+    """vcode_llm 的流式版本，content 为图片字节"""
+    return _image_sse(content, VCODE_IMG_PROMPT, _finish_code, json_mode=False)
+
+
+def vcode_llm_text_sse(text: str):
+    """vcode_llm_text 的流式版本"""
+    return _sse_completion(_text_payload(VCODE_IMG_PROMPT, text), _finish_code)
@@ -0,0 +1,113 @@
+"""
+图片预处理：在发给 LLM 之前缩小图片体积
+
+解码 -> 按 EXIF 摆正 -> （可选）裁掉四周留白 -> 长边缩到 IMG_MAX_EDGE -> 重新编码
+CPU 密集的缩放放在进程池里执行，不阻塞事件循环。
+处理失败或处理后反而更大时，原样返回原图，并给出按文件头识别的正确 MIME。
+"""
+import asyncio
+import io
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dotenv import load_dotenv
+
+from app.core.logger import log
+
+load_dotenv()
+
+IMG_PREP_ENABLED = os.getenv("IMG_PREP_ENABLED", "1") == "1"
+IMG_MAX_EDGE = int(os.getenv("IMG_MAX_EDGE", "1600"))
+IMG_FORMAT = os.getenv("IMG_FORMAT", "JPEG").upper()          # JPEG / WEBP / PNG
+IMG_QUALITY = int(os.getenv("IMG_QUALITY", "85"))
+IMG_CROP_WHITESPACE = os.getenv("IMG_CROP_WHITESPACE", "1") == "1"
+IMG_PREP_WORKERS = int(os.getenv("IMG_PREP_WORKERS", "2"))
+
+_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png", "GIF": "image/gif"}
+
+_executor: ProcessPoolExecutor | None = None
+
+
+def sniff_mime(content: bytes) -> str:
+    """按文件头判断图片类型，认不出来时按 png 处理（与原先行为一致）"""
+    if content.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if content.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if content[:4] == b"RIFF" and content[8:12] == b"WEBP":
+        return "image/webp"
+    if content[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    return "image/png"
+
+
+def _crop_whitespace(im, threshold: int = 12):
+    """以左上角像素为背景色，裁掉四周与背景色接近的边"""
+    from PIL import Image, ImageChops
+
+    rgb = im.convert("RGB")
+    bg = Image.new("RGB", rgb.size, rgb.getpixel((0, 0)))
+    diff = ImageChops.difference(rgb, bg).convert("L").point(lambda p: 255 if p > threshold else 0)
+    bbox = diff.getbbox()
+    if bbox and bbox != (0, 0) + im.size:
+        return im.crop(bbox)
+    return im
+
+
+def _process(content: bytes, max_edge: int, fmt: str, quality: int, crop: bool) -> tuple[bytes, str]:
+    """在子进程中执行：返回 (图片字节, MIME)"""
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(content)) as src:
+        im = ImageOps.exif_transpose(src)
+        if crop:
+            im = _crop_whitespace(im)
+        if max(im.size) > max_edge:
+            im.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        if fmt == "JPEG" and im.mode != "RGB":
+            # JPEG 不支持透明通道，铺到白底上
+            rgba = im.convert("RGBA")
+            im = Image.new("RGB", rgba.size, (255, 255, 255))
+            im.paste(rgba, mask=rgba.getchannel("A"))
+
+        out = io.BytesIO()
+        save_kwargs = {"optimize": True}
+        if fmt in ("JPEG", "WEBP"):
+            save_kwargs["quality"] = quality
+        im.save(out, format=fmt, **save_kwargs)
+
+    data = out.getvalue()
+    if len(data) >= len(content):
+        return content, sniff_mime(content)
+    return data, _MIME.get(fmt, "image/png")
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=IMG_PREP_WORKERS)
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def prepare_image(content: bytes) -> tuple[bytes, str]:
+    """
+    压缩图片，返回 (图片字节, MIME)
+    """
+    if not IMG_PREP_ENABLED:
+        return content, sniff_mime(content)
+
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(
+            _get_executor(), _process, content, IMG_MAX_EDGE, IMG_FORMAT, IMG_QUALITY, IMG_CROP_WHITESPACE
+        )
+    except Exception as e:
+        log(f"图片预处理失败，使用原图: {e}", "WARNING")
+        return content, sniff_mime(content)
@@ -0,0 +1,188 @@
+"""
+长连接复用的异步 LLM 客户端（SiliconFlow OpenAI 兼容接口）
+
+- 进程内共享一个 httpx.AsyncClient（HTTP/2 + keep-alive 连接池），不再每次请求新建
+- 全局并发上限 + 按模型的并发上限，一个慢模型不会占满所有请求
+- chat_completion() 统一负责鉴权、超时、重试
+- stream_chat_completion() 为流式版本，逐段产出回复文本
+"""
+import asyncio
+import json
+import os
+from contextlib import asynccontextmanager
+import httpx
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from app.core.logger import log
+
+load_dotenv()
+
+LLM_BASE_URL = os.getenv("LLM_BASE_URL", "https://api.siliconflow.cn/v1")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "3"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "10"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+# 按模型限流，格式："模型A=4,模型B=8"；未列出的模型只受全局上限约束
+LLM_MODEL_CONCURRENCY = os.getenv("LLM_MODEL_CONCURRENCY", "")
+
+# 需要重试的状态码：限流 + 服务端错误
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+def _parse_model_limits(spec: str) -> dict[str, int]:
+    limits = {}
+    for item in spec.split(","):
+        name, sep, n = item.strip().rpartition("=")
+        if sep and name and n.strip().isdigit():
+            limits[name.strip()] = int(n)
+    return limits
+
+
+_model_limits = _parse_model_limits(LLM_MODEL_CONCURRENCY)
+_global_sem = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+_model_sems: dict[str, asyncio.Semaphore] = {}
+_client: httpx.AsyncClient | None = None
+
+
+def get_client() -> httpx.AsyncClient:
+    """取共享的 AsyncClient，首次调用时创建"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            base_url=LLM_BASE_URL,
+            http2=True,
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_KEEPALIVE,
+            ),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _model_sem(model: str) -> asyncio.Semaphore | None:
+    limit = _model_limits.get(model)
+    if limit is None:
+        return None
+    sem = _model_sems.get(model)
+    if sem is None:
+        sem = _model_sems[model] = asyncio.Semaphore(limit)
+    return sem
+
+
+def _headers() -> dict:
+    api_key = os.getenv("SILICONFLOW_API_KEY")
+    if not api_key:
+        raise HTTPException(status_code=500, detail="服务器未配置 API 密钥")
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+    }
+
+
+@asynccontextmanager
+async def _slot(model_sem: asyncio.Semaphore | None):
+    """
+    占一个并发名额：先按模型、再全局
+    某个模型排满时请求只在自己的信号量上等待，不会占着全局名额饿死其他模型
+    """
+    if model_sem is None:
+        async with _global_sem:
+            yield
+        return
+    async with model_sem:
+        async with _global_sem:
+            yield
+
+
+async def _post_with_retry(payload: dict, headers: dict, model_sem: asyncio.Semaphore | None) -> dict:
+    client = get_client()
+    last_exc = None
+    for attempt in range(LLM_RETRIES):
+        try:
+            # 名额只在单次请求期间占用，退避等待时释放
+            async with _slot(model_sem):
+                response = await client.post("/chat/completions", json=payload, headers=headers)
+            if response.status_code in _RETRY_STATUS and attempt < LLM_RETRIES - 1:
+                log(f"LLM 返回 {response.status_code}，第 {attempt + 1} 次重试", "WARNING")
+            else:
+                response.raise_for_status()
+                return response.json()
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            last_exc = e
+            log(f"{type(e).__name__}: {e}", "ERROR")
+        if attempt < LLM_RETRIES - 1:
+            await asyncio.sleep(min(2 ** attempt, 8))
+    raise last_exc or RuntimeError("LLM 请求失败")
+
+
+async def chat_completion(payload: dict) -> dict:
+    """
+    调用 /chat/completions，返回响应 JSON
+    受全局与按模型的并发上限约束；超时/网络错误/429/5xx 会指数退避重试
+    """
+    headers = _headers()
+    return await _post_with_retry(payload, headers, _model_sem(payload.get("model", "")))
+
+
+def message_content(resp_json: dict) -> str:
+    """取第一条回复的文本内容"""
+    return resp_json["choices"][0]["message"]["content"]
+
+
+async def _stream_with_retry(payload: dict, headers: dict, model_sem: asyncio.Semaphore | None):
+    client = get_client()
+    last_exc = None
+    started = False
+    for attempt in range(LLM_RETRIES):
+        try:
+            async with _slot(model_sem), \
+                    client.stream("POST", "/chat/completions", json=payload, headers=headers) as response:
+                if response.status_code in _RETRY_STATUS and attempt < LLM_RETRIES - 1:
+                    log(f"LLM 返回 {response.status_code}，第 {attempt + 1} 次重试", "WARNING")
+                else:
+                    if response.is_error:
+                        await response.aread()
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            return
+                        choices = json.loads(data).get("choices") or []
+                        delta = (choices[0].get("delta") or {}).get("content") if choices else None
+                        if delta:
+                            started = True
+                            yield delta
+                    return
+        except (httpx.TimeoutException, httpx.TransportError) as e:
+            # 已经输出过内容就不能重试，否则调用方会收到重复的文本
+            if started:
+                raise
+            last_exc = e
+            log(f"{type(e).__name__}: {e}", "ERROR")
+        if attempt < LLM_RETRIES - 1:
+            await asyncio.sleep(min(2 ** attempt, 8))
+    raise last_exc or RuntimeError("LLM 请求失败")
+
+
+async def stream_chat_completion(payload: dict):
+    """
+    流式调用 /chat/completions（SSE），逐段产出回复文本
+    并发名额在整个流期间保持占用（退避等待时释放）；只在开始输出之前重试
+    调用方用 contextlib.aclosing 提前结束时会关闭上游连接，模型不再继续生成
+    """
+    headers = _headers()
+    payload = {**payload, "stream": True}
+    async for delta in _stream_with_retry(payload, headers, _model_sem(payload.get("model", ""))):
+        yield delta
@@ -10,7 +10,8 @@ def get_beijing_time():
 
 
 
-CALENDAR_IMG_PROMPT = """
+# 不带当前时间的模板，识别结果缓存的 key 用它（带时间的提示词每次启动都不同）
+CALENDAR_IMG_TEMPLATE = """
 你是一个事件分类助手。你的任务是从用户提供的图片中判断：
 
 1. 是否含有具体时间（如：今天下午3点、明天上午、5月2日10点-12点）
@@ -49,7 +50,8 @@ CALENDAR_IMG_PROMPT = """
 总之任何有可能是时间的信息，你都要利用起来
 
 当前的时间是：
-"""  + str(get_beijing_time())
+"""
+CALENDAR_IMG_PROMPT = CALENDAR_IMG_TEMPLATE + str(get_beijing_time())
 
 
 
@@ -96,7 +98,7 @@ CALENDAR_PROMPT = """
 """ + str(get_beijing_time())
 
 
-BILL_IMG_PROMPT =  """
+BILL_IMG_TEMPLATE = """
 
 你是一个记账助手，请从图片中提取五项内容: 
 1. 金额amount(返回纯数字,如 23.50)
@@ -110,7 +112,8 @@ BILL_IMG_PROMPT =  """
 注意,返回的时间格式为 YYYY-MM-DD HH:mm.
 
 当前的时间是：
-""" + str(get_beijing_time())
+"""
+BILL_IMG_PROMPT = BILL_IMG_TEMPLATE + str(get_beijing_time())
 # 账单时间,如果图片中存在时间的话,请返回图片中的时间,否则请返回当前时间.因为有可能不是付款以后立刻记账的.
 VCODE_IMG_PROMPT = """ 
 请从我提供的图片中自动识别以下内容：
@@ -0,0 +1,90 @@
+"""
+图片识别结果缓存
+
+key = SHA-256(模型 + 返回格式 + 提示词 + 图片字节)，同一张截图重复上传（重试、连点）直接命中，
+不再重复调用 Qwen3-VL。
+- 一级：进程内 LRU（LLM_CACHE_SIZE 条，LLM_CACHE_TTL 秒）
+- 二级（可选，LLM_CACHE_PERSIST=1）：写入现有 kv 表，进程重启后仍可命中
+"""
+import hashlib
+import json
+import os
+import time
+from dotenv import load_dotenv
+
+from app.core.cache import TTLCache, MISSING
+from app.core.logger import log
+from app.db import aio_kv_tools
+
+load_dotenv()
+
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "256"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+LLM_CACHE_PERSIST = os.getenv("LLM_CACHE_PERSIST", "0") == "1"
+
+_KV_PREFIX = "llm_cache:"
+
+_memory = TTLCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL)
+_persist_hits = 0
+_persist_misses = 0
+
+
+def cache_key(content: bytes, model: str, prompt: str, fmt: str = "json") -> str:
+    """
+    prompt 要传不随启动变化的文本（如 CALENDAR_IMG_TEMPLATE），否则重启后持久化缓存永远不命中
+    fmt 为请求的返回格式（json/text），格式不同的结果不能共用一条缓存
+    """
+    h = hashlib.sha256()
+    h.update(model.encode("utf-8"))
+    h.update(b"\0")
+    h.update(fmt.encode("utf-8"))
+    h.update(b"\0")
+    h.update(hashlib.sha256(prompt.encode("utf-8")).digest())
+    h.update(content)
+    return h.hexdigest()
+
+
+async def get(key: str):
+    """命中返回缓存结果，否则返回 MISSING"""
+    global _persist_hits, _persist_misses
+
+    value = _memory.get(key)
+    if value is not MISSING or not LLM_CACHE_PERSIST:
+        return value
+
+    try:
+        raw = await aio_kv_tools.get(_KV_PREFIX + key)
+        item = json.loads(raw) if raw else None
+    except Exception as e:
+        log(e)
+        item = None
+
+    remaining = item["expires_at"] - time.time() if item else 0
+    if remaining <= 0:
+        _persist_misses += 1
+        if item:
+            await aio_kv_tools.delete(_KV_PREFIX + key)
+        return MISSING
+
+    _persist_hits += 1
+    _memory.set(key, item["value"], ttl=remaining)
+    return item["value"]
+
+
+async def set(key: str, value) -> None:
+    _memory.set(key, value)
+    if LLM_CACHE_PERSIST:
+        item = {"expires_at": time.time() + LLM_CACHE_TTL, "value": value}
+        # kv 层的过期时间让定时任务能清掉过期结果；读取仍以 item 里的 expires_at 为准
+        await aio_kv_tools.set(_KV_PREFIX + key, json.dumps(item, ensure_ascii=False), ttl=int(LLM_CACHE_TTL))
+
+
+def stats() -> dict:
+    return {
+        "memory": _memory.stats(),
+        "persist": {
+            "enabled": LLM_CACHE_PERSIST,
+            "hits": _persist_hits,
+            "misses": _persist_misses,
+        },
+    }
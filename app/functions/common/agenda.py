@@ -1,4 +1,11 @@
 import datetime as _dt
+from dataclasses import dataclass
+import pymysql
+
+from app.db.agenda import _safe_table_name
+from app.db.pool import get_conn
+from app.functions.common import ics_cache
+from app.functions.common.recurrence import check_tzid
 
 def _utc_now_dtstamp() -> str:
     return _dt.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
@@ -29,46 +36,217 @@ def _to_datetime(v):
         return _dt.datetime.strptime(s, "%Y-%m-%d %H:%M:%S")
     raise TypeError(f"Unsupported datetime value: {type(v)}")
 
-def _fold_ical_line(line: str, limit_octets: int = 75) -> str:
+def _fold_ical_bytes(b: bytes, limit_octets: int = 75) -> bytes:
     """
-    iCalendar 行折叠：每行 <= 75 octets（UTF-8 计字节），续行以 CRLF + 空格开头
+    iCalendar 行折叠（按字节）：每个物理行 <= 75 octets（含续行开头的空格），续行以 CRLF + 空格开头
+    直接在 UTF-8 字节上切分，遇到多字节字符的续字节（0b10xxxxxx）往前退，保证不切断字符
     """
-    b = line.encode("utf-8")
     if len(b) <= limit_octets:
-        return line
+        return b
 
     parts = []
-    cur = ""
-    cur_bytes = 0
-
-    for ch in line:
-        cb = ch.encode("utf-8")
-        if cur_bytes + len(cb) > limit_octets:
-            parts.append(cur)
-            cur = ch
-            cur_bytes = len(cb)
-        else:
-            cur += ch
-            cur_bytes += len(cb)
-
-    if cur:
-        parts.append(cur)
+    start = 0
+    limit = limit_octets
+    n = len(b)
+    while n - start > limit:
+        cut = start + limit
+        while b[cut] & 0xC0 == 0x80:
+            cut -= 1
+        parts.append(b[start:cut])
+        start = cut
+        limit = limit_octets - 1   # 续行要留出开头的空格
+    parts.append(b[start:])
 
     # 续行以一个空格开头
-    return "\r\n ".join(parts)
+    return b"\r\n ".join(parts)
 
-def _prop(name: str, value: str, params: dict | None = None) -> str:
+def _fold_ical_line(line: str, limit_octets: int = 75) -> str:
     """
-    生成属性行：NAME(;PARAM=...):VALUE
+    iCalendar 行折叠：每行 <= 75 octets（UTF-8 计字节），续行以 CRLF + 空格开头
+    """
+    return _fold_ical_bytes(line.encode("utf-8"), limit_octets).decode("utf-8")
+
+def _prop(name: str, value: str, params: dict | None = None) -> bytes:
+    """
+    生成属性行（UTF-8 字节）：NAME(;PARAM=...):VALUE
     自动折行（folding）
     """
     if value is None:
-        return ""
+        return b""
     params_str = ""
     if params:
         params_str = "".join([f";{k}={v}" for k, v in params.items()])
     line = f"{name}{params_str}:{value}"
-    return _fold_ical_line(line)
+    return _fold_ical_bytes(line.encode("utf-8"))
+
+def _join(lines: list[bytes]) -> bytes:
+    """拼成若干行，每行以 CRLF 结尾，空行（值为 None 的属性）跳过"""
+    return b"".join(ln + b"\r\n" for ln in lines if ln)
+
+def _calendar_header(cal_name: str, tzid: str, now_stamp: str) -> bytes:
+    lines = []
+    lines.append(b"BEGIN:VCALENDAR")
+    lines.append(b"VERSION:2.0")
+    lines.append(_prop("PRODID", "-//your.app//Agenda Plugin//EN"))
+    lines.append(_prop("X-WR-CALNAME", cal_name))
+    lines.append(_prop("NAME", cal_name))
+    lines.append(_prop("REFRESH-INTERVAL", "P5M", params={"VALUE": "DURATION"}))
+    lines.append(b"CALSCALE:GREGORIAN")
+
+    # VTIMEZONE（按你示例的 Asia/Shanghai 模板输出）
+    lines.append(b"BEGIN:VTIMEZONE")
+    lines.append(_prop("TZID", tzid))
+    lines.append(_prop("LAST-MODIFIED", now_stamp))
+    lines.append(_prop("TZURL", f"https://www.tzurl.org/zoneinfo-outlook/{tzid}"))
+    lines.append(_prop("X-LIC-LOCATION", tzid))
+    lines.append(b"BEGIN:STANDARD")
+    lines.append(_prop("TZNAME", "CST"))
+    lines.append(_prop("TZOFFSETFROM", "+0800"))
+    lines.append(_prop("TZOFFSETTO", "+0800"))
+    lines.append(_prop("DTSTART", "19700101T000000"))
+    lines.append(b"END:STANDARD")
+    lines.append(b"END:VTIMEZONE")
+    return _join(lines)
+
+_CALENDAR_FOOTER = b"END:VCALENDAR\r\n"
+
+def _component(r: dict, tzid: str, now_stamp: str, include_todos: bool = True) -> bytes:
+    """
+    把一行记录转成 VEVENT/VTODO 组件；不需要输出时返回 b""
+    """
+    kind = (r.get("kind") or "").upper()
+    if kind == "VTODO" and not include_todos:
+        return b""
+    if kind not in ("VEVENT", "VTODO"):
+        # 不认识的类型直接跳过
+        return b""
+
+    uid = r.get("uid")
+    summary = r.get("summary") or ""
+    description = r.get("description")
+    location = r.get("location")
+    all_day = int(r.get("all_day") or 0)
+
+    lines = []
+    if kind == "VEVENT":
+        lines.append(b"BEGIN:VEVENT")
+        lines.append(_prop("DTSTAMP", now_stamp))
+        lines.append(_prop("UID", uid))
+
+        dtstart = _to_datetime(r.get("dtstart"))
+        dtend = _to_datetime(r.get("dtend"))
+
+        if all_day:
+            if not dtstart:
+                # 没有开始时间就跳过（或你也可选择用 created_at）
+                lines.append(b"END:VEVENT")
+                return _join(lines)
+            d0 = dtstart.date()
+            if dtend:
+                d1 = dtend.date()
+            else:
+                d1 = d0 + _dt.timedelta(days=1)
+
+            lines.append(_prop("DTSTART", _format_date(d0), params={"VALUE": "DATE"}))
+            lines.append(_prop("DTEND", _format_date(d1), params={"VALUE": "DATE"}))
+        else:
+            if dtstart:
+                lines.append(_prop("DTSTART", _format_dt_local(dtstart), params={"TZID": tzid}))
+            if dtend:
+                lines.append(_prop("DTEND", _format_dt_local(dtend), params={"TZID": tzid}))
+
+        lines.append(_prop("SUMMARY", summary))
+        if description:
+            lines.append(_prop("DESCRIPTION", description))
+        if location:
+            lines.append(_prop("LOCATION", location))
+
+        # 可选：重复/标签
+        if r.get("rrule"):
+            lines.append(_prop("RRULE", r["rrule"]))
+        if r.get("exdate"):
+            # 如果你存的是逗号分隔 20250101T...，这里直接输出；更严谨可拆分多行 EXDATE
+            lines.append(_prop("EXDATE", r["exdate"], params={"TZID": tzid}))
+        if r.get("categories"):
+            lines.append(_prop("CATEGORIES", r["categories"]))
+
+        lines.append(b"END:VEVENT")
+
+    elif kind == "VTODO":
+        lines.append(b"BEGIN:VTODO")
+        lines.append(_prop("DTSTAMP", now_stamp))
+        lines.append(_prop("UID", uid))
+        lines.append(_prop("SUMMARY", summary))
+
+        due = _to_datetime(r.get("due"))
+        if due:
+            lines.append(_prop("DUE", _format_dt_local(due), params={"TZID": tzid}))
+
+        if description:
+            lines.append(_prop("DESCRIPTION", description))
+        if location:
+            # VTODO 也允许 LOCATION（部分客户端可能忽略）
+            lines.append(_prop("LOCATION", location))
+
+        # 状态/优先级/进度
+        if r.get("status"):
+            lines.append(_prop("STATUS", str(r["status"])))
+        if r.get("priority") is not None:
+            lines.append(_prop("PRIORITY", str(int(r["priority"]))))
+        if r.get("percent_complete") is not None:
+            lines.append(_prop("PERCENT-COMPLETE", str(int(r["percent_complete"]))))
+
+        # 重复/标签
+        if r.get("rrule"):
+            lines.append(_prop("RRULE", r["rrule"]))
+        if r.get("exdate"):
+            lines.append(_prop("EXDATE", r["exdate"], params={"TZID": tzid}))
+        if r.get("categories"):
+            lines.append(_prop("CATEGORIES", r["categories"]))
+
+        lines.append(b"END:VTODO")
+
+    return _join(lines)
+
+# 流式导出时攒够这么多字节再交给调用方，避免每个组件一次小写入
+_STREAM_CHUNK = 64 * 1024
+
+def iter_ics(
+    table_name: str,
+    cal_name: str = "zzz",
+    tzid: str = "Asia/Shanghai",
+    db_name: str = "agenda",
+    include_todos: bool = True,
+    dtstamp: str | None = None,
+):
+    """
+    流式导出 .ics（UTF-8 字节块生成器）
+    使用服务端游标逐行读取，内存占用与表大小无关
+    """
+    table_name = _safe_table_name(table_name)
+    now_stamp = dtstamp or _utc_now_dtstamp()
+
+    conn = get_conn(db_name)
+    try:
+        with conn.cursor(pymysql.cursors.SSDictCursor) as cursor:
+            cursor.execute(f"SELECT * FROM `{table_name}` ORDER BY COALESCE(dtstart, due), created_at")
+
+            buf = [_calendar_header(cal_name, tzid, now_stamp)]
+            size = len(buf[0])
+            for r in cursor:
+                block = _component(r, tzid, now_stamp, include_todos)
+                if not block:
+                    continue
+                buf.append(block)
+                size += len(block)
+                if size >= _STREAM_CHUNK:
+                    yield b"".join(buf)
+                    buf, size = [], 0
+    finally:
+        conn.close()
+
+    buf.append(_CALENDAR_FOOTER)
+    yield b"".join(buf)
 
 def export_ics(
     table_name: str,
@@ -76,139 +254,141 @@ def export_ics(
     tzid: str = "Asia/Shanghai",
     db_name: str = "agenda",
     include_todos: bool = True,
+    dtstamp: str | None = None,
 ) -> str:
     """
     从用户表导出 .ics 文本（VEVENT + 可选 VTODO）
+    dtstamp：DTSTAMP/LAST-MODIFIED 使用的 UTC 时间，默认取当前时间
     """
+    return b"".join(
+        iter_ics(table_name, cal_name, tzid, db_name, include_todos, dtstamp)
+    ).decode("utf-8")
+
+
+def cached_export_ics(
+    table_name: str,
+    cal_name: str = "zzz",
+    tzid: str = "Asia/Shanghai",
+    db_name: str = "agenda",
+    include_todos: bool = True,
+) -> ics_cache.IcsArtifact:
+    """
+    带缓存的 export_ics：表没有变更时直接返回上次导出的内容（含 ETag/Last-Modified）
+    """
+    table_name = _safe_table_name(table_name)
+    check_tzid(tzid)
+    key = (db_name, table_name, cal_name, tzid, include_todos)
+
+    art = ics_cache.get(key)
+    if art is not None:
+        return art
+
+    version, changed = ics_cache.current(db_name, table_name)
+    text = export_ics(
+        table_name,
+        cal_name=cal_name,
+        tzid=tzid,
+        db_name=db_name,
+        include_todos=include_todos,
+        dtstamp=changed.strftime("%Y%m%dT%H%M%SZ"),
+    )
+    return ics_cache.put(key, text.encode("utf-8"), version)
+
+
+@dataclass
+class ComponentBlock:
+    """一条记录导出的 VEVENT/VTODO，附带用于过滤的类型和分类"""
+    kind: str
+    categories: frozenset[str]   # 小写
+    body: bytes
+
+
+def _categories(r: dict) -> frozenset[str]:
+    return frozenset(c.strip().lower() for c in (r.get("categories") or "").split(",") if c.strip())
+
+
+def component_blocks(
+    table_name: str,
+    tzid: str = "Asia/Shanghai",
+    db_name: str = "agenda",
+    dtstamp: str | None = None,
+) -> list[ComponentBlock]:
+    """把整张表导出成组件块列表（顺序同 iter_ics），供多表合并订阅拼接"""
     table_name = _safe_table_name(table_name)
+    now_stamp = dtstamp or _utc_now_dtstamp()
 
+    blocks = []
     conn = get_conn(db_name)
     try:
-        with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+        with conn.cursor(pymysql.cursors.SSDictCursor) as cursor:
             cursor.execute(f"SELECT * FROM `{table_name}` ORDER BY COALESCE(dtstart, due), created_at")
-            rows = cursor.fetchall()
+            for r in cursor:
+                body = _component(r, tzid, now_stamp)
+                if body:
+                    blocks.append(ComponentBlock((r.get("kind") or "").upper(), _categories(r), body))
     finally:
         conn.close()
+    return blocks
 
-    now_stamp = _utc_now_dtstamp()
-    vtimezone_last_modified = _utc_now_dtstamp()
 
-    lines = []
-    lines.append("BEGIN:VCALENDAR")
-    lines.append("VERSION:2.0")
-    lines.append(_prop("PRODID", "-//your.app//Agenda Plugin//EN"))
-    lines.append(_prop("X-WR-CALNAME", cal_name))
-    lines.append(_prop("NAME", cal_name))
-    lines.append(_prop("REFRESH-INTERVAL", "P5M", params={"VALUE": "DURATION"}))
-    lines.append("CALSCALE:GREGORIAN")
+def cached_component_blocks(
+    table_name: str,
+    tzid: str = "Asia/Shanghai",
+    db_name: str = "agenda",
+) -> tuple[list[ComponentBlock], _dt.datetime]:
+    """
+    带缓存的 component_blocks，返回 (组件块, 该表最近变更时间)
+    DTSTAMP 取该表的变更时间，表不变时组件块逐字节不变
+    """
+    table_name = _safe_table_name(table_name)
+    check_tzid(tzid)
+    key = (db_name, table_name, "blocks", tzid)
 
-    # VTIMEZONE（按你示例的 Asia/Shanghai 模板输出）
-    lines.append("BEGIN:VTIMEZONE")
-    lines.append(_prop("TZID", tzid))
-    lines.append(_prop("LAST-MODIFIED", vtimezone_last_modified))
-    lines.append(_prop("TZURL", f"https://www.tzurl.org/zoneinfo-outlook/{tzid}"))
-    lines.append(_prop("X-LIC-LOCATION", tzid))
-    lines.append("BEGIN:STANDARD")
-    lines.append(_prop("TZNAME", "CST"))
-    lines.append(_prop("TZOFFSETFROM", "+0800"))
-    lines.append(_prop("TZOFFSETTO", "+0800"))
-    lines.append(_prop("DTSTART", "19700101T000000"))
-    lines.append("END:STANDARD")
-    lines.append("END:VTIMEZONE")
-
-    for r in rows:
-        kind = (r.get("kind") or "").upper()
-        if kind == "VTODO" and not include_todos:
-            continue
-        if kind not in ("VEVENT", "VTODO"):
-            # 不认识的类型直接跳过
-            continue
-
-        uid = r.get("uid")
-        summary = r.get("summary") or ""
-        description = r.get("description")
-        location = r.get("location")
-        all_day = int(r.get("all_day") or 0)
-
-        if kind == "VEVENT":
-            lines.append("BEGIN:VEVENT")
-            lines.append(_prop("DTSTAMP", now_stamp))
-            lines.append(_prop("UID", uid))
-
-            dtstart = _to_datetime(r.get("dtstart"))
-            dtend = _to_datetime(r.get("dtend"))
-
-            if all_day:
-                if not dtstart:
-                    # 没有开始时间就跳过（或你也可选择用 created_at）
-                    lines.append("END:VEVENT")
-                    continue
-                d0 = dtstart.date()
-                if dtend:
-                    d1 = dtend.date()
-                else:
-                    d1 = d0 + _dt.timedelta(days=1)
-
-                lines.append(_prop("DTSTART", _format_date(d0), params={"VALUE": "DATE"}))
-                lines.append(_prop("DTEND", _format_date(d1), params={"VALUE": "DATE"}))
-            else:
-                if dtstart:
-                    lines.append(_prop("DTSTART", _format_dt_local(dtstart), params={"TZID": tzid}))
-                if dtend:
-                    lines.append(_prop("DTEND", _format_dt_local(dtend), params={"TZID": tzid}))
-
-            lines.append(_prop("SUMMARY", summary))
-            if description:
-                lines.append(_prop("DESCRIPTION", description))
-            if location:
-                lines.append(_prop("LOCATION", location))
-
-            # 可选：重复/标签
-            if r.get("rrule"):
-                lines.append(_prop("RRULE", r["rrule"]))
-            if r.get("exdate"):
-                # 如果你存的是逗号分隔 20250101T...，这里直接输出；更严谨可拆分多行 EXDATE
-                lines.append(_prop("EXDATE", r["exdate"], params={"TZID": tzid}))
-            if r.get("categories"):
-                lines.append(_prop("CATEGORIES", r["categories"]))
-
-            lines.append("END:VEVENT")
-
-        elif kind == "VTODO":
-            lines.append("BEGIN:VTODO")
-            lines.append(_prop("DTSTAMP", now_stamp))
-            lines.append(_prop("UID", uid))
-            lines.append(_prop("SUMMARY", summary))
-
-            due = _to_datetime(r.get("due"))
-            if due:
-                lines.append(_prop("DUE", _format_dt_local(due), params={"TZID": tzid}))
-
-            if description:
-                lines.append(_prop("DESCRIPTION", description))
-            if location:
-                # VTODO 也允许 LOCATION（部分客户端可能忽略）
-                lines.append(_prop("LOCATION", location))
-
-            # 状态/优先级/进度
-            if r.get("status"):
-                lines.append(_prop("STATUS", str(r["status"])))
-            if r.get("priority") is not None:
-                lines.append(_prop("PRIORITY", str(int(r["priority"]))))
-            if r.get("percent_complete") is not None:
-                lines.append(_prop("PERCENT-COMPLETE", str(int(r["percent_complete"]))))
-
-            # 重复/标签
-            if r.get("rrule"):
-                lines.append(_prop("RRULE", r["rrule"]))
-            if r.get("exdate"):
-                lines.append(_prop("EXDATE", r["exdate"], params={"TZID": tzid}))
-            if r.get("categories"):
-                lines.append(_prop("CATEGORIES", r["categories"]))
-
-            lines.append("END:VTODO")
-
-    lines.append("END:VCALENDAR")
-
-    # 确保 CRLF 结尾
-    return "\r\n".join([ln for ln in lines if ln]) + "\r\n"
+    version, changed = ics_cache.current(db_name, table_name)
+    blocks = ics_cache.get_blocks(key)
+    if blocks is None:
+        blocks = component_blocks(table_name, tzid, db_name, changed.strftime("%Y%m%dT%H%M%SZ"))
+        ics_cache.put_blocks(key, blocks, version)
+    return blocks, changed
+
+
+def merged_export_ics(
+    table_names: list[str],
+    cal_name: str = "zzz",
+    tzid: str = "Asia/Shanghai",
+    db_name: str = "agenda",
+    kinds: set[str] | None = None,
+    categories: set[str] | None = None,
+) -> ics_cache.IcsArtifact:
+    """
+    把多张表合并成一个订阅，只做拼接：各表的组件块分别缓存，某张表有改动只重建那一张
+    kinds：只保留这些类型（VEVENT/VTODO）；categories：只保留带任一分类的组件（不区分大小写）
+    拼好的结果按参数缓存，Last-Modified 由 ics_cache 按内容是否变化决定
+    """
+    if not table_names:
+        raise ValueError("至少需要一张表")
+    table_names = [_safe_table_name(t) for t in table_names]
+    check_tzid(tzid)
+    wanted = frozenset(c.lower() for c in categories) if categories else None
+    key = (db_name, "merged", tuple(table_names), cal_name, tzid, frozenset(kinds or ()), wanted)
+
+    art = ics_cache.get_merged(key, table_names)
+    if art is not None:
+        return art
+
+    built_versions = ics_cache.versions(db_name, table_names)
+    parts = []
+    latest = None
+    for table_name in table_names:
+        blocks, changed = cached_component_blocks(table_name, tzid, db_name)
+        latest = changed if latest is None else max(latest, changed)
+        for b in blocks:
+            if kinds and b.kind not in kinds:
+                continue
+            if wanted is not None and not (b.categories & wanted):
+                continue
+            parts.append(b.body)
+
+    header = _calendar_header(cal_name, tzid, latest.strftime("%Y%m%dT%H%M%SZ"))
+    body = b"".join([header, *parts, _CALENDAR_FOOTER])
+    return ics_cache.put_merged(key, body, table_names, built_versions)
@@ -0,0 +1,339 @@
+"""
+日程批量导入
+
+- iter_ics_events() 逐行读取 .ics（先展开折行），每解析完一个 VEVENT/VTODO 就产出一行，
+  内存占用与文件大小无关
+- import_events() 把行规范化后按 AGENDA_IMPORT_BATCH 条一批，用一条多行
+  INSERT ... ON DUPLICATE KEY UPDATE 写入（按 uid/kind/recurrence_id 匹配已有记录），
+  返回逐条结果
+"""
+import asyncio
+import datetime as _dt
+import itertools
+import os
+import re
+from typing import Iterable, Iterator
+from zoneinfo import ZoneInfo
+from dotenv import load_dotenv
+
+from app.core.logger import log
+from app.db.agenda import _ALLOWED_FIELDS
+from app.db.aio_agenda import upsert_events, upsert_key
+from app.db.aio_pool import is_transient_error
+from app.functions.common import ics_cache
+from app.functions.common.recurrence import parse_time, check_tzid
+
+load_dotenv()
+
+AGENDA_IMPORT_BATCH = int(os.getenv("AGENDA_IMPORT_BATCH", "500"))   # 每条 INSERT 写入的行数
+
+_COMPONENTS = ("VEVENT", "VTODO")
+_TIME_FIELDS = ("dtstart", "dtend", "due", "recurrence_id")
+# 取值超出列定义时整批 INSERT 会失败，所以逐条先检查
+# VARCHAR 列的最大字符数
+_VARCHAR_FIELDS = {"uid": 255, "summary": 255, "location": 255, "categories": 255, "status": 50}
+# TEXT 列，最多 65535 字节
+_TEXT_FIELDS = ("description", "rrule", "exdate")
+_TEXT_MAX_BYTES = 65535
+# 整数列的取值范围（PRIORITY 按 RFC 5545 为 0-9）
+_INT_FIELDS = {"percent_complete": (0, 100), "priority": (0, 9), "sequence": (0, 2**31 - 1)}
+
+_TEXT_UNESCAPE_RE = re.compile(r"\\([nN,;\\])")
+_DURATION_RE = re.compile(
+    r"^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$"
+)
+
+
+# ---------- .ics 解析 ----------
+
+def _unfold(lines: Iterable[bytes]) -> Iterator[str]:
+    """展开折行（续行以空格或制表符开头）；在字节上拼接，避免把多字节字符切坏"""
+    buf = None
+    for raw in lines:
+        line = raw.rstrip(b"\r\n")
+        if line[:1] in (b" ", b"\t"):
+            if buf is not None:
+                buf += line[1:]
+            continue
+        if buf:
+            yield buf.decode("utf-8", errors="replace")
+        buf = line
+    if buf:
+        yield buf.decode("utf-8", errors="replace")
+
+
+def _split_line(line: str) -> tuple[str, dict, str] | None:
+    """NAME;PARAM=V;...:VALUE -> (NAME, {PARAM: V}, VALUE)；引号内的冒号不算分隔符"""
+    in_quote = False
+    for i, ch in enumerate(line):
+        if ch == '"':
+            in_quote = not in_quote
+        elif ch == ":" and not in_quote:
+            head, value = line[:i], line[i + 1:]
+            break
+    else:
+        return None
+
+    name, *parts = head.split(";")
+    params = {}
+    for p in parts:
+        k, _, v = p.partition("=")
+        params[k.upper()] = v.strip('"')
+    return name.upper(), params, value
+
+
+def _unescape(value: str) -> str:
+    return _TEXT_UNESCAPE_RE.sub(lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+
+
+def _ical_time(value: str, params: dict, tzid: str) -> tuple[_dt.datetime, bool]:
+    """
+    解析 DATE / DATE-TIME，返回 (tzid 下不带时区的本地时间, 是否为全天日期)
+    UTC（以 Z 结尾）和带其它 TZID 的时间换算到 tzid；不认识的 TZID 按原值处理
+    """
+    v = value.strip()
+    if params.get("VALUE") == "DATE" or len(v) == 8:
+        return _dt.datetime.strptime(v, "%Y%m%d"), True
+
+    dt = _dt.datetime.strptime(v.rstrip("Z"), "%Y%m%dT%H%M%S")
+    src = None
+    if v.endswith("Z"):
+        src = _dt.timezone.utc
+    elif params.get("TZID") and params["TZID"] != tzid:
+        try:
+            src = ZoneInfo(params["TZID"])
+        except Exception:
+            src = None
+    if src is not None:
+        dt = dt.replace(tzinfo=src).astimezone(ZoneInfo(tzid)).replace(tzinfo=None)
+    return dt, False
+
+
+def _duration(value: str) -> _dt.timedelta:
+    m = _DURATION_RE.match(value.strip())
+    if not m:
+        raise ValueError(f"无法解析 DURATION: {value!r}")
+    sign, w, d, h, mi, s = m.groups()
+    delta = _dt.timedelta(
+        weeks=int(w or 0), days=int(d or 0), hours=int(h or 0), minutes=int(mi or 0), seconds=int(s or 0)
+    )
+    return -delta if sign == "-" else delta
+
+
+def _apply(row: dict, name: str, params: dict, value: str, tzid: str):
+    """把一个属性写进行（字段名与表结构一致）"""
+    if name == "UID":
+        row["uid"] = value.strip()
+    elif name in ("SUMMARY", "DESCRIPTION", "LOCATION"):
+        row[name.lower()] = _unescape(value)
+    elif name in ("DTSTART", "DTEND", "DUE", "RECURRENCE-ID"):
+        dt, is_date = _ical_time(value, params, tzid)
+        row[name.lower().replace("-", "_")] = dt
+        if name == "DTSTART" and is_date:
+            row["all_day"] = 1
+    elif name == "DURATION":
+        row["_duration"] = _duration(value)
+    elif name == "STATUS":
+        row["status"] = value.strip().upper()
+    elif name in ("PRIORITY", "PERCENT-COMPLETE", "SEQUENCE"):
+        row[name.lower().replace("-", "_")] = int(value)
+    elif name == "RRULE":
+        row["rrule"] = value.strip()
+    elif name == "EXDATE":
+        for item in value.split(","):
+            if item.strip():
+                dt, _ = _ical_time(item, params, tzid)
+                row.setdefault("_exdate", []).append(dt.strftime("%Y%m%dT%H%M%S"))
+    elif name == "CATEGORIES":
+        row.setdefault("_categories", []).extend(
+            c.strip() for c in _unescape(value).split(",") if c.strip()
+        )
+
+
+def _finish(row: dict) -> dict:
+    if "_exdate" in row:
+        row["exdate"] = ",".join(row.pop("_exdate"))
+    if "_categories" in row:
+        row["categories"] = ",".join(row.pop("_categories"))
+    duration = row.pop("_duration", None)
+    if duration is not None and row.get("dtend") is None:
+        if row["kind"] == "VEVENT" and row.get("dtstart") is not None:
+            row["dtend"] = row["dtstart"] + duration
+    return row
+
+
+def iter_ics_events(lines: Iterable[bytes], tzid: str = "Asia/Shanghai") -> Iterator[dict]:
+    """
+    流式解析 .ics：lines 可以直接是二进制文件对象
+    每个 VEVENT/VTODO 产出一个 dict（字段名同表结构），内嵌的 VALARM 等子组件忽略
+    解析失败的属性不会中断整个文件，而是在该行记录 "_error"，由 import_events 报告
+    """
+    row = None
+    depth = 0      # 当前组件嵌套深度
+    row_depth = 0  # row 所在的深度
+    for line in _unfold(lines):
+        parsed = _split_line(line)
+        if parsed is None:
+            continue
+        name, params, value = parsed
+
+        if name == "BEGIN":
+            depth += 1
+            comp = value.strip().upper()
+            if row is None and comp in _COMPONENTS:
+                row, row_depth = {"kind": comp}, depth
+            continue
+        if name == "END":
+            if row is not None and depth == row_depth:
+                yield _finish(row)
+                row = None
+            depth -= 1
+            continue
+
+        if row is None or depth != row_depth or "_error" in row:
+            continue
+        try:
+            _apply(row, name, params, value, tzid)
+        except ValueError as e:
+            row["_error"] = f"{name}: {e}"
+
+
+# ---------- 规范化与写入 ----------
+
+def _check_int(name: str, value, lo: int, hi: int) -> int | None:
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise ValueError(f"{name} 必须是整数")
+    try:
+        value = int(value)
+    except ValueError:
+        raise ValueError(f"{name} 必须是整数")
+    if not lo <= value <= hi:
+        raise ValueError(f"{name} 必须在 {lo}-{hi} 之间")
+    return value
+
+
+def normalize_event(data: dict) -> dict:
+    """
+    校验并补齐一行，返回包含全部可写字段的 dict（没给的字段为 NULL/默认值）
+    导入是整行覆盖：已有记录中导入数据没给的字段会被清空
+    """
+    if data.get("_error"):
+        raise ValueError(data["_error"])
+
+    clean = {k: v for k, v in data.items() if k in _ALLOWED_FIELDS}
+    if not clean.get("uid"):
+        raise ValueError("uid 不能为空")
+    if clean.get("kind") not in _COMPONENTS:
+        raise ValueError("kind 必须是 'VEVENT' 或 'VTODO'")
+
+    for f in _TIME_FIELDS:
+        clean[f] = parse_time(clean.get(f))
+        # DATETIME 列只支持 1000-9999 年
+        if clean[f] is not None and clean[f].year < 1000:
+            raise ValueError(f"{f} 超出范围")
+    for f, size in _VARCHAR_FIELDS.items():
+        if clean.get(f) is None:
+            continue
+        if not isinstance(clean[f], str):
+            raise ValueError(f"{f} 必须是字符串")
+        if len(clean[f]) > size:
+            raise ValueError(f"{f} 超过 {size} 个字符")
+    for f in _TEXT_FIELDS:
+        if clean.get(f) is None:
+            continue
+        if not isinstance(clean[f], str):
+            raise ValueError(f"{f} 必须是字符串")
+        if len(clean[f].encode("utf-8")) > _TEXT_MAX_BYTES:
+            raise ValueError(f"{f} 超过 {_TEXT_MAX_BYTES} 字节")
+    for f, (lo, hi) in _INT_FIELDS.items():
+        clean[f] = _check_int(f, clean.get(f), lo, hi)
+
+    clean["summary"] = clean.get("summary") or ""
+    clean["all_day"] = 1 if clean.get("all_day") else 0
+    clean["sequence"] = clean["sequence"] or 0
+    return {f: clean.get(f) for f in sorted(_ALLOWED_FIELDS)}
+
+
+async def _flush(table_name: str, batch: list[tuple[int, dict]], results: list, db_name: str):
+    """写入一批；batch 内同一 (uid, kind, recurrence_id) 只保留最后一条"""
+    latest = {}
+    for index, row in batch:
+        key = upsert_key(row["uid"], row["kind"], row["recurrence_id"])
+        if key in latest:
+            results[latest[key][0]].update(status="duplicate", error="被同一批中后出现的同一条目覆盖")
+        latest[key] = (index, row)
+
+    items = list(latest.values())
+    try:
+        written = await upsert_events(table_name, [row for _, row in items], db_name)
+    except Exception as e:
+        log(f"日程批量导入失败 table={table_name}: {e}", "ERROR")
+        if len(items) > 1 and not is_transient_error(e):
+            # normalize_event 没拦住的坏数据：逐条重写，只让有问题的那几条失败
+            await _flush_each(table_name, items, results, db_name)
+            return
+        for index, _ in items:
+            results[index].update(status="error", error=str(e))
+        return
+    ics_cache.invalidate(db_name, table_name)
+    for (index, _), (event_id, created) in zip(items, written):
+        results[index].update(status="created" if created else "updated", id=event_id)
+
+
+async def _flush_each(table_name: str, items: list[tuple[int, dict]], results: list, db_name: str):
+    """整批写入失败后逐条写入"""
+    for index, row in items:
+        try:
+            [(event_id, created)] = await upsert_events(table_name, [row], db_name)
+        except Exception as e:
+            results[index].update(status="error", error=str(e))
+            continue
+        results[index].update(status="created" if created else "updated", id=event_id)
+    ics_cache.invalidate(db_name, table_name)
+
+
+async def import_events(
+    table_name: str,
+    source: Iterable[dict],
+    db_name: str = "agenda",
+    blocking: bool = False,
+) -> dict:
+    """
+    批量 upsert 日程/待办
+    source：行的迭代器（JSON 数组或 iter_ics_events 的结果）
+    blocking=True 时 source 会读文件，每批在线程里取，避免阻塞事件循环
+    返回 {"created", "updated", "failed", "items": [{"index", "uid", "status", "id"/"error"}]}
+    """
+    source = iter(source)
+    results = []
+    while True:
+        if blocking:
+            chunk = await asyncio.to_thread(list, itertools.islice(source, AGENDA_IMPORT_BATCH))
+        else:
+            chunk = list(itertools.islice(source, AGENDA_IMPORT_BATCH))
+        if not chunk:
+            break
+
+        batch = []
+        for data in chunk:
+            index = len(results)
+            uid = data.get("uid") if isinstance(data, dict) else None
+            results.append({"index": index, "uid": uid})
+            try:
+                if not isinstance(data, dict):
+                    raise ValueError("每一项必须是对象")
+                batch.append((index, normalize_event(data)))
+            except (ValueError, TypeError) as e:
+                results[index].update(status="error", error=str(e))
+        if batch:
+            await _flush(table_name, batch, results, db_name)
+
+    count = lambda status: sum(1 for r in results if r.get("status") == status)
+    return {
+        "created": count("created"),
+        "updated": count("updated"),
+        "failed": count("error"),
+        "items": results,
+    }
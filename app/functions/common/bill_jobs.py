@@ -0,0 +1,129 @@
+"""
+/book 账单识别的后台任务队列
+
+- 有界队列（BILL_JOB_QUEUE_SIZE）+ 固定数量的 worker（BILL_JOB_WORKERS），控制同时识别的数量
+- 任务状态持久化在 bills.bill_job（queued/running/done/failed），进程重启后未完成的任务会被重新入队
+- 失败自动重试（最多 BILL_JOB_MAX_ATTEMPTS 次，指数退避），识别和入库失败都会重试
+- 入库与标记完成在同一事务里，一个任务只记一次账；running 超过 BILL_JOB_LEASE 秒未更新才允许被重新领取
+"""
+import asyncio
+import os
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from app.core.logger import log
+from app.db import aio_jobs
+from app.functions.alm.call_llm import bill_llm
+
+load_dotenv()
+
+BILL_JOB_QUEUE_SIZE = int(os.getenv("BILL_JOB_QUEUE_SIZE", "100"))
+BILL_JOB_WORKERS = int(os.getenv("BILL_JOB_WORKERS", "4"))
+BILL_JOB_MAX_ATTEMPTS = int(os.getenv("BILL_JOB_MAX_ATTEMPTS", "3"))
+BILL_JOB_RETRY_BASE = float(os.getenv("BILL_JOB_RETRY_BASE", "5"))   # 第 n 次重试等待 base * 2^(n-1) 秒
+BILL_JOB_LEASE = float(os.getenv("BILL_JOB_LEASE", "600"))           # running 任务超过该秒数未更新视为执行者已退出
+
+
+class QueueFull(Exception):
+    """队列已满，请稍后再提交"""
+
+
+_queue: asyncio.Queue | None = None
+_tasks: set[asyncio.Task] = set()
+
+
+def _spawn(coro) -> asyncio.Task:
+    # 持有 task 引用，避免被垃圾回收
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+async def submit(content: bytes, position: str) -> int:
+    """提交一个账单识别任务，返回任务 id；队列满时抛 QueueFull"""
+    if _queue is None:
+        raise RuntimeError("任务队列未启动")
+    if _queue.full():
+        raise QueueFull("账单识别任务过多，请稍后重试")
+
+    job_id = await aio_jobs.create_job(content, position)
+    try:
+        _queue.put_nowait(job_id)
+    except asyncio.QueueFull:
+        await aio_jobs.fail_job(job_id, "队列已满", retry=False)
+        raise QueueFull("账单识别任务过多，请稍后重试")
+    return job_id
+
+
+async def _retry_later(job_id: int, delay: float):
+    await asyncio.sleep(delay)
+    await _queue.put(job_id)
+
+
+async def _run(job_id: int):
+    job = await aio_jobs.claim_job(job_id, BILL_JOB_LEASE)
+    if job is None:
+        return
+    image, position, attempts = job
+
+    try:
+        result = await bill_llm(image, position)
+        await aio_jobs.finish_job(job_id, result)
+    except Exception as e:
+        error = str(e.detail) if isinstance(e, HTTPException) else str(e)
+        retry = attempts < BILL_JOB_MAX_ATTEMPTS
+        log(f"账单任务 {job_id} 第 {attempts} 次失败: {error}", "ERROR")
+        await aio_jobs.fail_job(job_id, error, retry=retry)
+        if retry:
+            _spawn(_retry_later(job_id, BILL_JOB_RETRY_BASE * 2 ** (attempts - 1)))
+
+
+async def _worker():
+    while True:
+        job_id = await _queue.get()
+        try:
+            await _run(job_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log(f"账单任务 {job_id} 执行异常: {e}", "ERROR")
+        finally:
+            _queue.task_done()
+
+
+async def _recover():
+    try:
+        jobs = await aio_jobs.list_unfinished_jobs(BILL_JOB_LEASE)
+    except Exception as e:
+        log(f"恢复未完成账单任务失败: {e}", "ERROR")
+        return
+    if jobs:
+        log(f"恢复 {len(jobs)} 个未完成的账单任务")
+    for job_id, wait in jobs:
+        if wait:
+            # 上次停在 running 的任务要等租约过期才能领取
+            _spawn(_retry_later(job_id, wait))
+        else:
+            await _queue.put(job_id)
+
+
+async def start_workers():
+    """启动 worker，并把上次未完成的任务重新入队"""
+    global _queue
+    if _queue is not None:
+        return
+    _queue = asyncio.Queue(maxsize=BILL_JOB_QUEUE_SIZE)
+    for _ in range(BILL_JOB_WORKERS):
+        _spawn(_worker())
+    _spawn(_recover())
+
+
+async def stop_workers():
+    """停止 worker；正在执行的任务保持 running 状态，租约过期后由下次启动恢复"""
+    global _queue
+    tasks = list(_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    _queue = None
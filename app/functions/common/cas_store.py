@@ -0,0 +1,138 @@
+"""
+UPLOAD_DIR 的内容寻址存储
+
+真实文件按 sha256 存在 UPLOAD_STORE_DIR/objects/ab/cd/<sha256>（不对外公开），
+对外的文件名（key.png、时间戳.jpg 等）是 UPLOAD_DIR 下指向该对象的硬链接别名，
+所以 /uploads/<filename> 的访问方式不变，相同内容只占一份磁盘。
+对象的引用计数即硬链接数：st_nlink - 1 个别名。
+"""
+import errno
+import hashlib
+import os
+import shutil
+
+from app.core.config import UPLOAD_DIR, UPLOAD_STORE_DIR
+
+OBJECTS_DIR = os.path.join(UPLOAD_STORE_DIR, "objects")
+
+# 这些错误说明文件系统不支持硬链接（跨设备、不允许），退化为复制
+_NO_LINK_ERRNOS = {errno.EXDEV, errno.EPERM}
+
+
+def ensure_store():
+    """创建对象库目录"""
+    os.makedirs(OBJECTS_DIR, exist_ok=True)
+
+
+def object_path(sha256: str) -> str:
+    return os.path.join(OBJECTS_DIR, sha256[:2], sha256[2:4], sha256)
+
+
+def _ensure_object(tmp_path: str, obj: str):
+    """对象不存在时用临时文件建一个（硬链接，临时文件保留）；已存在相同内容则什么也不做（去重）"""
+    if os.path.exists(obj):
+        return
+    os.makedirs(os.path.dirname(obj), exist_ok=True)
+    try:
+        os.link(tmp_path, obj)
+    except FileExistsError:
+        pass
+    except OSError as e:
+        if e.errno not in _NO_LINK_ERRNOS:
+            raise
+        shutil.copyfile(tmp_path, obj)
+
+
+def store_file(tmp_path: str, sha256: str, filenames) -> str:
+    """
+    把临时文件收进对象库，并挂到 filenames 中第一个可用的别名上，返回该别名
+    临时文件保留到别名建好为止：期间对象被并发的 remove_alias 回收（link 时 FileNotFoundError），
+    就用临时文件重新入库再挂一次。结束时总会删除临时文件
+    """
+    obj = object_path(sha256)
+    try:
+        for filename in filenames:
+            for attempt in range(3):
+                _ensure_object(tmp_path, obj)
+                try:
+                    linked = link_alias(obj, filename)
+                    break
+                except FileNotFoundError:
+                    if attempt == 2:
+                        raise
+            if linked:
+                return filename
+    finally:
+        os.unlink(tmp_path)
+
+
+def _same_file(a: str, b: str) -> bool:
+    try:
+        return os.path.samefile(a, b)
+    except OSError:
+        return False
+
+
+def link_alias(obj: str, filename: str) -> bool:
+    """
+    为对象创建别名 UPLOAD_DIR/filename
+    - 成功或该别名本来就指向同一对象：返回 True
+    - 别名已被其他内容占用：返回 False（由调用方换名）
+    - 对象已被回收：抛 FileNotFoundError（由调用方重新入库）
+    os.link 在目标存在时直接失败，并发上传不会互相覆盖
+    """
+    alias = os.path.join(UPLOAD_DIR, filename)
+    try:
+        os.link(obj, alias)
+        return True
+    except FileExistsError:
+        return _same_file(obj, alias)
+    except OSError as e:
+        if e.errno not in _NO_LINK_ERRNOS:
+            raise
+        # 文件系统不支持硬链接时退化为复制（不再共享磁盘，但行为正确）
+        if os.path.exists(alias):
+            return False
+        shutil.copyfile(obj, alias)
+        return True
+
+
+def remove_alias(filename: str) -> bool:
+    """
+    删除一个别名；如果它是对象的最后一个别名，同时回收对象
+    返回是否删除了文件。需要读文件算哈希，在事件循环里调用时放到线程中执行
+    """
+    alias = os.path.join(UPLOAD_DIR, filename)
+    try:
+        st = os.stat(alias)
+    except FileNotFoundError:
+        return False
+
+    obj = None
+    if st.st_nlink == 2:
+        # 只剩“对象 + 这个别名”，找到对象以便一并回收
+        digest = hashlib.sha256()
+        with open(alias, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+                digest.update(chunk)
+        candidate = object_path(digest.hexdigest())
+        if _same_file(candidate, alias):
+            obj = candidate
+
+    try:
+        os.unlink(alias)
+    except FileNotFoundError:
+        return False
+    # 删完别名再确认一次：期间有新别名（或正在入库的临时文件）链上来时对象要保留
+    try:
+        if obj is not None and os.stat(obj).st_nlink == 1:
+            os.unlink(obj)
+    except FileNotFoundError:
+        pass
+    return True
+
+
+def refcount(filename: str) -> int:
+    """别名所指对象当前被多少个别名引用（非内容寻址的旧文件返回 1）"""
+    st = os.stat(os.path.join(UPLOAD_DIR, filename))
+    return max(1, st.st_nlink - 1)
@@ -0,0 +1,75 @@
+"""
+忙闲查询与冲突检测
+
+输入是 recurrence.expand_rows() 展开后的实例（已按开始时间排序），
+按开始时间做一次扫描线合并得到忙碌区间，空闲区间是窗口内忙碌区间的补集。
+"""
+import datetime as _dt
+
+from app.functions.common.recurrence import _span
+
+
+def _blocks_time(item: dict) -> bool:
+    """只有有时长、未取消的日程占用时间；待办只有截止时间，不算忙碌"""
+    if (item.get("kind") or "").upper() != "VEVENT":
+        return False
+    return (item.get("status") or "").upper() != "CANCELLED"
+
+
+def busy_spans(instances, exclude_uid: str | None = None) -> list[tuple[_dt.datetime, _dt.datetime, dict]]:
+    """[(开始, 结束, 实例)]，按开始时间排序；时长为 0 的实例跳过"""
+    out = []
+    for item in instances:
+        if not _blocks_time(item) or (exclude_uid and item.get("uid") == exclude_uid):
+            continue
+        start, duration = _span(item)
+        if start is None or not duration:
+            continue
+        out.append((start, start + duration, item))
+    out.sort(key=lambda x: x[0])
+    return out
+
+
+def merge_intervals(spans, win_start: _dt.datetime, win_end: _dt.datetime) -> list[tuple[_dt.datetime, _dt.datetime]]:
+    """
+    扫描线合并：spans 需按开始时间排序；结果裁剪到 [win_start, win_end)
+    首尾相接的区间也合并成一段
+    """
+    merged = []
+    for start, end, *_ in spans:
+        start, end = max(start, win_start), min(end, win_end)
+        if start >= end:
+            continue
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    return [(s, e) for s, e in merged]
+
+
+def free_intervals(
+    busy: list[tuple[_dt.datetime, _dt.datetime]],
+    win_start: _dt.datetime,
+    win_end: _dt.datetime,
+    min_duration: _dt.timedelta = _dt.timedelta(0),
+) -> list[tuple[_dt.datetime, _dt.datetime]]:
+    """窗口内忙碌区间（已合并、有序）的补集，短于 min_duration 的空档丢掉"""
+    out = []
+    cursor = win_start
+    for start, end in busy:
+        if start > cursor and start - cursor >= min_duration:
+            out.append((cursor, start))
+        cursor = max(cursor, end)
+    if win_end > cursor and win_end - cursor >= min_duration:
+        out.append((cursor, win_end))
+    return out
+
+
+def conflicts(instances, start: _dt.datetime, end: _dt.datetime, exclude_uid: str | None = None) -> list[dict]:
+    """与 [start, end) 重叠的占用时间的实例（首尾相接不算冲突）"""
+    return [
+        item
+        for s, e, item in busy_spans(instances, exclude_uid)
+        if s < end and e > start
+    ]
@@ -0,0 +1,138 @@
+"""
+按表缓存导出的 .ics 内容
+
+日历客户端每 5 分钟轮询一次，数据没变时不再重新查表、拼字符串：
+- 写日程的调用方（路由、批量导入）成功后调用 invalidate() 使该表缓存失效
+- 缓存另有 ICS_CACHE_TTL 兜底（其他进程改了数据时也能在 TTL 内刷新）
+- ETag 取内容哈希，Last-Modified 取内容最近一次变化的时间，用于条件请求返回 304
+- 合并多表的订阅按表缓存组件块（get_blocks/put_blocks），拼好的结果也缓存（get_merged/put_merged），
+  任一张表失效即失效；Last-Modified 同样按内容是否变化决定，不看各表的变更时间
+- 所有缓存都是有界的 TTLCache（ICS_CACHE_MAXSIZE），cal_name/tzid 等请求参数再多也不会无限增长
+"""
+import datetime as _dt
+import hashlib
+import itertools
+import os
+import threading
+import time
+from dataclasses import dataclass
+from dotenv import load_dotenv
+
+from app.core.cache import TTLCache, MISSING
+
+load_dotenv()
+
+ICS_CACHE_TTL = float(os.getenv("ICS_CACHE_TTL", "300"))
+ICS_CACHE_MAXSIZE = int(os.getenv("ICS_CACHE_MAXSIZE", "256"))
+
+
+@dataclass
+class IcsArtifact:
+    body: bytes
+    etag: str
+    last_modified: _dt.datetime   # UTC，精确到秒
+    built_at: float
+
+
+_lock = threading.Lock()
+_versions = itertools.count(1)
+# (db_name, table_name) -> (版本号, 变更时间)；版本号每次 invalidate 递增，
+# 缓存条目记下构建时的版本号，取出时版本不一致即视为失效，不必逐个删除
+_changed_at = TTLCache(maxsize=ICS_CACHE_MAXSIZE * 4, ttl=float("inf"))
+_artifacts = TTLCache(maxsize=ICS_CACHE_MAXSIZE, ttl=ICS_CACHE_TTL)     # key -> (版本号, IcsArtifact)
+_blocks = TTLCache(maxsize=ICS_CACHE_MAXSIZE, ttl=ICS_CACHE_TTL)        # key -> (版本号, 组件块列表)
+_last_seen = TTLCache(maxsize=ICS_CACHE_MAXSIZE * 4, ttl=float("inf"))  # key -> (etag, last_modified)
+
+
+def _utc_now() -> _dt.datetime:
+    return _dt.datetime.now(_dt.timezone.utc).replace(microsecond=0)
+
+
+def current(db_name: str, table_name: str) -> tuple[int, _dt.datetime]:
+    """
+    该表当前的 (版本号, 变更时间)；本进程内第一次访问时取当前时间
+    构建前取一次：版本号传给 put/put_blocks，变更时间用作 DTSTAMP
+    """
+    with _lock:
+        cur = _changed_at.get((db_name, table_name))
+        if cur is MISSING:
+            cur = (next(_versions), _utc_now())
+            _changed_at.set((db_name, table_name), cur)
+        return cur
+
+
+def changed_at(db_name: str, table_name: str) -> _dt.datetime:
+    """
+    该表最近一次失效时间；本进程内第一次访问时取当前时间
+    导出时用作 DTSTAMP，保证数据不变时导出内容逐字节相同
+    """
+    return current(db_name, table_name)[1]
+
+
+def invalidate(db_name: str, table_name: str) -> None:
+    with _lock:
+        _changed_at.set((db_name, table_name), (next(_versions), _utc_now()))
+
+
+def _valid(key: tuple, item) -> bool:
+    return item is not MISSING and item[0] == current(*key[:2])[0]
+
+
+def get(key: tuple) -> IcsArtifact | None:
+    """key 的前两项必须是 (db_name, table_name)"""
+    item = _artifacts.get(key)
+    return item[1] if _valid(key, item) else None
+
+
+def _stamp(key: tuple, body: bytes) -> IcsArtifact:
+    """算 ETag；内容与该 key 上一次相同则沿用原来的 Last-Modified，否则取当前时间"""
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    with _lock:
+        prev = _last_seen.get(key, None)
+        last_modified = prev[1] if prev and prev[0] == etag else _utc_now()
+        _last_seen.set(key, (etag, last_modified))
+    return IcsArtifact(body=body, etag=etag, last_modified=last_modified, built_at=time.monotonic())
+
+
+def put(key: tuple, body: bytes, built_version: int) -> IcsArtifact:
+    """
+    built_version 为构建前 current() 取到的版本号；内容与上一次相同则沿用原来的 Last-Modified
+    构建期间表又被改过（版本号变了）则不缓存，避免存下旧内容
+    """
+    art = _stamp(key, body)
+    if built_version == current(*key[:2])[0]:
+        _artifacts.set(key, (built_version, art))
+    return art
+
+
+def versions(db_name: str, table_names: list[str]) -> tuple[int, ...]:
+    """多张表当前的版本号，合并订阅构建前取一次传给 put_merged"""
+    return tuple(current(db_name, t)[0] for t in table_names)
+
+
+def get_merged(key: tuple, table_names: list[str]) -> IcsArtifact | None:
+    """key 的第一项必须是 db_name；table_names 中任一张表失效过即返回 None"""
+    item = _artifacts.get(key)
+    if item is MISSING or item[0] != versions(key[0], table_names):
+        return None
+    return item[1]
+
+
+def put_merged(key: tuple, body: bytes, table_names: list[str], built_versions: tuple[int, ...]) -> IcsArtifact:
+    """同 put，built_versions 为构建前 versions() 的结果"""
+    art = _stamp(key, body)
+    if built_versions == versions(key[0], table_names):
+        _artifacts.set(key, (built_versions, art))
+    return art
+
+
+def get_blocks(key: tuple) -> list | None:
+    """key 的前两项必须是 (db_name, table_name)"""
+    item = _blocks.get(key)
+    return item[1] if _valid(key, item) else None
+
+
+def put_blocks(key: tuple, blocks: list, built_version: int) -> None:
+    """built_version 为构建前 current() 取到的版本号；构建期间表又被改过则不缓存"""
+    if built_version == current(*key[:2])[0]:
+        _blocks.set(key, (built_version, blocks))
@@ -0,0 +1,109 @@
+"""
+位置记录的写缓冲（write-behind）
+
+单条 POST /location 先进内存缓冲，攒够 POSITION_FLUSH_SIZE 条或每隔
+POSITION_FLUSH_INTERVAL 秒合并成一条多行 INSERT 写库，避免每个点一个事务。
+连接类错误（数据库不可用）时整批放回缓冲等下次重试；
+数据类错误（某些点非法）时把批次二分重试，定位出的坏点记日志后丢弃（死信），不会卡住后面的点。
+缓冲超过 POSITION_BUFFER_MAX 时丢弃最旧的点。
+"""
+import asyncio
+import os
+from dotenv import load_dotenv
+
+from app.core.logger import log
+from app.db.aio_tools import insert_positions
+from app.db.aio_pool import is_transient_error
+
+load_dotenv()
+
+POSITION_FLUSH_SIZE = int(os.getenv("POSITION_FLUSH_SIZE", "200"))
+POSITION_FLUSH_INTERVAL = float(os.getenv("POSITION_FLUSH_INTERVAL", "2"))
+POSITION_BUFFER_MAX = int(os.getenv("POSITION_BUFFER_MAX", "20000"))
+
+_buffer: list[dict] = []
+_flush_lock = asyncio.Lock()
+_wakeup = asyncio.Event()
+_task: asyncio.Task | None = None
+_dropped = 0
+_dead = 0
+
+
+def add(point: dict) -> None:
+    """放入一个点；够一批时唤醒后台写库"""
+    global _dropped
+    _buffer.append(point)
+    if len(_buffer) > POSITION_BUFFER_MAX:
+        overflow = len(_buffer) - POSITION_BUFFER_MAX
+        del _buffer[:overflow]
+        _dropped += overflow
+        log(f"位置缓冲已满，丢弃最旧的 {overflow} 条（累计 {_dropped} 条）", "WARNING")
+    if len(_buffer) >= POSITION_FLUSH_SIZE:
+        _wakeup.set()
+
+
+async def _write(batch: list[dict]) -> tuple[int, list[dict]]:
+    """
+    写入一批，返回 (写入条数, 因连接类错误没写成、需要放回缓冲的点)
+    数据类错误时把出错的部分二分重试，定位出的坏点记日志后丢弃
+    """
+    global _dead
+    written = 0
+    pending = [batch]   # 栈，先处理前半段，保持原来的顺序
+    while pending:
+        part = pending.pop()
+        try:
+            written += await insert_positions(part)
+            continue
+        except Exception as e:
+            if is_transient_error(e):
+                log(f"位置批量写入失败，稍后重试: {e}", "ERROR")
+                return written, part + [p for chunk in reversed(pending) for p in chunk]
+            if len(part) == 1:
+                _dead += 1
+                log(f"位置点写入失败，已丢弃（累计 {_dead} 条）: {part[0]!r}: {e}", "ERROR")
+                continue
+        mid = len(part) // 2
+        pending += [part[mid:], part[:mid]]
+    return written, []
+
+
+async def flush() -> int:
+    """把当前缓冲整批写库，返回写入条数"""
+    global _buffer
+    async with _flush_lock:
+        written = 0
+        while _buffer:
+            batch, _buffer = _buffer[:POSITION_FLUSH_SIZE], _buffer[POSITION_FLUSH_SIZE:]
+            n, rest = await _write(batch)
+            written += n
+            if rest:
+                _buffer = rest + _buffer
+                break
+        return written
+
+
+async def _flusher():
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=POSITION_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        await flush()
+
+
+def start_flusher():
+    global _task
+    if _task is None:
+        _task = asyncio.create_task(_flusher())
+
+
+async def stop_flusher():
+    """停止后台任务，并把剩余的点写完"""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
+    await flush()
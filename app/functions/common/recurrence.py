@@ -0,0 +1,154 @@
+"""
+日程重复规则（RRULE/EXDATE）展开
+
+- compile_rule() 带 LRU 缓存，同一条规则在多次查询间只解析一次
+- expand_rows() 把数据库行展开成落在 [start, end) 内的实例，
+  单次修改（recurrence_id 不为空的行）会替换掉主事件里对应的那次
+"""
+import datetime as _dt
+import os
+import re
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+from dateutil.rrule import rrulestr
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# 非重复事件最长跨度（天），窗口查询据此向前多取一段，以包含开始于窗口之前、结束于窗口之内的事件
+AGENDA_MAX_EVENT_DAYS = int(os.getenv("AGENDA_MAX_EVENT_DAYS", "31"))
+
+_UNTIL_UTC_RE = re.compile(r"UNTIL=(\d{8}T\d{6})Z", re.IGNORECASE)
+
+
+def parse_time(v) -> _dt.datetime | None:
+    """
+    兼容 datetime/date、"YYYY-MM-DD"、"YYYY-MM-DD HH:MM:SS"、ISO 8601 以及 iCalendar 的 "YYYYMMDDTHHMMSS"
+    一律返回不带时区的本地时间
+    """
+    if v is None or v == "":
+        return None
+    if isinstance(v, _dt.datetime):
+        return v.replace(tzinfo=None)
+    if isinstance(v, _dt.date):
+        return _dt.datetime(v.year, v.month, v.day)
+    s = str(v).strip()
+    if re.fullmatch(r"\d{8}(T\d{6}Z?)?", s):
+        fmt = "%Y%m%d" if len(s) == 8 else "%Y%m%dT%H%M%S"
+        return _dt.datetime.strptime(s.rstrip("Z"), fmt)
+    return _dt.datetime.fromisoformat(s).replace(tzinfo=None)
+
+
+def check_tzid(tzid: str) -> str:
+    """校验时区名，未知时抛 ValueError（路由据此返回 400）"""
+    try:
+        ZoneInfo(tzid)
+    except Exception:
+        raise ValueError(f"未知时区: {tzid!r}")
+    return tzid
+
+
+def _until_to_local(rule: str, tzid: str) -> str:
+    """把 UTC 的 UNTIL 换算成 tzid 本地时间，使之与不带时区的 DTSTART 一致（dateutil 要求两者一致）"""
+    tz = ZoneInfo(tzid)
+
+    def repl(m):
+        utc = _dt.datetime.strptime(m.group(1), "%Y%m%dT%H%M%S").replace(tzinfo=_dt.timezone.utc)
+        return "UNTIL=" + utc.astimezone(tz).strftime("%Y%m%dT%H%M%S")
+
+    return _UNTIL_UTC_RE.sub(repl, rule)
+
+
+@lru_cache(maxsize=2048)
+def compile_rule(rrule: str, dtstart: _dt.datetime, tzid: str = "Asia/Shanghai"):
+    """解析 RRULE 字符串，结果按 (规则, 起点, 时区) 缓存"""
+    rule = rrule.strip()
+    if rule.upper().startswith("RRULE:"):
+        rule = rule[6:]
+    # 不用 rrulestr(cache=True)：它会把生成过的所有实例留在规则对象里，而规则对象本身又被 LRU 长期持有
+    return rrulestr(_until_to_local(rule, tzid), dtstart=dtstart)
+
+
+def parse_exdate(exdate: str | None) -> set[_dt.datetime]:
+    """EXDATE 以逗号分隔存储"""
+    if not exdate:
+        return set()
+    out = set()
+    for item in exdate.split(","):
+        item = item.strip()
+        if item:
+            out.add(parse_time(item))
+    return out
+
+
+def _span(row: dict) -> tuple[_dt.datetime | None, _dt.timedelta]:
+    """(起点, 时长)：事件取 dtstart/dtend，全天事件默认 1 天；待办取 due，时长为 0"""
+    if (row.get("kind") or "").upper() == "VTODO":
+        return parse_time(row.get("due")), _dt.timedelta(0)
+    start = parse_time(row.get("dtstart"))
+    if start is None:
+        return None, _dt.timedelta(0)
+    end = parse_time(row.get("dtend"))
+    if end is not None and end >= start:
+        return start, end - start
+    if int(row.get("all_day") or 0):
+        return start, _dt.timedelta(days=1)
+    return start, _dt.timedelta(0)
+
+
+def _instance(row: dict, start: _dt.datetime, duration: _dt.timedelta, recurrence_id=None) -> dict:
+    item = dict(row)
+    if (row.get("kind") or "").upper() == "VTODO":
+        item["due"] = start
+    else:
+        item["dtstart"] = start
+        if row.get("dtend") is not None:
+            item["dtend"] = start + duration
+    if recurrence_id is not None:
+        item["recurrence_id"] = recurrence_id
+    return item
+
+
+def _overlaps(start: _dt.datetime, duration: _dt.timedelta, win_start: _dt.datetime, win_end: _dt.datetime) -> bool:
+    if not duration:
+        return win_start <= start < win_end
+    return start < win_end and start + duration > win_start
+
+
+def expand_rows(rows, win_start: _dt.datetime, win_end: _dt.datetime, tzid: str = "Asia/Shanghai") -> list[dict]:
+    """
+    把行展开成与 [win_start, win_end) 相交的实例，按开始时间排序
+    重复事件展开出的实例带 recurrence_id（该次的原始开始时间）
+    单次修改行只要在 rows 里就会替换掉主事件对应的那次，改到窗口外的不会出现在结果中
+    tzid 未知时抛 ValueError
+    """
+    check_tzid(tzid)
+    rows = list(rows)
+    overridden = {
+        (r.get("uid"), r.get("kind"), parse_time(r.get("recurrence_id")))
+        for r in rows
+        if r.get("recurrence_id") is not None
+    }
+
+    out = []
+    for r in rows:
+        start, duration = _span(r)
+        if start is None:
+            continue
+
+        if not r.get("rrule") or r.get("recurrence_id") is not None:
+            if _overlaps(start, duration, win_start, win_end):
+                out.append(_instance(r, start, duration))
+            continue
+
+        rule = compile_rule(r["rrule"], start, tzid)
+        skip = parse_exdate(r.get("exdate"))
+        # 向前多取一个时长，包含开始于窗口前、仍在进行中的实例
+        for occ in rule.between(win_start - duration, win_end, inc=True):
+            if occ in skip or (r.get("uid"), r.get("kind"), occ) in overridden:
+                continue
+            if _overlaps(occ, duration, win_start, win_end):
+                out.append(_instance(r, occ, duration, recurrence_id=occ))
+
+    out.sort(key=lambda x: (_span(x)[0], x.get("id") or 0))
+    return out
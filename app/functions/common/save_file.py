@@ -1,50 +1,116 @@
-from app.core.config import UPLOAD_DIR
+from app.core.config import UPLOAD_DIR, UPLOAD_MAX_BYTES, UPLOAD_CHUNK_SIZE, UPLOAD_FORM_OVERHEAD, UPLOAD_TMP_DIR
 from fastapi import  UploadFile
+import asyncio
+import hashlib
 import os
+import tempfile
 import datetime
 from typing import Optional
+from app.functions.common import cas_store
+
+
+class FileTooLarge(ValueError):
+    """上传文件超过 UPLOAD_MAX_BYTES"""
+
+
+class LengthRequired(ValueError):
+    """上传请求没有 Content-Length，无法在解析前判断大小"""
+
+
+def check_content_length(value: Optional[str]) -> None:
+    """
+    multipart 表单在进入路由前就会被整体解析、落盘，
+    所以按请求头的 Content-Length 提前拒绝超大上传（留出表单本身的开销）
+    """
+    if value is None:
+        raise LengthRequired("上传请求需要 Content-Length")
+    if not value.isdigit() or int(value) > UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD:
+        raise FileTooLarge(f"文件超过大小上限 {UPLOAD_MAX_BYTES} 字节")
+
+
+async def _stream_to_temp(f: UploadFile) -> tuple[str, int, str]:
+    """
+    分块把上传内容写到 UPLOAD_TMP_DIR 下的临时文件（写盘放到线程里，不阻塞事件循环），
+    边写边算 sha256，超过大小上限立即中止。
+    返回 (临时文件路径, 字节数, sha256)
+    """
+    if f.size is not None and f.size > UPLOAD_MAX_BYTES:
+        raise FileTooLarge(f"文件超过大小上限 {UPLOAD_MAX_BYTES} 字节")
+
+    # 临时文件不能放在对外公开的 UPLOAD_DIR 下，否则未写完的内容也能被访问
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_TMP_DIR, prefix="upload-", suffix=".part")
+    digest = hashlib.sha256()
+    total = 0
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = await f.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if total > UPLOAD_MAX_BYTES:
+                    raise FileTooLarge(f"文件超过大小上限 {UPLOAD_MAX_BYTES} 字节")
+                digest.update(chunk)
+                await asyncio.to_thread(out.write, chunk)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    return tmp_path, total, digest.hexdigest()
+
+
+def _candidate_names(key: Optional[str], ext: str, sha256: str):
+    """
+    依次产出候选文件名：有 key 时先用 key 本身；
+    其后都带上内容哈希前缀，同一秒内的并发上传也不会撞名
+    """
+    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+    if key:
+        yield f"{key}{ext}"
+        base_name = f"{key}_{timestamp}_{sha256[:8]}"
+    else:
+        base_name = f"{timestamp}_{sha256[:8]}"
+    yield f"{base_name}{ext}"
+    n = 1
+    while True:
+        yield f"{base_name}_{n}{ext}"
+        n += 1
+
 
 async def save_file(f: UploadFile, key: Optional[str] = None) -> dict:
     """
     保存上传的文件到本地，并返回相关信息
+    内容按 sha256 存入对象库（相同内容只存一份），filename 是指向它的别名
     """
     # 确保目录存在
     os.makedirs(UPLOAD_DIR, exist_ok=True)
+    os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+    cas_store.ensure_store()
 
     # 取扩展名
     ext = os.path.splitext(f.filename or "")[1]
     if not ext:
         ext = ".jpg"
 
-    timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
-
-    # 生成文件名
-    if key:
-        base_name = key
-        filename = f"{base_name}{ext}"
-        file_path = os.path.join(UPLOAD_DIR, filename)
-
-        # 如果重名，加时间戳
-        if os.path.exists(file_path):
-            filename = f"{base_name}_{timestamp}{ext}"
-            file_path = os.path.join(UPLOAD_DIR, filename)
-    else:
-        filename = f"{timestamp}{ext}"
-        file_path = os.path.join(UPLOAD_DIR, filename)
-
-    # 读取文件内容
-    content = await f.read()
-    if not content:
+    # 先流式写入临时文件
+    tmp_path, size, sha256 = await _stream_to_temp(f)
+    if not size:
+        os.unlink(tmp_path)
         raise ValueError("上传文件内容为空")
 
-    # 写入磁盘
-    with open(file_path, "wb") as out:
-        out.write(content)
+    # mkstemp 默认 0600，改回普通文件权限；再收进对象库（已存在则去重）
+    # 生成文件名：重名且内容不同则换下一个候选名，相同内容直接复用已有别名
+    os.chmod(tmp_path, 0o644)
+    filename = await asyncio.to_thread(
+        cas_store.store_file, tmp_path, sha256, _candidate_names(key, ext, sha256)
+    )
 
     return {
         "message": "上传成功",
         "filename": filename,
         "url": f"/{UPLOAD_DIR}/{filename}",
+        "size": size,
+        "sha256": sha256,
     }
 
 
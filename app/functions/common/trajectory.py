@@ -0,0 +1,57 @@
+"""
+轨迹简化：Douglas-Peucker（按米计的容差）
+
+点坐标先投影到以首点为原点的局部平面（等距圆柱近似，城市尺度误差可忽略），
+再用栈代替递归，长轨迹也不会触发递归深度限制。
+"""
+import math
+
+_METERS_PER_DEG = 111320.0
+
+
+def _project(points: list[dict]) -> list[tuple[float, float]]:
+    lat0 = math.radians(points[0]["lat"])
+    kx = _METERS_PER_DEG * math.cos(lat0)
+    lon0, lat0_deg = points[0]["lon"], points[0]["lat"]
+    return [((p["lon"] - lon0) * kx, (p["lat"] - lat0_deg) * _METERS_PER_DEG) for p in points]
+
+
+def _seg_dist(p, a, b) -> float:
+    """点 p 到线段 ab 的距离"""
+    ax, ay = a
+    bx, by = b
+    px, py = p
+    dx, dy = bx - ax, by - ay
+    if dx == 0 and dy == 0:
+        return math.hypot(px - ax, py - ay)
+    t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / (dx * dx + dy * dy)))
+    return math.hypot(px - (ax + t * dx), py - (ay + t * dy))
+
+
+def simplify(points: list[dict], tolerance_m: float) -> list[dict]:
+    """
+    Douglas-Peucker 简化，保留首尾点；points 为按时间排序、含 lat/lon 的 dict
+    tolerance_m <= 0 时原样返回
+    """
+    n = len(points)
+    if n <= 2 or tolerance_m <= 0:
+        return list(points)
+
+    xy = _project(points)
+    keep = [False] * n
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        max_d, index = 0.0, -1
+        a, b = xy[first], xy[last]
+        for i in range(first + 1, last):
+            d = _seg_dist(xy[i], a, b)
+            if d > max_d:
+                max_d, index = d, i
+        if index != -1 and max_d > tolerance_m:
+            keep[index] = True
+            stack.append((first, index))
+            stack.append((index, last))
+
+    return [p for p, k in zip(points, keep) if k]
@@ -0,0 +1,28 @@
+import logging
+import os
+from dotenv import load_dotenv
+
+from app.db.aio_agenda import prune_tombstones
+from app.db.migrate import AGENDA_DB
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+AGENDA_TOMBSTONE_PRUNE_BATCH = int(os.getenv("AGENDA_TOMBSTONE_PRUNE_BATCH", "1000"))   # 每条 DELETE 最多删除的行数
+AGENDA_TOMBSTONE_PRUNE_MAX_BATCHES = int(os.getenv("AGENDA_TOMBSTONE_PRUNE_MAX_BATCHES", "100"))
+
+
+async def prune_tombstones_async():
+    """分批删除超过保留期的日程删除记录，一次删不完的留给下次"""
+    total = 0
+    try:
+        for _ in range(AGENDA_TOMBSTONE_PRUNE_MAX_BATCHES):
+            deleted = await prune_tombstones(AGENDA_TOMBSTONE_PRUNE_BATCH, AGENDA_DB)
+            total += deleted
+            if deleted < AGENDA_TOMBSTONE_PRUNE_BATCH:
+                break
+        if total:
+            logger.info(f"日程删除记录清理完成：删除 {total} 行")
+    except Exception as e:
+        logger.exception(f"日程删除记录清理失败（已删除 {total} 行）: {e}")
@@ -0,0 +1,33 @@
+import datetime
+import logging
+import os
+from dotenv import load_dotenv
+
+from app.db.aio_positions import compaction_groups, compact_group
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+POSITION_COMPACT_AFTER_DAYS = int(os.getenv("POSITION_COMPACT_AFTER_DAYS", "30"))      # 早于多少天的原始点参与压缩
+POSITION_COMPACT_TOLERANCE_M = float(os.getenv("POSITION_COMPACT_TOLERANCE_M", "20"))  # 简化容差（米）
+POSITION_COMPACT_BATCH = int(os.getenv("POSITION_COMPACT_BATCH", "200"))               # 每次最多处理的 (name, 日期) 分组数
+
+
+async def compact_positions_async():
+    """
+    把旧的原始位置点按 (name, 日期) 做 Douglas-Peucker 简化，
+    写入 position_summary 并删除原始点；每次只处理一批分组，剩下的留给下次
+    """
+    # 只压缩完整的天：cutoff 取日期，当天及之后的点保留原样
+    cutoff = (datetime.datetime.now() - datetime.timedelta(days=POSITION_COMPACT_AFTER_DAYS)).date()
+    try:
+        groups = await compaction_groups(cutoff, POSITION_COMPACT_BATCH)
+        raw_total = kept_total = 0
+        for name, day in groups:
+            raw, kept = await compact_group(name, day, POSITION_COMPACT_TOLERANCE_M)
+            raw_total += raw
+            kept_total += kept
+        logger.info(f"轨迹压缩完成：{len(groups)} 组，{raw_total} 个点压缩为 {kept_total} 个")
+    except Exception as e:
+        logger.exception(f"轨迹压缩失败: {e}")
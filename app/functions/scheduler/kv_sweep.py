@@ -0,0 +1,31 @@
+import logging
+import os
+from dotenv import load_dotenv
+
+from app.db.aio_kv_tools import delete_expired
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+KV_SWEEP_INTERVAL_MIN = int(os.getenv("KV_SWEEP_INTERVAL_MIN", "10"))   # 清理间隔（分钟）
+KV_SWEEP_BATCH = int(os.getenv("KV_SWEEP_BATCH", "1000"))               # 每条 DELETE 最多删除的行数
+KV_SWEEP_MAX_BATCHES = int(os.getenv("KV_SWEEP_MAX_BATCHES", "50"))     # 每次最多执行的 DELETE 条数
+
+
+async def sweep_kv_async():
+    """
+    分批删除 kv 表里已过期的行，每批一个短事务，避免长时间锁表；
+    一次删不完的留给下次
+    """
+    total = 0
+    try:
+        for _ in range(KV_SWEEP_MAX_BATCHES):
+            deleted = await delete_expired(KV_SWEEP_BATCH)
+            total += deleted
+            if deleted < KV_SWEEP_BATCH:
+                break
+        if total:
+            logger.info(f"kv 过期清理完成：删除 {total} 行")
+    except Exception as e:
+        logger.exception(f"kv 过期清理失败（已删除 {total} 行）: {e}")
@@ -1,6 +1,10 @@
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from app.functions.common.proxy_manager import ProxyManager
+from app.functions.scheduler.compaction import compact_positions_async
+from app.functions.scheduler.kv_sweep import sweep_kv_async, KV_SWEEP_INTERVAL_MIN
+from app.functions.scheduler.agenda_prune import prune_tombstones_async
 import asyncio
 import logging
 from pytz import timezone
@@ -40,6 +44,29 @@ def start_scheduler():
         replace_existing=True,
     )
 
+    scheduler.add_job(
+        compact_positions_async,
+        CronTrigger(hour=3, minute=30),  # 每天凌晨压缩旧轨迹
+        id="position_compaction_job",
+        replace_existing=True,
+    )
+
+    scheduler.add_job(
+        prune_tombstones_async,
+        CronTrigger(hour=4, minute=0),  # 每天清理过期的日程删除记录
+        id="agenda_tombstone_prune_job",
+        replace_existing=True,
+    )
+
+    scheduler.add_job(
+        sweep_kv_async,
+        IntervalTrigger(minutes=KV_SWEEP_INTERVAL_MIN),  # 定期删除过期的 kv
+        id="kv_sweep_job",
+        replace_existing=True,
+        max_instances=1,
+        coalesce=True,
+    )
+
     scheduler.start()
 
 def qiandao():
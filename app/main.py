@@ -2,20 +2,29 @@ from fastapi import FastAPI
 from app.api.routes import router
 import uvicorn
 from fastapi.staticfiles import StaticFiles
-from app.db.init import init_bills_db, init_position_db, init_kv_db, init_agenda_db
+from app.db.migrate import run_migrations
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+import asyncio
+import os
 import time
 import uuid
 from fastapi import FastAPI, Request
 from starlette.middleware.base import BaseHTTPMiddleware
 from app.functions.scheduler.qiandao import start_scheduler
+from app.db.pool import close_all_pools
+from app.db.aio_pool import close_all_aio_pools
+from app.functions.alm.llm_client import close_client
+from app.functions.alm.image_prep import shutdown_executor
+from app.functions.common.bill_jobs import start_workers, stop_workers
+from app.functions.common.position_buffer import start_flusher, stop_flusher
+from app.functions.common.save_file import check_content_length, FileTooLarge, LengthRequired
+from app.core.logger import log
 from uvicorn.config import LOGGING_CONFIG    
 LOGGING_CONFIG["formatters"]["default"]["fmt"] = "%(asctime)s - %(levelprefix)s %(message)s"
 
-# init_bills_db()
-# init_position_db()
-# init_kv_db()
-# init_agenda_db('zdh')
+# 建库建表、加索引等统一由 app/db/migrate.py 按版本执行
+RUN_MIGRATIONS = os.getenv("RUN_MIGRATIONS", "1") == "1"
 app = FastAPI()
 
 
@@ -31,9 +40,43 @@ app.add_middleware(
 )
 app.include_router(router)
 
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    # 在 FastAPI 解析 multipart 之前按 Content-Length 拒绝超大上传
+    if request.method == "POST" and request.url.path == "/save_file":
+        try:
+            check_content_length(request.headers.get("content-length"))
+        except LengthRequired as e:
+            return JSONResponse(status_code=411, content={"detail": str(e)})
+        except FileTooLarge as e:
+            return JSONResponse(status_code=413, content={"detail": str(e)})
+    return await call_next(request)
+
+
 @app.on_event("startup")
 async def startup_event():
+    if RUN_MIGRATIONS:
+        try:
+            applied = await asyncio.to_thread(run_migrations)
+            if applied:
+                log("已执行迁移: " + ", ".join(applied))
+        except Exception as e:
+            # 表结构不完整时后台任务和接口都会出错，直接让启动失败
+            log(f"数据库迁移失败，停止启动: {e}", "ERROR")
+            raise
     start_scheduler()
+    await start_workers()
+    start_flusher()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await stop_workers()
+    await stop_flusher()
+    close_all_pools()
+    await close_all_aio_pools()
+    await close_client()
+    shutdown_executor()
 
 if __name__ == "__main__":
     uvicorn.run("app.main:app", host="0.0.0.0", port=8888, reload=True)
\ No newline at end of file
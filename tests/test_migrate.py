@@ -0,0 +1,28 @@
+"""
+app.db.migrate 在导入时校验迁移列表，服务、定时任务和手动迁移都会导入它，
+导入失败会让它们全部起不来
+"""
+import pytest
+
+pytest.importorskip("pymysql")
+pytest.importorskip("dotenv")
+
+from app.db import migrate
+
+
+def test_import_and_versions_unique_per_list():
+    for migrations in (migrate.MIGRATIONS, migrate.AGENDA_MIGRATIONS):
+        versions = [v for v, _, _ in migrations]
+        assert len(versions) == len(set(versions))
+
+
+def test_plan_creates_agenda_table_before_its_indexes(monkeypatch):
+    monkeypatch.setattr(migrate, "AGENDA_TABLES", ["zdh"])
+    plan = migrate._planned()
+    targets = [(v, t) for v, t, _, _, _ in plan]
+    assert len(targets) == len(set(targets))
+
+    agenda_fns = [fn for _, t, _, fn, _ in plan if t]
+    assert agenda_fns[0] is migrate._agenda_table
+    # 合并后的计划按版本号递增执行
+    assert [v for v, _, _, _, _ in plan] == sorted(v for v, _, _, _, _ in plan)